@@ -0,0 +1,49 @@
+"""
+Seleccion ponderada en O(1) con el metodo alias (Vose).
+La tabla se construye una vez por record y version del conjunto healthy
+(forma parte del plan compilado, ver resolve_plan): cada seleccion cuesta
+un numero aleatorio y un acceso a la tabla, en vez de sumar pesos y recorrer
+la lista en cada query.
+"""
+
+import random
+from typing import Callable, Sequence
+
+
+class AliasTable:
+    """Tabla alias de Vose sobre una lista de items con pesos no negativos."""
+    __slots__ = ("items", "prob", "alias", "n")
+
+    def __init__(self, items: Sequence, weights: Sequence[float]):
+        n = len(items)
+        weights = [max(0.0, float(w)) for w in weights]
+        total = sum(weights)
+        if total <= 0:
+            weights, total = [1.0] * n, float(n)  # todos en 0: uniforme
+        scaled = [w * n / total for w in weights]
+        prob = [0.0] * n
+        alias = [0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Lo que queda (por redondeo) tiene probabilidad 1
+        for i in large + small:
+            prob[i] = 1.0
+        self.items = tuple(items)
+        self.prob = prob
+        self.alias = alias
+        self.n = n
+
+    def sample(self, rand: Callable[[], float] = random.random):
+        # Un solo numero: la parte entera elige la columna, la fraccionaria el lado
+        u = rand() * self.n
+        i = int(u)
+        if i >= self.n:  # rand() == 1.0 con generadores externos
+            i = self.n - 1
+        return self.items[i] if u - i < self.prob[i] else self.items[self.alias[i]]
@@ -0,0 +1,235 @@
+"""
+Cache de respuestas upstream para /api/dns_resolver.
+Clave: (qname, qtype, qclass, bit DO). Respeta el TTL minimo de la seccion
+answer; NXDOMAIN y NODATA se cachean con el SOA de authority (RFC 2308).
+En cada hit se reescribe el ID de transaccion, la pregunta (mismo case que
+la query) y los TTLs restantes. Tamaño acotado con desalojo LRU.
+
+- Refresh-ahead: should_prefetch() marca (una sola vez por entrada) las
+  entradas populares en el ultimo tramo de su TTL para refrescarlas antes de
+  que venzan.
+- Serve-stale (RFC 8767): las entradas vencidas se conservan stale_max_s mas;
+  get_stale() las entrega con un TTL corto cuando el upstream no responde.
+"""
+
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    import dns_wire
+    from config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_TTL, ANSWER_CACHE_NEGATIVE_MAX_TTL
+    from config import ANSWER_CACHE_PREFETCH_FRACTION, ANSWER_CACHE_PREFETCH_MIN_HITS
+    from config import ANSWER_CACHE_STALE_MAX_S, ANSWER_CACHE_STALE_TTL, ANSWER_CACHE_STALE_RECHECK_S
+except ImportError:
+    from . import dns_wire
+    from .config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_TTL, ANSWER_CACHE_NEGATIVE_MAX_TTL
+    from .config import ANSWER_CACHE_PREFETCH_FRACTION, ANSWER_CACHE_PREFETCH_MIN_HITS
+    from .config import ANSWER_CACHE_STALE_MAX_S, ANSWER_CACHE_STALE_TTL, ANSWER_CACHE_STALE_RECHECK_S
+
+CacheKey = Tuple[str, int, int, bool]
+
+
+class _Entry:
+    __slots__ = ("response", "stored_at", "ttl", "expires_at", "question_end", "ttl_fields",
+                 "hits", "prefetching", "failed_at")
+
+    def __init__(self, response: bytes, stored_at: float, ttl: int, question_end: int, ttl_fields: list):
+        self.response = response
+        self.stored_at = stored_at
+        self.ttl = ttl
+        self.expires_at = stored_at + ttl
+        self.question_end = question_end
+        self.ttl_fields = ttl_fields
+        self.hits = 0
+        self.prefetching = False
+        self.failed_at: Optional[float] = None  # ultima vez que el upstream fallo al refrescarla
+
+
+def make_key(query: bytes) -> Optional[Tuple[CacheKey, int]]:
+    """Retorna (clave, fin de la pregunta) o None si la query no es cacheable."""
+    try:
+        if dns_wire.get_opcode(query) != 0 or dns_wire.get_flags(query) & dns_wire.FLAG_QR:
+            return None
+        question = dns_wire.parse_question(query)
+    except (ValueError, IndexError):
+        return None
+    key = (question.qname, question.qtype, question.qclass, dns_wire.has_do_bit(query))
+    return key, question.end
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int, max_ttl: int, negative_max_ttl: int,
+                 prefetch_fraction: float = ANSWER_CACHE_PREFETCH_FRACTION,
+                 prefetch_min_hits: int = ANSWER_CACHE_PREFETCH_MIN_HITS,
+                 stale_max_s: int = ANSWER_CACHE_STALE_MAX_S, stale_ttl: int = ANSWER_CACHE_STALE_TTL,
+                 stale_recheck_s: float = ANSWER_CACHE_STALE_RECHECK_S):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.negative_max_ttl = negative_max_ttl
+        self.prefetch_fraction = prefetch_fraction
+        self.prefetch_min_hits = prefetch_min_hits
+        self.stale_max_s = max(0, stale_max_s)
+        self.stale_ttl = stale_ttl
+        self.stale_recheck_s = stale_recheck_s
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.expired = 0
+        self.prefetches = 0
+        self.stale_served = 0
+
+    def get(self, key: CacheKey, query: bytes, question_end: int) -> Optional[bytes]:
+        """Respuesta cacheada adaptada a la query, o None (miss)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= now:
+                # Vencida: se conserva para serve-stale hasta stale_max_s despues
+                if now >= entry.expires_at + self.stale_max_s:
+                    del self._entries[key]
+                    self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry.hits += 1
+        return self._render(entry, query, question_end, now)
+
+    def should_prefetch(self, key: CacheKey) -> bool:
+        """
+        True (una sola vez por entrada) si la entrada es popular y le queda menos
+        de prefetch_fraction de su TTL: el llamador debe refrescarla en background.
+        """
+        if self.prefetch_fraction <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.prefetching or entry.hits < self.prefetch_min_hits:
+                return False
+            remaining = entry.expires_at - now
+            if remaining <= 0 or remaining > entry.ttl * self.prefetch_fraction:
+                return False
+            entry.prefetching = True
+            self.prefetches += 1
+        return True
+
+    def _stale_entry(self, key: CacheKey, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at > now or now >= entry.expires_at + self.stale_max_s:
+            return None
+        return entry
+
+    def has_stale(self, key: CacheKey) -> bool:
+        with self._lock:
+            return self._stale_entry(key, time.monotonic()) is not None
+
+    def get_stale(self, key: CacheKey, query: bytes, question_end: int) -> Optional[bytes]:
+        """Respuesta vencida (RFC 8767) con TTL stale_ttl, o None si no hay."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._stale_entry(key, now)
+            if entry is None:
+                return None
+            self.stale_served += 1
+        return self._render(entry, query, question_end, now, fixed_ttl=self.stale_ttl)
+
+    def mark_failed(self, key: CacheKey):
+        """El upstream no pudo refrescar la entrada (ver recently_failed)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.failed_at = time.monotonic()
+
+    def recently_failed(self, key: CacheKey) -> bool:
+        """True si la entrada esta vencida y su refresco fallo hace menos de stale_recheck_s."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._stale_entry(key, now)
+            return entry is not None and entry.failed_at is not None and now - entry.failed_at < self.stale_recheck_s
+
+    @staticmethod
+    def _render(entry: _Entry, query: bytes, question_end: int, now: float, fixed_ttl: Optional[int] = None) -> bytes:
+        out = bytearray(entry.response)
+        # ID de la query actual
+        out[0:2] = query[0:2]
+        # Pregunta con el mismo case que envio el cliente (DNS 0x20)
+        if question_end == entry.question_end:
+            out[dns_wire.HEADER_LEN:question_end] = query[dns_wire.HEADER_LEN:question_end]
+        # TTLs decrementados por el tiempo que lleva en cache (o fijos si esta vencida)
+        elapsed = int(now - entry.stored_at)
+        for off, ttl in entry.ttl_fields:
+            struct.pack_into("!I", out, off, fixed_ttl if fixed_ttl is not None else max(0, ttl - elapsed))
+        return bytes(out)
+
+    def put(self, key: CacheKey, response: bytes) -> bool:
+        """Guarda una respuesta upstream si es cacheable. Retorna True si se guardo."""
+        try:
+            flags = dns_wire.get_flags(response)
+            if not flags & dns_wire.FLAG_QR or flags & dns_wire.FLAG_TC:
+                return False
+            rcode = dns_wire.get_rcode(response)
+            if rcode not in (dns_wire.RCODE_NOERROR, dns_wire.RCODE_NXDOMAIN):
+                return False
+            question = dns_wire.parse_question(response)
+            if (question.qname, question.qtype, question.qclass) != key[:3]:
+                return False
+            scan = dns_wire.scan_ttls(response, question.end)
+        except (ValueError, IndexError, struct.error):
+            return False
+
+        if rcode == dns_wire.RCODE_NOERROR and dns_wire.answer_count(response) > 0:
+            if scan.min_answer_ttl is None:
+                return False
+            ttl = min(scan.min_answer_ttl, self.max_ttl)
+        else:
+            # NXDOMAIN / NODATA: sin SOA no se cachea (RFC 2308, seccion 5)
+            if scan.negative_ttl is None:
+                return False
+            ttl = min(scan.negative_ttl, self.negative_max_ttl)
+        if ttl <= 0:
+            return False
+
+        entry = _Entry(response, time.monotonic(), ttl, question.end, scan.ttl_fields)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.inserts += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "inserts": self.inserts,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "prefetches": self.prefetches,
+            "stale_served": self.stale_served,
+        }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_TTL, ANSWER_CACHE_NEGATIVE_MAX_TTL)
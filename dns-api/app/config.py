@@ -5,13 +5,105 @@ from dotenv import load_dotenv
 # Load environment variables from .env file in parent directory
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
-UPSTREAM_DNS = os.getenv("UPSTREAM_DNS", "8.8.8.8")
+# Servidores upstream separados por coma: host[:puerto], IPv6 entre corchetes.
+# Cada query va al de menor RTT suavizado (penalizado por su tasa de fallas);
+# si no responde dentro de su p95 (acotado a [UPSTREAM_HEDGE_MIN_MS,
+# UPSTREAM_HEDGE_MAX_MS]) se envia una copia al siguiente, hasta
+# UPSTREAM_HEDGE_MAX copias por query (0 = sin hedging). Gana la primera
+# respuesta valida.
+UPSTREAM_DNS = os.getenv("UPSTREAM_DNS", "8.8.8.8,1.1.1.1")
+UPSTREAM_HEDGE_MAX = int(os.getenv("UPSTREAM_HEDGE_MAX", "1"))
+UPSTREAM_HEDGE_MIN_MS = float(os.getenv("UPSTREAM_HEDGE_MIN_MS", "10"))
+UPSTREAM_HEDGE_MAX_MS = float(os.getenv("UPSTREAM_HEDGE_MAX_MS", "300"))
+UPSTREAM_FAILURE_PENALTY_MS = float(os.getenv("UPSTREAM_FAILURE_PENALTY_MS", "500"))
 DEFAULT_TIMEOUT_MS = int(os.getenv("DEFAULT_TIMEOUT_MS", "2000"))
+# Sockets UDP persistentes por servidor upstream (por worker)
+UPSTREAM_UDP_POOL_SIZE = int(os.getenv("UPSTREAM_UDP_POOL_SIZE", "4"))
+# Conexiones TCP persistentes (fallback de respuestas truncadas)
+UPSTREAM_TCP_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_TCP_MAX_CONNECTIONS", "2"))
+UPSTREAM_TCP_MAX_INFLIGHT = int(os.getenv("UPSTREAM_TCP_MAX_INFLIGHT", "32"))
+UPSTREAM_TCP_IDLE_TIMEOUT_S = float(os.getenv("UPSTREAM_TCP_IDLE_TIMEOUT_S", "10"))
 PORT = int(os.getenv("PORT", "8080"))
 
+# Servidor DNS nativo (run_dns.py): UDP/TCP sin pasar por HTTP
+DNS_LISTEN_HOST = os.getenv("DNS_LISTEN_HOST", "0.0.0.0")
+DNS_LISTEN_PORT = int(os.getenv("DNS_LISTEN_PORT", "5353"))
+DNS_LISTEN_WORKERS = int(os.getenv("DNS_LISTEN_WORKERS", "1"))
+DNS_TCP_IDLE_TIMEOUT_S = float(os.getenv("DNS_TCP_IDLE_TIMEOUT_S", "10"))
+
+# Almacenamiento de records e ip_to_country: firestore | sqlite.
+# SQLite (modo WAL) es un archivo local compartido por los workers; los cambios
+# de otros procesos se detectan cada SQLITE_WATCH_INTERVAL_S.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/dns.sqlite3")
+SQLITE_WATCH_INTERVAL_S = float(os.getenv("SQLITE_WATCH_INTERVAL_S", "0.2"))
+
+# Archivo binario compilado de rangos IP->pais (mmap compartido entre workers).
+# Vacio = indice en memoria por proceso.
+GEO_DB_PATH = os.getenv("GEO_DB_PATH", "")
+GEO_DB_RELOAD_INTERVAL_S = float(os.getenv("GEO_DB_RELOAD_INTERVAL_S", "5"))
+
+# Contadores round-robin de records multi. Con RR_STATE_PATH se comparten entre
+# workers via mmap; vacio = contador por proceso. Checkpoint de rr_index al
+# storage cada RR_CHECKPOINT_INTERVAL_S (0 = nunca). rr_index no cuenta para el
+# ETag/version de GET /api/records ni recompila el plan del record: el checkpoint
+# no invalida a los clientes que hacen polling, a cambio de que un 304 o un delta
+# puedan traer un rr_index viejo (es solo la semilla de la rotacion).
+RR_STATE_PATH = os.getenv("RR_STATE_PATH", "")
+RR_STATE_SLOTS = int(os.getenv("RR_STATE_SLOTS", "4096"))
+RR_CHECKPOINT_INTERVAL_S = float(os.getenv("RR_CHECKPOINT_INTERVAL_S", "0"))
+
+# Ingesta de /api/update_health: flush en lotes, deadband de RTT y refresco de last_check
+HEALTH_FLUSH_INTERVAL_S = float(os.getenv("HEALTH_FLUSH_INTERVAL_S", "1"))
+HEALTH_RTT_DEADBAND_MS = float(os.getenv("HEALTH_RTT_DEADBAND_MS", "5"))
+HEALTH_REFRESH_INTERVAL_S = float(os.getenv("HEALTH_REFRESH_INTERVAL_S", "30"))
+# Flushes fallidos tras los que se descartan los campos en cola de un record
+HEALTH_MAX_ATTEMPTS = int(os.getenv("HEALTH_MAX_ATTEMPTS", "10"))
+
+# Cache de la coleccion records mantenido por un listener on_snapshot
+RECORD_CACHE_ENABLED = os.getenv("RECORD_CACHE_ENABLED", "1") == "1"
+RECORD_CACHE_CHECK_INTERVAL_S = float(os.getenv("RECORD_CACHE_CHECK_INTERVAL_S", "5"))
+# Un fqdn escrito por este proceso se lee del storage hasta que llega su evento o pasa este tiempo
+# (una escritura que no cambia el documento no genera evento)
+RECORD_CACHE_DIRTY_TIMEOUT_S = float(os.getenv("RECORD_CACHE_DIRTY_TIMEOUT_S", "5"))
+# Borrados que recuerda el feed de GET /api/records?since= (mas viejos = respuesta completa)
+RECORD_FEED_MAX_TOMBSTONES = int(os.getenv("RECORD_FEED_MAX_TOMBSTONES", "10000"))
+# Versiones recientes (por proyeccion) desde las que ?since= puede responder solo los cambios
+RECORD_FEED_HISTORY = int(os.getenv("RECORD_FEED_HISTORY", "4096"))
+# Proyecciones (?fields=) distintas con feed propio; la menos usada se descarta
+RECORD_FEED_MAX_PROJECTIONS = int(os.getenv("RECORD_FEED_MAX_PROJECTIONS", "8"))
+
+# Cache de decisiones geo/roundtrip por (fqdn, prefijo del cliente) (0 entradas = deshabilitado)
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "50000"))
+DECISION_CACHE_TTL_S = float(os.getenv("DECISION_CACHE_TTL_S", "60"))
+
+# Cache de respuestas upstream de /api/dns_resolver (0 entradas = deshabilitado)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+ANSWER_CACHE_MAX_TTL = int(os.getenv("ANSWER_CACHE_MAX_TTL", "86400"))
+ANSWER_CACHE_NEGATIVE_MAX_TTL = int(os.getenv("ANSWER_CACHE_NEGATIVE_MAX_TTL", "10800"))
+# Refresh-ahead: una entrada con al menos PREFETCH_MIN_HITS hits se refresca en
+# background cuando le queda menos de PREFETCH_FRACTION de su TTL (0 = deshabilitado)
+ANSWER_CACHE_PREFETCH_FRACTION = float(os.getenv("ANSWER_CACHE_PREFETCH_FRACTION", "0.1"))
+ANSWER_CACHE_PREFETCH_MIN_HITS = int(os.getenv("ANSWER_CACHE_PREFETCH_MIN_HITS", "2"))
+ANSWER_CACHE_PREFETCH_MAX_INFLIGHT = int(os.getenv("ANSWER_CACHE_PREFETCH_MAX_INFLIGHT", "32"))
+# Serve-stale (RFC 8767): respuestas vencidas hace menos de STALE_MAX_S se usan
+# (con TTL STALE_TTL) si el upstream no responde en STALE_WAIT_MS o falla; tras
+# una falla se sirven sin consultar durante STALE_RECHECK_S (0 = deshabilitado)
+ANSWER_CACHE_STALE_MAX_S = int(os.getenv("ANSWER_CACHE_STALE_MAX_S", "86400"))
+ANSWER_CACHE_STALE_TTL = int(os.getenv("ANSWER_CACHE_STALE_TTL", "30"))
+ANSWER_CACHE_STALE_WAIT_MS = int(os.getenv("ANSWER_CACHE_STALE_WAIT_MS", "1800"))
+ANSWER_CACHE_STALE_RECHECK_S = float(os.getenv("ANSWER_CACHE_STALE_RECHECK_S", "30"))
+
+# Logging: nivel global, niveles por categoria ("resolve=WARNING,health=DEBUG"),
+# formato text|json, tamaño de la cola y tope de lineas por query por segundo
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUERY_RATE_PER_S = float(os.getenv("LOG_QUERY_RATE_PER_S", "20"))
+
 # Load Firebase credentials from environment variable
 firebase_cred_str = os.getenv("FIREBASE_CRED_JSON")
-if firebase_cred_str:
-    FIREBASE_CRED_JSON = json.loads(firebase_cred_str)
+FIREBASE_CRED_JSON = json.loads(firebase_cred_str) if firebase_cred_str else None
     
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "")
\ No newline at end of file
@@ -6,6 +6,7 @@ Inserta records + health usando create_record() con geolocalización automática
 - Ejecuta: python create_tests.py
 """
 
+import asyncio
 import time
 from firebase_client import get_client
 
@@ -127,7 +128,7 @@ def upload_all_with_create_record(samples):
         print(f"📝 Creating record: {fqdn}")
         
         # 1) Crear record con geolocalización automática
-        if create_record(record_data):
+        if asyncio.run(create_record(record_data)):
             print(f"✅ Record created: {fqdn}")
             success_count += 1
 
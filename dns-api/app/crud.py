@@ -1,18 +1,34 @@
 
+import asyncio
+
 try: 
-    from firebase_client import get_client
+    from storage import get_storage
 except ImportError:
-    from .firebase_client import get_client
+    from .storage import get_storage
 
 try: 
-    from utils import get_geo_location_from_db
+    from utils import get_geo_location_from_db_async, int_to_ip, int_to_ip6, ip_range_doc, parse_ip
+except ImportError:
+    from .utils import get_geo_location_from_db_async, int_to_ip, int_to_ip6, ip_range_doc, parse_ip
+
+try:
+    import geo_index
+    import record_cache
+except ImportError:
+    from . import geo_index
+    from . import record_cache
+
+try:
+    from logs import get_logger
 except ImportError:
-    from .utils import get_geo_location_from_db
+    from .logs import get_logger
+
+logger = get_logger("crud")
 
 
-def create_record(data: dict) -> bool:
+async def create_record(data: dict) -> bool:
     """
-    Crea un record DNS en Firestore con geolocalizacion para los targets.
+    Crea un record DNS con geolocalizacion para los targets.
     
     Estructura esperada:
     {
@@ -30,115 +46,146 @@ def create_record(data: dict) -> bool:
         "rr_index": 0 (para tipo multi)
     }
     """
-    client = get_client()
-    if not client:
-        return False
-    
     try:
         # Agregar informacion de geolocalizacion a cada target
         for target in data.get("targets", []):
             if "ip" in target:
-                location_info = get_geo_location_from_db(target["ip"])
+                location_info = await get_geo_location_from_db_async(target["ip"])
                 target["geo_location"] = {
                     "country": location_info.get("country", "unknown"),
                     "region": location_info.get("region", "unknown")
                 }
-        # Guardar el record en Firestore
-        client.collection("records").document(data.get("fqdn")).set(data)
+        # Guardar el record
+        await get_storage().set_record_async(data.get("fqdn"), data)
+        record_cache.invalidate(data.get("fqdn"))
         return True
         
     except Exception as e:
-        print(f"Error creating record: {e}")
+        logger.error("Error creating record: %s", e)
         return False
     
-def get_record(fqdn: str):
-    """Obtiene un record DNS por su FQDN."""
-    client = get_client()
-    if not client:
-        return None
-    doc = client.collection("records").document(fqdn).get()
-    return doc.to_dict() if doc.exists else None
+async def get_record(fqdn: str):
+    """
+    Obtiene un record DNS por su FQDN.
+    Lee del cache en memoria; solo va al storage ante un miss.
+    El dict retornado puede ser compartido por el cache: no modificarlo.
+    """
+    hit, record = record_cache.lookup(fqdn)
+    if hit:
+        return record
+
+    token = record_cache.read_token()
+    record = await get_storage().get_record_async(fqdn)
+    record_cache.store(fqdn, record, token)
+    return record
 
-def get_all_records() -> list:
+async def get_records(fqdns: list) -> dict:
+    """
+    Obtiene varios records a la vez: {fqdn: record | None}.
+    Los que no estan en cache se leen con una sola llamada al storage.
+    """
+    found = {}
+    missing = []
+    for fqdn in dict.fromkeys(fqdns):
+        hit, record = record_cache.lookup(fqdn)
+        if hit:
+            found[fqdn] = record
+        else:
+            missing.append(fqdn)
+
+    if missing:
+        token = record_cache.read_token()
+        for fqdn, record in (await get_storage().get_records_async(missing)).items():
+            found[fqdn] = record
+            record_cache.store(fqdn, record, token)
+    return found
+
+async def get_all_records() -> list:
     """Obtiene todos los records DNS de la base de datos."""
-    client = get_client()
-    if not client:
-        return []
-    
+    cached = record_cache.all_records()
+    if cached is not None:
+        return cached
+
     try:
-        docs = client.collection("records").stream()
-        records = [doc.to_dict() for doc in docs]
-        return records
+        return await get_storage().list_records_async()
         
     except Exception as e:
-        print(f"Error retrieving records: {e}")
+        logger.error("Error retrieving records: %s", e)
         return []
     
-def get_record_by_fqdn(fqdn: str) -> dict | None:
+async def get_records_snapshot(fields=None):
+    """
+    (version, records) de la coleccion; version es el digest de la proyeccion
+    fields (ver record_cache). Con el cache sincronizado sale de memoria; si
+    no, se lee del storage.
+    """
+    snap = record_cache.snapshot(fields)
+    if snap is not None:
+        return snap
+    records = await get_all_records()
+    return record_cache.digest_of(records, fields), records
+
+async def get_records_since(version: str, fields=None):
+    """
+    (version, full, records, borrados) cuya proyeccion cambio despues de
+    version (ver record_cache.changes_since). Sin cache sincronizado: todo.
+    """
+    delta = record_cache.changes_since(version, fields)
+    if delta is not None:
+        return delta
+    records = await get_all_records()
+    return record_cache.digest_of(records, fields), True, records, []
+
+async def get_record_by_fqdn(fqdn: str) -> dict | None:
     """Obtiene un record DNS por su FQDN (alias de get_record)."""
-    client = get_client()
-    if not client:
-        return None
-    
     try:
-        doc = client.collection("records").document(fqdn).get()
-        return doc.to_dict() if doc.exists else None
+        return await get_record(fqdn)
         
     except Exception as e:
-        print(f"Error retrieving record for {fqdn}: {e}")
+        logger.error("Error retrieving record for %s: %s", fqdn, e)
         return None
     
-def delete_record(fqdn: str) -> bool:
+async def delete_record(fqdn: str) -> bool:
     """Elimina un record DNS por su FQDN."""
-    client = get_client()
-    if not client:
-        return False
-    
     try:
-        client.collection("records").document(fqdn).delete()
+        await get_storage().delete_record_async(fqdn)
+        record_cache.invalidate(fqdn)
         return True
         
     except Exception as e:
-        print(f"Error deleting record for {fqdn}: {e}")
+        logger.error("Error deleting record for %s: %s", fqdn, e)
         return False
 
-def delete_all_records():
+async def delete_all_records():
     """Elimina todos los records DNS de la base de datos."""
-    client = get_client()
-    if not client:
-        return False
-    
     try:
-        docs = client.collection("records").stream()
-        for doc in docs:
-            doc.reference.delete()
+        # Borrado masivo por lotes: fuera del event loop
+        await asyncio.to_thread(get_storage().delete_all_records)
+        record_cache.invalidate()
         return True
         
     except Exception as e:
-        print(f"Error deleting all records: {e}")
+        logger.error("Error deleting all records: %s", e)
         return False
 
-def update_record(fqdn: str, updates: dict) -> bool:
+async def update_record(fqdn: str, updates: dict) -> bool:
     """Actualiza campos de un record DNS existente."""
-    client = get_client()
-    if not client:
-        return False
-    
     try:
-        client.collection("records").document(fqdn).update(updates)
+        await get_storage().update_record_async(fqdn, updates)
+        record_cache.invalidate(fqdn)
         return True
         
     except Exception as e:
-        print(f"Error updating record for {fqdn}: {e}")
+        logger.error("Error updating record for %s: %s", fqdn, e)
         return False
 
 
 
 
 
-def create_ip_to_country(data: dict) -> bool:
+async def create_ip_to_country(data: dict) -> bool:
     """
-    Crea un mapeo de rango IP a pais en Firestore.
+    Crea un mapeo de rango IP a pais.
     
     Estructura esperada:
     {
@@ -148,87 +195,86 @@ def create_ip_to_country(data: dict) -> bool:
     }
     
     Genera documento con ID: range_{start_int}_{end_int}
+    (IPv6: range6_{start_hex}_{end_hex}, ver utils.ip_range_doc)
     """
-    client = get_client()
-    if not client:
-        return False
-    
     try:
         start_ip = data.get("start_ip")
         end_ip = data.get("end_ip")
         country = data.get("country")
         
         if not start_ip or not end_ip:
-            print("Error: start_ip y end_ip son requeridos")
+            logger.error("start_ip y end_ip son requeridos")
             return False
         
-        def ip_to_int(ip: str) -> int:
-            a, b, c, d = map(int, ip.split("."))
-            return (a << 24) | (b << 16) | (c << 8) | d
-        
-        s = ip_to_int(start_ip)
-        e = ip_to_int(end_ip)
-        doc_id = f"range_{s}_{e}"
+        doc_id, payload = ip_range_doc(start_ip, end_ip, country)
         
-        payload = {
-            "range_start": s,
-            "range_end": e,
-            "start_ip": start_ip,
-            "end_ip": end_ip,
-            "country": country
-        }
-        
-        client.collection("ip_to_country").document(doc_id).set(payload)
+        await get_storage().set_ip_range_async(doc_id, payload)
         return True
         
     except Exception as e:
-        print(f"Error creating ip_to_country: {e}")
+        logger.error("Error creating ip_to_country: %s", e)
         return False
 
-def get_ip_to_country(ip_or_id: str):
+async def get_ip_to_country(ip_or_id: str):
     """
-    Busca el mapeo IP->pais por IP (ej: "8.8.8.8") o por ID de documento (ej: "range_134744072_134744327").
-    Si es una IP, busca el rango que la contiene.
+    Busca el mapeo IP->pais por IP (ej: "8.8.8.8" o "2001:db8::1") o por ID de documento
+    (ej: "range_134744072_134744327"). Si es una IP, busca el rango que la contiene.
+
+    Por IP responde desde el indice en memoria de geo_index solo si es el
+    indice por proceso (sin GEO_DB_PATH) y este worker no tiene una
+    reconstruccion pendiente por una escritura propia; con el archivo
+    compilado (GEO_DB_PATH, el default en Docker) los rangos estan fusionados
+    y no identifican documentos, asi que siempre se consulta el storage. Las
+    escrituras hechas por otro worker no llegan al indice por proceso de este
+    hasta que lo reconstruye.
     """
-    client = get_client()
-    if not client:
-        return None
-    
     try:
-        # Si contiene punto, es una IP
-        if "." in ip_or_id:
-            def ip_to_int(ip: str) -> int:
-                a, b, c, d = map(int, ip.split("."))
-                return (a << 24) | (b << 16) | (c << 8) | d
-            
-            ip_int = ip_to_int(ip_or_id)
-            
-            # Buscar por range_start <= ip_int, ordenar descendente y validar range_end
-            from google.cloud import firestore
-            docs = list(
-                client.collection("ip_to_country")
-                .where("range_start", "<=", ip_int)
-                .order_by("range_start", direction=firestore.Query.DESCENDING)
-                .limit(10)
-                .stream()
-            )
+        if _is_ip(ip_or_id):
+            version, ip_int = parse_ip(ip_or_id)
+
+            # Camino rapido: indice en memoria compartido con la geolocalizacion
+            # (el archivo compilado fusiona rangos, asi que no sirve para ubicar documentos;
+            # tras un create/update/delete propio se consulta el storage hasta recargarlo)
+            index = geo_index.get_index()
+            if index is not None and not index.merged and not geo_index.rebuild_pending():
+                match = index.lookup(ip_int) if version == 4 else index.lookup_v6(ip_int)
+                if not match:
+                    return None
+                s, e, country = match
+                if version == 6:
+                    return ip_range_doc(int_to_ip6(s), int_to_ip6(e), country)[1]
+                return {
+                    "range_start": s,
+                    "range_end": e,
+                    "start_ip": int_to_ip(s),
+                    "end_ip": int_to_ip(e),
+                    "country": country
+                }
             
-            for doc in docs:
-                data = doc.to_dict()
-                if data.get("range_end", 0) >= ip_int:
-                    return data
-            return None
+            # Buscar por inicio <= ip_int, ordenar descendente y validar el fin
+            return await get_storage().find_ip_range_async(ip_int, candidates=10, version=version)
         else:
             # Es un ID de documento
-            doc = client.collection("ip_to_country").document(ip_or_id).get()
-            return doc.to_dict() if doc.exists else None
+            return await get_storage().get_ip_range_async(ip_or_id)
             
     except Exception as e:
-        print(f"Error retrieving ip_to_country: {e}")
+        logger.error("Error retrieving ip_to_country: %s", e)
         return None
 
 
-def get_all_ip_to_country(limit: int = 100, start_after: str = None) -> dict:
+def _is_ip(ip_or_id: str) -> bool:
+    # Los IDs de documento no tienen puntos ni dos puntos
+    return "." in ip_or_id or ":" in ip_or_id
+
+
+def _range_doc_id(found: dict) -> str:
+    """ID del documento de un rango encontrado por IP."""
+    if "range_start_hex" in found:
+        return f"range6_{found['range_start_hex']}_{found['range_end_hex']}"
+    return f"range_{found.get('range_start')}_{found.get('range_end')}"
+
+
+async def get_all_ip_to_country(limit: int = 100, start_after: str = None) -> dict:
     """
     Obtiene rangos IP->pais con paginacion.
     
@@ -244,33 +290,22 @@ def get_all_ip_to_country(limit: int = 100, start_after: str = None) -> dict:
             "has_more": bool
         }
     """
-    client = get_client()
-    if not client:
-        return {"data": [], "count": 0, "next_page_token": None, "has_more": False}
-
     try:
         # Limitar el tamaño de página para evitar timeouts
         limit = min(limit, 1000)
         
-        query = client.collection("ip_to_country").order_by("__name__").limit(limit + 1)
-        
-        # Si hay un cursor, continuar desde ese documento
-        if start_after:
-            start_doc = client.collection("ip_to_country").document(start_after).get()
-            if start_doc.exists:
-                query = query.start_after(start_doc)
-        
-        docs = list(query.stream())
+        # Un documento extra para saber si hay otra pagina
+        docs = await get_storage().list_ip_ranges_async(limit + 1, start_after)
         
         # Verificar si hay más páginas
         has_more = len(docs) > limit
         if has_more:
             docs = docs[:limit]  # Remover el documento extra
         
-        records = [doc.to_dict() for doc in docs]
+        records = [data for _, data in docs]
         
         # Obtener el token para la próxima página
-        next_page_token = docs[-1].id if (docs and has_more) else None
+        next_page_token = docs[-1][0] if (docs and has_more) else None
         
         return {
             "data": records,
@@ -280,60 +315,48 @@ def get_all_ip_to_country(limit: int = 100, start_after: str = None) -> dict:
         }
 
     except Exception as e:
-        print(f"Error retrieving IP to Country records: {e}")
+        logger.error("Error retrieving IP to Country records: %s", e)
         return {"data": [], "count": 0, "next_page_token": None, "has_more": False}
 
-def update_ip_to_country(ip_or_id: str, updates: dict) -> bool:
+async def update_ip_to_country(ip_or_id: str, updates: dict) -> bool:
     """
     Actualiza un rango IP->pais por IP o por ID de documento.
     Nota: No se recomienda cambiar start_ip/end_ip porque el ID incluye los valores.
     """
-    client = get_client()
-    if not client:
-        return False
-    
     try:
         doc_id = ip_or_id
         
         # Si es una IP, buscar el documento
-        if "." in ip_or_id:
-            found = get_ip_to_country(ip_or_id)
+        if _is_ip(ip_or_id):
+            found = await get_ip_to_country(ip_or_id)
             if not found:
-                print(f"No se encontro rango para IP: {ip_or_id}")
+                logger.info("No se encontro rango para IP: %s", ip_or_id)
                 return False
-            s = found.get("range_start")
-            e = found.get("range_end")
-            doc_id = f"range_{s}_{e}"
+            doc_id = _range_doc_id(found)
         
-        client.collection("ip_to_country").document(doc_id).update(updates)
+        await get_storage().update_ip_range_async(doc_id, updates)
         return True
         
     except Exception as e:
-        print(f"Error updating IP to Country record: {e}")
+        logger.error("Error updating IP to Country record: %s", e)
         return False
 
-def delete_ip_to_country(ip_or_id: str) -> bool:
+async def delete_ip_to_country(ip_or_id: str) -> bool:
     """Elimina un rango IP->pais por IP o por ID de documento."""
-    client = get_client()
-    if not client:
-        return False
-    
     try:
         doc_id = ip_or_id
         
         # Si es una IP, buscar el documento
-        if "." in ip_or_id:
-            found = get_ip_to_country(ip_or_id)
+        if _is_ip(ip_or_id):
+            found = await get_ip_to_country(ip_or_id)
             if not found:
-                print(f"No se encontro rango para IP: {ip_or_id}")
+                logger.info("No se encontro rango para IP: %s", ip_or_id)
                 return False
-            s = found.get("range_start")
-            e = found.get("range_end")
-            doc_id = f"range_{s}_{e}"
+            doc_id = _range_doc_id(found)
         
-        client.collection("ip_to_country").document(doc_id).delete()
+        await get_storage().delete_ip_range_async(doc_id)
         return True
         
     except Exception as e:
-        print(f"Error deleting IP to Country record: {e}")
+        logger.error("Error deleting IP to Country record: %s", e)
         return False
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Cache de decisiones de resolve() para records geo y roundtrip.
+La respuesta solo depende del estado del record y de la ubicacion del
+cliente, asi que se guarda por (fqdn, prefijo del cliente: /24 en IPv4,
+/56 en IPv6). La version del record es su plan compilado: si el record o su
+health cambian hay un plan nuevo y las entradas viejas dejan de valer.
+DECISION_CACHE_TTL_S acota cuanto se reutiliza una decision si cambia la
+base de geolocalizacion. Tamaño acotado con desalojo LRU.
+"""
+
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    from config import DECISION_CACHE_MAX_ENTRIES, DECISION_CACHE_TTL_S
+except ImportError:
+    from .config import DECISION_CACHE_MAX_ENTRIES, DECISION_CACHE_TTL_S
+
+DecisionKey = Tuple[str, str]
+
+
+def client_prefix(client_ip: str) -> Optional[str]:
+    """Prefijo /24 (IPv4) o /56 (IPv6) del cliente, o None si la IP no es valida."""
+    if not client_ip:
+        return None
+    if ":" not in client_ip:
+        head, sep, _ = client_ip.rpartition(".")
+        return head if sep and head.count(".") == 2 else None
+    try:
+        return str(ipaddress.IPv6Network(f"{client_ip}/56", strict=False).network_address)
+    except ValueError:
+        return None
+
+
+class _Entry:
+    __slots__ = ("plan", "result", "expires_at")
+
+    def __init__(self, plan, result: dict, expires_at: float):
+        self.plan = plan
+        self.result = result
+        self.expires_at = expires_at
+
+
+class DecisionCache:
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[DecisionKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def make_key(self, fqdn: str, client_ip: str) -> Optional[DecisionKey]:
+        if self.max_entries <= 0 or not fqdn:
+            return None
+        prefix = client_prefix(client_ip)
+        return (fqdn, prefix) if prefix is not None else None
+
+    def get(self, key: DecisionKey, plan) -> Optional[dict]:
+        """Decision cacheada para la version actual del record (plan), o None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.plan is not plan or entry.expires_at <= now:
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(entry.result)
+
+    def put(self, key: DecisionKey, plan, result: dict):
+        entry = _Entry(plan, dict(result), time.monotonic() + self.ttl_s)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
+
+
+decision_cache = DecisionCache(DECISION_CACHE_MAX_ENTRIES, DECISION_CACHE_TTL_S)
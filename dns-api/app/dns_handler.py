@@ -0,0 +1,58 @@
+"""
+Respuesta a una query DNS en formato wire, sin pasar por HTTP.
+- Queries A estandar sobre un record administrado: se resuelven con
+  resolve_ip.resolve_async y se sintetiza la respuesta.
+- Todo lo demas (otros tipos, opcodes, nombres no administrados o sin
+  targets healthy): se reenvia al upstream, igual que hace el interceptor.
+"""
+
+try:
+    import dns_wire
+    from config import DEFAULT_TIMEOUT_MS
+    from crud import get_record
+    from resolve_ip import resolve_async
+    from resolver_logic import forward_dns_query
+except ImportError:
+    from . import dns_wire
+    from .config import DEFAULT_TIMEOUT_MS
+    from .crud import get_record
+    from .resolve_ip import resolve_async
+    from .resolver_logic import forward_dns_query
+
+DEFAULT_RECORD_TTL = 300  # mismo TTL que usa el interceptor
+
+
+async def answer_managed(query: bytes, question: dns_wire.Question, client_ip: str):
+    """Respuesta sintetica para un record administrado, o None si hay que reenviar."""
+    if question.qtype != dns_wire.TYPE_A or question.qclass != dns_wire.CLASS_IN:
+        return None
+    record = await get_record(question.qname)
+    if not record:
+        return None
+    result = await resolve_async(record, client_ip)
+    if not result or not result.get("ip"):
+        return None
+    try:
+        return dns_wire.build_a_response(query, question, result["ip"], record.get("ttl", DEFAULT_RECORD_TTL))
+    except OSError:
+        # ip del target invalida (no IPv4)
+        return None
+
+
+async def handle_dns_query(query: bytes, client_ip: str, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> bytes:
+    """Retorna la respuesta wire para la query (SERVFAIL si el upstream falla)."""
+    try:
+        question = dns_wire.parse_question(query)
+    except ValueError:
+        question = None
+
+    if question is not None and dns_wire.get_opcode(query) == 0:
+        response = await answer_managed(query, question, client_ip)
+        if response is not None:
+            return response
+
+    try:
+        response, _, _ = await forward_dns_query(query, timeout_ms)
+        return response
+    except Exception:
+        return dns_wire.build_error_response(query, dns_wire.RCODE_SERVFAIL)
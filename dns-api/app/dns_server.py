@@ -0,0 +1,197 @@
+"""
+Servidor DNS nativo (UDP y TCP) sobre la misma logica de la API.
+Evita el camino interceptor -> HTTP/JSON -> base64 -> FastAPI: recibe el
+paquete wire y responde con dns_handler.handle_dns_query.
+
+Con --workers N se hace fork de N procesos; cada uno abre sus propios
+sockets con SO_REUSEPORT y el kernel reparte las queries entre ellos.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import struct
+import sys
+
+try:
+    import dns_wire
+    import geo_index
+    import logs
+    import record_cache
+    import rr_state
+    import upstream
+    from config import DNS_LISTEN_HOST, DNS_LISTEN_PORT, DNS_LISTEN_WORKERS, DNS_TCP_IDLE_TIMEOUT_S
+    from dns_handler import handle_dns_query
+except ImportError:
+    from . import dns_wire
+    from . import geo_index
+    from . import logs
+    from . import record_cache
+    from . import rr_state
+    from . import upstream
+    from .config import DNS_LISTEN_HOST, DNS_LISTEN_PORT, DNS_LISTEN_WORKERS, DNS_TCP_IDLE_TIMEOUT_S
+    from .dns_handler import handle_dns_query
+
+logger = logs.get_logger("dns")
+
+
+async def _respond(query: bytes, client_ip: str) -> bytes:
+    """handle_dns_query con SERVFAIL ante cualquier error (storage, resolve), no solo del upstream."""
+    try:
+        return await handle_dns_query(query, client_ip)
+    except Exception as e:
+        logger.warning("dns query from %s failed: %r", client_ip, e)
+        return dns_wire.build_error_response(query, dns_wire.RCODE_SERVFAIL)
+
+
+class _UdpDnsServer(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < dns_wire.HEADER_LEN or dns_wire.get_flags(data) & dns_wire.FLAG_QR:
+            return  # paquete invalido o una respuesta: se ignora
+        task = asyncio.create_task(self._answer(data, addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _answer(self, query: bytes, addr):
+        response = await _respond(query, addr[0])
+        if not response:
+            return
+        if len(response) > dns_wire.max_udp_payload(query):
+            response = dns_wire.truncate_response(response)
+        self.transport.sendto(response, addr)
+
+
+async def _handle_tcp_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Conexion TCP: varias queries en vuelo, cada respuesta se escribe al terminar."""
+    client_ip = (writer.get_extra_info("peername") or ("unknown",))[0]
+    tasks = set()
+
+    async def answer(query: bytes):
+        response = await _respond(query, client_ip)
+        if response and not writer.is_closing():
+            writer.write(struct.pack("!H", len(response)) + response)
+
+    try:
+        while True:
+            length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), DNS_TCP_IDLE_TIMEOUT_S))[0]
+            query = await asyncio.wait_for(reader.readexactly(length), DNS_TCP_IDLE_TIMEOUT_S)
+            if length < dns_wire.HEADER_LEN:
+                break
+            task = asyncio.create_task(answer(query))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+
+def _bind(host: str, port: int, sock_type: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, sock_type)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.setblocking(False)
+    return sock
+
+
+async def serve(host: str, port: int, reuse_port: bool):
+    """Atiende UDP y TCP en host:port hasta recibir SIGTERM/SIGINT."""
+    loop = asyncio.get_running_loop()
+
+    # Mismos caches que los workers de la API (una copia por proceso)
+    geo_index.start()
+    record_cache.start()
+    rr_state.start()
+
+    udp_transport, _ = await loop.create_datagram_endpoint(
+        _UdpDnsServer, sock=_bind(host, port, socket.SOCK_DGRAM, reuse_port)
+    )
+    tcp_sock = _bind(host, port, socket.SOCK_STREAM, reuse_port)
+    tcp_server = await asyncio.start_server(_handle_tcp_client, sock=tcp_sock)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    logger.info("pid=%d escuchando en %s:%d (udp/tcp)", os.getpid(), host, port)
+    try:
+        await stop.wait()
+    finally:
+        udp_transport.close()
+        tcp_server.close()
+        await tcp_server.wait_closed()
+        rr_state.stop()
+        record_cache.stop()
+        upstream.close_all()
+
+
+def _run_worker(host: str, port: int, reuse_port: bool):
+    try:
+        asyncio.run(serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logs.shutdown()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Servidor DNS nativo (UDP/TCP) de la API")
+    p.add_argument("--host", default=DNS_LISTEN_HOST)
+    p.add_argument("--port", type=int, default=DNS_LISTEN_PORT)
+    p.add_argument("--workers", type=int, default=DNS_LISTEN_WORKERS,
+                   help="procesos con SO_REUSEPORT (requiere Linux/BSD)")
+    args = p.parse_args()
+    logs.setup()
+
+    reuse_port = hasattr(socket, "SO_REUSEPORT")
+    workers = max(1, args.workers)
+    if workers > 1 and not (reuse_port and hasattr(os, "fork")):
+        logger.warning("SO_REUSEPORT/fork no disponibles: se usa un solo proceso")
+        workers = 1
+
+    if workers == 1:
+        _run_worker(args.host, args.port, reuse_port)
+        return
+
+    # Fork antes de crear clientes de Firestore (gRPC no es fork-safe)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            logs.after_fork()
+            _run_worker(args.host, args.port, reuse_port)
+            os._exit(0)
+        children.append(pid)
+
+    def forward_signal(signum, _frame):
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sys.exit(0)
@@ -0,0 +1,238 @@
+"""
+Utilidades minimas para leer y modificar mensajes DNS en formato wire (RFC 1035).
+Solo lo necesario para cachear y reenviar respuestas: header, pregunta,
+TTLs de los RRs, SOA para cache negativo y bit DO del OPT (EDNS0), mas la
+construccion de respuestas A sinteticas para los records administrados.
+"""
+
+import socket
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+HEADER_LEN = 12
+
+FLAG_QR = 0x8000
+FLAG_AA = 0x0400
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+FLAG_RA = 0x0080
+FLAG_CD = 0x0010
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_OPT = 41
+CLASS_IN = 1
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR_FIXED = struct.Struct("!HHIH")  # type, class, ttl, rdlength
+
+
+class Question(NamedTuple):
+    qname: str      # formato de presentacion en minusculas, sin punto final
+    qtype: int
+    qclass: int
+    end: int        # offset donde termina la seccion de pregunta
+
+
+class TtlScan(NamedTuple):
+    min_answer_ttl: Optional[int]        # None si no hay RRs en answer
+    negative_ttl: Optional[int]          # min(TTL SOA, MINIMUM) de authority, RFC 2308
+    ttl_fields: List[Tuple[int, int]]    # (offset, ttl original) de cada RR (sin OPT)
+
+
+def get_id(msg: bytes) -> int:
+    return (msg[0] << 8) | msg[1]
+
+
+def set_id(msg: bytes, msg_id: int) -> bytes:
+    return msg_id.to_bytes(2, "big") + msg[2:]
+
+
+def get_flags(msg: bytes) -> int:
+    return (msg[2] << 8) | msg[3]
+
+
+def get_rcode(msg: bytes) -> int:
+    return msg[3] & 0x0F
+
+
+def get_opcode(msg: bytes) -> int:
+    return (msg[2] >> 3) & 0x0F
+
+
+def _skip_name(msg: bytes, off: int) -> int:
+    """Avanza sobre un nombre (con o sin compresion) y retorna el offset siguiente."""
+    while True:
+        if off >= len(msg):
+            raise ValueError("name out of bounds")
+        length = msg[off]
+        if length == 0:
+            return off + 1
+        if length & 0xC0 == 0xC0:
+            return off + 2
+        if length & 0xC0:
+            raise ValueError("bad label")
+        off += 1 + length
+
+
+def _label_text(label: bytes) -> str:
+    """
+    Label en formato de presentacion (RFC 4343): minusculas solo ASCII, con
+    "." y "\\" escapados y los bytes no imprimibles como \\DDD. Asi dos
+    nombres distintos en wire nunca dan el mismo texto.
+    """
+    out = []
+    for b in label.lower():
+        if b in (0x2E, 0x5C):
+            out.append("\\" + chr(b))
+        elif 0x21 <= b <= 0x7E:
+            out.append(chr(b))
+        else:
+            out.append("\\%03d" % b)
+    return "".join(out)
+
+
+def _read_qname(msg: bytes, off: int) -> Tuple[str, int]:
+    """Lee el nombre de la pregunta (sin punteros de compresion)."""
+    labels = []
+    while True:
+        if off >= len(msg):
+            raise ValueError("qname out of bounds")
+        length = msg[off]
+        if length == 0:
+            return ".".join(labels), off + 1
+        if length & 0xC0:
+            raise ValueError("compressed qname")
+        if off + 1 + length > len(msg):
+            raise ValueError("qname out of bounds")
+        labels.append(_label_text(msg[off + 1:off + 1 + length]))
+        off += 1 + length
+
+
+def parse_question(msg: bytes) -> Question:
+    """Retorna la (unica) pregunta del mensaje. ValueError si no hay exactamente una."""
+    if len(msg) < HEADER_LEN:
+        raise ValueError("short message")
+    qdcount = (msg[4] << 8) | msg[5]
+    if qdcount != 1:
+        raise ValueError("qdcount != 1")
+    qname, off = _read_qname(msg, HEADER_LEN)
+    if off + 4 > len(msg):
+        raise ValueError("truncated question")
+    qtype, qclass = struct.unpack_from("!HH", msg, off)
+    return Question(qname, qtype, qclass, off + 4)
+
+
+def _iter_rrs(msg: bytes, off: int):
+    """Itera (seccion, offset, type, class, ttl, rdata_offset, rdlength) de todos los RRs."""
+    _, _, _, ancount, nscount, arcount = _HEADER.unpack_from(msg, 0)
+    sections = (("an", ancount), ("ns", nscount), ("ar", arcount))
+    for section, count in sections:
+        for _ in range(count):
+            off = _skip_name(msg, off)
+            if off + _RR_FIXED.size > len(msg):
+                raise ValueError("truncated rr")
+            rtype, rclass, ttl, rdlength = _RR_FIXED.unpack_from(msg, off)
+            rdata = off + _RR_FIXED.size
+            if rdata + rdlength > len(msg):
+                raise ValueError("truncated rdata")
+            yield section, off, rtype, rclass, ttl, rdata, rdlength
+            off = rdata + rdlength
+
+
+def _find_opt(msg: bytes) -> Optional[Tuple[int, int]]:
+    """Retorna (class, ttl) del OPT RR (class = tamaño UDP, ttl = flags EDNS) o None."""
+    try:
+        question = parse_question(msg)
+        for section, _, rtype, rclass, ttl, _, _ in _iter_rrs(msg, question.end):
+            if section == "ar" and rtype == TYPE_OPT:
+                return rclass, ttl
+    except (ValueError, struct.error):
+        pass
+    return None
+
+
+def has_do_bit(msg: bytes) -> bool:
+    """True si la query trae un OPT RR con el bit DO (DNSSEC OK)."""
+    opt = _find_opt(msg)
+    return bool(opt and opt[1] & 0x8000)
+
+
+def max_udp_payload(query: bytes) -> int:
+    """Tamaño maximo de respuesta UDP que acepta el cliente (EDNS0 o 512)."""
+    opt = _find_opt(query)
+    if not opt:
+        return 512
+    return max(512, min(opt[0], 4096))
+
+
+def scan_ttls(msg: bytes, question_end: int) -> TtlScan:
+    """Recorre los RRs de una respuesta y junta los TTLs relevantes para el cache."""
+    min_answer_ttl = None
+    negative_ttl = None
+    ttl_fields = []
+    for section, off, rtype, _, ttl, rdata, rdlength in _iter_rrs(msg, question_end):
+        if rtype == TYPE_OPT:
+            continue  # el "TTL" del OPT son flags EDNS
+        ttl_fields.append((off + 4, ttl))
+        if section == "an":
+            min_answer_ttl = ttl if min_answer_ttl is None else min(min_answer_ttl, ttl)
+        elif section == "ns" and rtype == TYPE_SOA and rdlength >= 20:
+            soa_minimum = struct.unpack_from("!I", msg, rdata + rdlength - 4)[0]
+            negative_ttl = min(ttl, soa_minimum)
+    return TtlScan(min_answer_ttl, negative_ttl, ttl_fields)
+
+
+def answer_count(msg: bytes) -> int:
+    return (msg[6] << 8) | msg[7]
+
+
+def response_min_ttl(msg: bytes) -> Optional[int]:
+    """TTL minimo de la respuesta (answer, o SOA si es negativa); None si no aplica."""
+    try:
+        scan = scan_ttls(msg, parse_question(msg).end)
+    except (ValueError, IndexError, struct.error):
+        return None
+    return scan.min_answer_ttl if scan.min_answer_ttl is not None else scan.negative_ttl
+
+
+def _response_header(query: bytes, rcode: int, flags_extra: int, qdcount: int, ancount: int) -> bytes:
+    # Conserva ID, opcode, RD y CD de la query; marca QR y RA
+    flags = get_flags(query) & 0x7910
+    flags |= FLAG_QR | FLAG_RA | flags_extra | rcode
+    return _HEADER.pack(get_id(query), flags, qdcount, ancount, 0, 0)
+
+
+def build_a_response(query: bytes, question: Question, ip: str, ttl: int) -> bytes:
+    """Respuesta autoritativa con un unico registro A para la pregunta de la query."""
+    header = _response_header(query, RCODE_NOERROR, FLAG_AA, 1, 1)
+    # Nombre comprimido apuntando al QNAME (offset 12)
+    answer = b"\xc0\x0c" + _RR_FIXED.pack(TYPE_A, CLASS_IN, max(0, int(ttl)), 4) + socket.inet_aton(ip)
+    return header + query[HEADER_LEN:question.end] + answer
+
+
+def build_error_response(query: bytes, rcode: int) -> bytes:
+    """Respuesta sin registros (SERVFAIL, FORMERR...) que repite la pregunta si es legible."""
+    if len(query) < HEADER_LEN:
+        return b""
+    try:
+        question_end = parse_question(query).end
+    except ValueError:
+        return _response_header(query, rcode, 0, 0, 0)
+    return _response_header(query, rcode, 0, 1, 0) + query[HEADER_LEN:question_end]
+
+
+def truncate_response(response: bytes) -> bytes:
+    """Deja solo header y pregunta con TC=1 (el cliente debe reintentar por TCP)."""
+    try:
+        question_end = parse_question(response).end
+        qdcount = 1
+    except ValueError:
+        question_end, qdcount = HEADER_LEN, 0
+    flags = get_flags(response) | FLAG_TC
+    return _HEADER.pack(get_id(response), flags, qdcount, 0, 0, 0) + response[HEADER_LEN:question_end]
@@ -1,5 +1,5 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 
 try:
     from app.config import FIREBASE_CRED_JSON
@@ -8,6 +8,7 @@ except ImportError:
 
 _app = None
 _db = None
+_async_db = None
 
 def init_firebase():
     global _app, _db
@@ -21,3 +22,12 @@ def get_client():
     if not _db: 
         init_firebase()
     return _db
+
+def get_async_client():
+    """AsyncClient de Firestore para el event loop (gRPC asyncio, sin threads)."""
+    global _async_db
+    if not _async_db:
+        if not _app:
+            init_firebase()
+        _async_db = firestore_async.client(_app)
+    return _async_db
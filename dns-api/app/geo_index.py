@@ -0,0 +1,443 @@
+"""
+Indice de la coleccion ip_to_country para geolocalizar IPs sin consultar el storage.
+
+Dos formas de respaldo, con la misma interfaz lookup(ip_int) / lookup_v6(ip_int):
+- IpRangeIndex: arrays ordenados en memoria del proceso (carga desde el storage).
+- MmapIpRangeIndex: archivo binario compilado (GEO_DB_PATH) mapeado con mmap
+  de solo lectura; todos los workers comparten la misma copia en el page cache.
+
+Los rangos IPv6 van en un Ipv6RangeIndex aparte: cada extremo de 128 bits
+son dos uint64 (parte alta/baja) en arrays paralelos. En todos los casos la
+busqueda es binaria (bisect). El indice se reconstruye en background y se
+reemplaza de forma atomica.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+try:
+    from storage import get_storage
+    from config import GEO_DB_PATH, GEO_DB_RELOAD_INTERVAL_S
+    from logs import get_logger
+except ImportError:
+    from .storage import get_storage
+    from .config import GEO_DB_PATH, GEO_DB_RELOAD_INTERVAL_S
+    from .logs import get_logger
+
+logger = get_logger("geo")
+
+
+# --- FORMATO DEL ARCHIVO BINARIO ---
+#
+# Little-endian, arrays alineados a 4 bytes:
+#   header   : magic "GEO1" | uint32 count | uint32 flags | uint32 count6
+#   starts   : uint32[count]  (ordenado)
+#   ends     : uint32[count]
+#   countries: char[2][count] (codigo ISO de 2 letras)
+# Con flags & FLAG_IPV6, seccion IPv6 alineada a 8 bytes a continuacion:
+#   start_hi, start_lo, end_hi, end_lo: uint64[count6] (ordenado por start)
+#   countries: char[2][count6]
+# Los lectores anteriores ignoran la seccion IPv6 (count6 era un campo reservado en 0).
+
+GEO_DB_MAGIC = b"GEO1"
+FLAG_IPV6 = 1
+_HEADER = struct.Struct("<4sIII")
+_MASK64 = (1 << 64) - 1
+
+
+def _ipv6_offset(count: int) -> int:
+    return (_HEADER.size + 10 * count + 7) & ~7
+
+
+class Ipv6RangeIndex:
+    """
+    Rangos IPv6 ordenados por inicio en arrays uint64 paralelos (alta/baja),
+    32 bytes por rango mas el pais, sin un int de Python por rango.
+    """
+
+    __slots__ = ("start_hi", "start_lo", "end_hi", "end_lo", "_country")
+
+    def __init__(self, start_hi, start_lo, end_hi, end_lo, country_at):
+        self.start_hi = start_hi
+        self.start_lo = start_lo
+        self.end_hi = end_hi
+        self.end_lo = end_lo
+        self._country = country_at  # indice -> codigo de pais
+
+    def __len__(self) -> int:
+        return len(self.start_hi)
+
+    def lookup(self, ip_int: int) -> Optional[Tuple[int, int, str]]:
+        """Retorna (range_start, range_end, country) del rango que contiene la IP."""
+        hi, lo = ip_int >> 64, ip_int & _MASK64
+        # Rangos con la misma parte alta: el orden lo define la parte baja
+        first = bisect_left(self.start_hi, hi)
+        last = bisect_right(self.start_hi, hi, first)
+        i = bisect_right(self.start_lo, lo, first, last) - 1
+        if i < first:
+            # Ninguno empieza en esta parte alta antes de la IP: el anterior
+            i = first - 1
+        if i < 0:
+            return None
+        end_hi = self.end_hi[i]
+        if end_hi < hi or (end_hi == hi and self.end_lo[i] < lo):
+            return None
+        return (self.start_hi[i] << 64) | self.start_lo[i], (end_hi << 64) | self.end_lo[i], self._country(i)
+
+
+class IpRangeIndex:
+    """Rangos IPv4 ordenados por inicio, respaldados por arrays compactos."""
+
+    __slots__ = ("starts", "ends", "country_ids", "countries", "v6", "built_at")
+
+    # Los rangos son exactamente los documentos de la coleccion (no fusionados)
+    merged = False
+
+    def __init__(self, starts: array, ends: array, country_ids: array, countries: tuple,
+                 v6: Optional[Ipv6RangeIndex] = None):
+        self.starts = starts            # array('I') con range_start ordenado
+        self.ends = ends                # array('I') con range_end
+        self.country_ids = country_ids  # array('H') con indice en countries
+        self.countries = countries      # tupla de codigos de pais unicos
+        self.v6 = v6                    # rangos IPv6 (None si no hay)
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.starts) + (len(self.v6) if self.v6 is not None else 0)
+
+    def lookup(self, ip_int: int) -> Optional[Tuple[int, int, str]]:
+        """Retorna (range_start, range_end, country) del rango que contiene la IP."""
+        i = bisect_right(self.starts, ip_int) - 1
+        if i < 0 or ip_int > self.ends[i]:
+            return None
+        return self.starts[i], self.ends[i], self.countries[self.country_ids[i]]
+
+    def lookup_v6(self, ip_int: int) -> Optional[Tuple[int, int, str]]:
+        return self.v6.lookup(ip_int) if self.v6 is not None else None
+
+
+def _code_reader(codes, names: dict):
+    """indice -> pais a partir de codigos de 2 bytes (con cache de los str ya decodificados)."""
+    def country_at(i: int) -> str:
+        raw = bytes(codes[2 * i:2 * i + 2])
+        country = names.get(raw)
+        if country is None:
+            country = names.setdefault(raw, raw.decode("ascii", "replace"))
+        return country
+    return country_at
+
+
+class MmapIpRangeIndex:
+    """Rangos IPv4 (y opcionalmente IPv6) leidos directamente de un archivo GEO1 mapeado en memoria."""
+
+    __slots__ = ("path", "file_id", "starts", "ends", "codes", "v6", "_mm", "_names", "built_at")
+
+    # Los rangos contiguos del mismo pais estan fusionados
+    merged = True
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, flags, count6 = _HEADER.unpack_from(mm, 0)
+        if magic != GEO_DB_MAGIC:
+            raise ValueError(f"{path}: no es un archivo GEO1")
+        if len(mm) < _HEADER.size + count * 10:
+            raise ValueError(f"{path}: archivo truncado")
+
+        view = memoryview(mm)
+        off = _HEADER.size
+        starts = view[off:off + 4 * count].cast("I")
+        ends = view[off + 4 * count:off + 8 * count].cast("I")
+        if sys.byteorder != "little":
+            # En hosts big-endian se copian y convierten los arrays
+            starts, ends = array("I", starts), array("I", ends)
+            starts.byteswap()
+            ends.byteswap()
+
+        self.path = path
+        self.file_id = (st.st_ino, st.st_mtime_ns)
+        self.starts = starts
+        self.ends = ends
+        self.codes = view[off + 8 * count:off + 10 * count]
+        self._mm = mm
+        self._names = {}
+        self.v6 = self._map_ipv6(view, count, count6) if flags & FLAG_IPV6 and count6 else None
+        self.built_at = st.st_mtime
+
+    def _map_ipv6(self, view: memoryview, count: int, count6: int) -> Ipv6RangeIndex:
+        off = _ipv6_offset(count)
+        if len(view) < off + count6 * 34:
+            raise ValueError(f"{self.path}: seccion IPv6 truncada")
+        cols = [view[off + 8 * count6 * k:off + 8 * count6 * (k + 1)].cast("Q") for k in range(4)]
+        if sys.byteorder != "little":
+            cols = [array("Q", c) for c in cols]
+            for c in cols:
+                c.byteswap()
+        codes = view[off + 32 * count6:off + 34 * count6]
+        return Ipv6RangeIndex(*cols, _code_reader(codes, self._names))
+
+    def __len__(self) -> int:
+        return len(self.starts) + (len(self.v6) if self.v6 is not None else 0)
+
+    def lookup(self, ip_int: int) -> Optional[Tuple[int, int, str]]:
+        """Retorna (range_start, range_end, country) del rango fusionado que contiene la IP."""
+        i = bisect_right(self.starts, ip_int) - 1
+        if i < 0 or ip_int > self.ends[i]:
+            return None
+        raw = bytes(self.codes[2 * i:2 * i + 2])
+        country = self._names.get(raw)
+        if country is None:
+            country = self._names.setdefault(raw, raw.decode("ascii", "replace"))
+        return self.starts[i], self.ends[i], country
+
+    def lookup_v6(self, ip_int: int) -> Optional[Tuple[int, int, str]]:
+        return self.v6.lookup(ip_int) if self.v6 is not None else None
+
+
+# --- CONSTRUCCION ---
+
+def build_index6(rows: Iterable[Tuple[int, int, str]]) -> Optional[Ipv6RangeIndex]:
+    """Indice IPv6 a partir de tuplas (range_start, range_end, country) de 128 bits; None si no hay rangos."""
+    start_hi, start_lo, end_hi, end_lo = array("Q"), array("Q"), array("Q"), array("Q")
+    country_ids, countries, country_pos = array("H"), [], {}
+    for s, e, country in sorted(rows):
+        if country not in country_pos:
+            country_pos[country] = len(countries)
+            countries.append(country)
+        start_hi.append(s >> 64)
+        start_lo.append(s & _MASK64)
+        end_hi.append(e >> 64)
+        end_lo.append(e & _MASK64)
+        country_ids.append(country_pos[country])
+    if not start_hi:
+        return None
+    names = tuple(countries)
+    return Ipv6RangeIndex(start_hi, start_lo, end_hi, end_lo, lambda i: names[country_ids[i]])
+
+
+def build_index(rows: Iterable[Tuple[int, int, str]],
+                rows6: Iterable[Tuple[int, int, str]] = ()) -> IpRangeIndex:
+    """Construye el indice a partir de tuplas (range_start, range_end, country), IPv4 y opcionalmente IPv6."""
+    starts, ends, country_ids = array("I"), array("I"), array("H")
+    countries, country_pos = [], {}
+
+    for s, e, country in sorted(rows):
+        if country not in country_pos:
+            country_pos[country] = len(countries)
+            countries.append(country)
+        starts.append(s)
+        ends.append(e)
+        country_ids.append(country_pos[country])
+
+    return IpRangeIndex(starts, ends, country_ids, tuple(countries), build_index6(rows6))
+
+
+def merge_ranges(rows: Iterable[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    """Ordena los rangos y fusiona los adyacentes (o solapados) del mismo pais."""
+    merged: List[Tuple[int, int, str]] = []
+    for s, e, country in sorted(rows):
+        if merged:
+            ps, pe, pc = merged[-1]
+            if pc == country and s <= pe + 1:
+                merged[-1] = (ps, max(pe, e), pc)
+                continue
+        merged.append((s, e, country))
+    return merged
+
+
+def _country_codes(rows) -> bytes:
+    return b"".join(c.encode("ascii", "replace")[:2].ljust(2, b"?") for _, _, c in rows)
+
+
+def write_geo_db(path: str, rows: Iterable[Tuple[int, int, str]],
+                 rows6: Iterable[Tuple[int, int, str]] = ()) -> int:
+    """
+    Compila los rangos (IPv4 y opcionalmente IPv6) a un archivo GEO1 y lo
+    publica con os.replace (atomico para los lectores). Retorna la cantidad de
+    rangos escritos tras fusionar.
+    """
+    merged = merge_ranges(rows)
+    merged6 = merge_ranges(rows6)
+    starts = array("I", (s for s, _, _ in merged))
+    ends = array("I", (e for _, e, _ in merged))
+    codes = _country_codes(merged)
+    cols6 = [
+        array("Q", (s >> 64 for s, _, _ in merged6)),
+        array("Q", (s & _MASK64 for s, _, _ in merged6)),
+        array("Q", (e >> 64 for _, e, _ in merged6)),
+        array("Q", (e & _MASK64 for _, e, _ in merged6)),
+    ]
+    if sys.byteorder != "little":
+        starts.byteswap()
+        ends.byteswap()
+        for c in cols6:
+            c.byteswap()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(GEO_DB_MAGIC, len(merged), FLAG_IPV6 if merged6 else 0, len(merged6)))
+        f.write(starts.tobytes())
+        f.write(ends.tobytes())
+        f.write(codes)
+        if merged6:
+            f.write(b"\0" * (_ipv6_offset(len(merged)) - f.tell()))
+            for c in cols6:
+                f.write(c.tobytes())
+            f.write(_country_codes(merged6))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(merged) + len(merged6)
+
+
+def load_rows_from_storage() -> List[Tuple[int, int, str]]:
+    """Lee los rangos IPv4 de la coleccion ip_to_country (solo los campos necesarios)."""
+    return get_storage().load_ip_rows()
+
+
+def load_rows6_from_storage() -> List[Tuple[int, int, str]]:
+    """Lee los rangos IPv6 de la coleccion ip_to_country."""
+    return get_storage().load_ip6_rows()
+
+
+def load_from_storage() -> IpRangeIndex:
+    """Construye un IpRangeIndex en memoria desde el storage (Firestore o SQLite)."""
+    return build_index(load_rows_from_storage(), load_rows6_from_storage())
+
+
+# --- ESTADO DEL PROCESO ---
+
+_index = None
+_lock = threading.Lock()
+_rebuild_thread: Optional[threading.Thread] = None
+_rebuild_requested = False
+_next_reload_check = 0.0
+
+
+def _file_id(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _maybe_reload_geo_db():
+    """Reabre el archivo si otro worker publico una version nueva."""
+    global _index, _next_reload_check
+    now = time.monotonic()
+    if now < _next_reload_check:
+        return
+    _next_reload_check = now + GEO_DB_RELOAD_INTERVAL_S
+
+    current = _index
+    file_id = _file_id(GEO_DB_PATH)
+    if file_id is None or (isinstance(current, MmapIpRangeIndex) and current.file_id == file_id):
+        return
+    try:
+        _index = MmapIpRangeIndex(GEO_DB_PATH)
+    except Exception as e:
+        logger.warning("could not reload geo db %s: %s", GEO_DB_PATH, e)
+
+
+def get_index():
+    """Indice actual, o None si todavia no termino la primera carga."""
+    if GEO_DB_PATH:
+        _maybe_reload_geo_db()
+    return _index
+
+
+def _rebuild_geo_db(requested_at: float) -> MmapIpRangeIndex:
+    """Recompila el archivo compartido; solo un worker a la vez lo hace."""
+    lock_file = open(f"{GEO_DB_PATH}.lock", "a+")
+    try:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Si otro worker ya lo recompilo despues de nuestro pedido, se reutiliza
+        try:
+            fresh = os.stat(GEO_DB_PATH).st_mtime >= requested_at
+        except OSError:
+            fresh = False
+        if not fresh:
+            write_geo_db(GEO_DB_PATH, load_rows_from_storage(), load_rows6_from_storage())
+        return MmapIpRangeIndex(GEO_DB_PATH)
+    finally:
+        lock_file.close()
+
+
+def rebuild(requested_at: Optional[float] = None):
+    """Recarga el indice de forma sincrona y lo publica."""
+    global _index
+    start = time.monotonic()
+    if GEO_DB_PATH:
+        index = _rebuild_geo_db(requested_at if requested_at is not None else time.time())
+    else:
+        index = load_from_storage()
+    _index = index  # swap atomico: los lectores ven el indice viejo o el nuevo
+    logger.info("Indice ip_to_country cargado: %d rangos en %.1fs", len(index), time.monotonic() - start)
+    return index
+
+
+def _rebuild_loop():
+    global _rebuild_thread, _rebuild_requested
+    while True:
+        with _lock:
+            if not _rebuild_requested:
+                _rebuild_thread = None
+                return
+            _rebuild_requested = False
+            requested_at = time.time()
+        try:
+            rebuild(requested_at)
+        except Exception as e:
+            logger.warning("ip_to_country index rebuild failed: %s", e)
+
+
+def schedule_rebuild():
+    """
+    Pide una reconstruccion en background. Varias solicitudes mientras hay una
+    en curso se agrupan en una sola recarga adicional.
+    """
+    global _rebuild_thread, _rebuild_requested
+    with _lock:
+        _rebuild_requested = True
+        if _rebuild_thread is not None:
+            return
+        _rebuild_thread = threading.Thread(target=_rebuild_loop, name="geo-index-rebuild", daemon=True)
+        _rebuild_thread.start()
+
+
+def rebuild_pending() -> bool:
+    """True mientras este proceso tiene una reconstruccion pedida o en curso (el indice puede estar viejo)."""
+    return _rebuild_thread is not None
+
+
+def start():
+    """
+    Inicializa el indice al arrancar el worker. Si existe el archivo compilado
+    se mapea directamente (sin parseo); si no, se construye en background.
+    """
+    global _index
+    if GEO_DB_PATH and os.path.exists(GEO_DB_PATH):
+        try:
+            _index = MmapIpRangeIndex(GEO_DB_PATH)
+            return
+        except Exception as e:
+            logger.warning("could not open geo db %s: %s", GEO_DB_PATH, e)
+    schedule_rebuild()
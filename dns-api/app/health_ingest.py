@@ -0,0 +1,382 @@
+"""
+Ingesta de reportes de health (/api/update_health) sin bloquear el event loop.
+
+- Los reportes se acumulan en memoria y se escriben en lotes (WriteBatch en
+  Firestore, una transaccion en SQLite)
+  cada HEALTH_FLUSH_INTERVAL_S desde un thread aparte.
+- Se deduplican por (fqdn, target, region): si llegan varios antes del
+  flush, solo se escribe el ultimo.
+- Deadband: si el status no cambio y el RTT se movio menos de
+  HEALTH_RTT_DEADBAND_MS, no se reescribe (salvo cada
+  HEALTH_REFRESH_INTERVAL_S, para mantener last_check al dia).
+- El status agregado del target (mayoria de regiones) se calcula en el
+  flush, con el record completo: el de record_cache (aunque este dirty por
+  una escritura propia) o, si el cache no esta sincronizado, una lectura
+  directa; encima se aplican los reportes recientes de este proceso. Nunca
+  se toma la mayoria sobre un subconjunto de las regiones.
+- Los campos se validan al encolar (ValueError -> 400). Si un lote falla,
+  se reintenta de a un record para que un update invalido no bloquee al
+  resto; un record que falla HEALTH_MAX_ATTEMPTS flushes se descarta.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import record_cache
+    from storage import get_storage
+    from config import HEALTH_FLUSH_INTERVAL_S, HEALTH_RTT_DEADBAND_MS, HEALTH_REFRESH_INTERVAL_S
+    from config import HEALTH_MAX_ATTEMPTS
+    from logs import get_logger
+except ImportError:
+    from . import record_cache
+    from .storage import get_storage
+    from .config import HEALTH_FLUSH_INTERVAL_S, HEALTH_RTT_DEADBAND_MS, HEALTH_REFRESH_INTERVAL_S
+    from .config import HEALTH_MAX_ATTEMPTS
+    from .logs import get_logger
+
+logger = get_logger("health")
+
+UNHEALTHY_RTT_MS = 999.0
+# Firestore acepta hasta 500 operaciones por batch
+_MAX_BATCH_OPS = 450
+# Reportes propios que se superponen al record en memoria mientras el
+# listener todavia no trajo la escritura de vuelta
+_OVERLAY_S = max(10.0, 3 * HEALTH_FLUSH_INTERVAL_S)
+# Caracteres que Firestore no acepta en un field path sin comillas (FieldPath.from_string)
+_INVALID_PATH_CHARS = set("~*/[]`")
+# Errores que se repiten igual en cada reintento (update invalido, record inexistente)
+_PERMANENT_ERRORS = (ValueError, TypeError, KeyError)
+
+_pending: Dict[str, Dict[str, object]] = {}               # fqdn -> campos a escribir
+_placeholders: Dict[str, Tuple[Optional[str], Optional[str]]] = {}  # fqdn -> (target_id, ip)
+_last_written: Dict[Tuple[str, str, str], Tuple[str, float, float]] = {}  # (fqdn, target, region) -> (status, rtt, t)
+_recent: Dict[Tuple[str, str], Dict[str, Tuple[str, float]]] = {}         # (fqdn, target) -> region -> (status, t)
+_aggregate: Dict[str, Set[str]] = {}                      # fqdn -> targets con status agregado a recalcular
+_attempts: Dict[str, int] = {}                            # fqdn -> flushes fallidos seguidos
+_lock = threading.Lock()
+_flush_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+_stats = {"received": 0, "deduplicated": 0, "suppressed": 0, "written": 0, "batches": 0, "errors": 0,
+          "dropped": 0}
+
+
+def majority_status(status_by_region: Dict[str, str]) -> str:
+    # Mayoría estricta de "healthy"
+    total = len(status_by_region) if status_by_region else 0
+    if total == 0:
+        return "unknown"
+    healthy = sum(1 for v in status_by_region.values() if v == "healthy")
+    # Umbral: mitad + 1 sobre las regiones que ya reportaron
+    threshold = (total // 2) + 1
+    return "healthy" if healthy >= threshold else "unhealthy"
+
+
+def _status_by_region(record: Optional[dict], fqdn: str, target_id: str, now: float) -> Dict[str, str]:
+    """status_by_region del target: record completo + reportes recientes propios."""
+    merged: Dict[str, str] = {}
+    if record:
+        target_health = record.get("health", {}).get(target_id) or {}
+        merged.update(target_health.get("status_by_region") or {})
+    for region, (status, t) in _recent.get((fqdn, target_id), {}).items():
+        if now - t <= _OVERLAY_S or region not in merged:
+            merged[region] = status
+    return merged
+
+
+def check_path(path: str):
+    """ValueError si path no es un field path que Firestore acepte (a.b.c, sin elementos vacios)."""
+    if not isinstance(path, str) or not path or len(path.encode()) > 1500:
+        raise ValueError(f"Invalid field path: {path!r}")
+    for element in path.split("."):
+        if not element or _INVALID_PATH_CHARS.intersection(element):
+            raise ValueError(f"Invalid field path: {path!r}")
+
+
+def _check_element(name: str, value: str):
+    if not value or "." in value or _INVALID_PATH_CHARS.intersection(value):
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+def _enqueue(fqdn: str, fields: Dict[str, object]):
+    pending = _pending.setdefault(fqdn, {})
+    if any(k in pending for k in fields):
+        _stats["deduplicated"] += 1
+    pending.update(fields)
+
+
+def submit_report(fqdn: str, target_id: str, region: str, status_in: str, rtt: float,
+                  target_ip: Optional[str] = None) -> Optional[Dict[str, object]]:
+    """
+    Encola un reporte (formato expandido). Retorna los campos que se van a
+    escribir, o None si el deadband lo descarto. ValueError si target_id o
+    region no sirven como elemento de un field path.
+    """
+    _check_element("target_id", target_id)
+    _check_element("region", region)
+    now = time.monotonic()
+    rtt_value = rtt if status_in == "healthy" else UNHEALTHY_RTT_MS
+    key = (fqdn, target_id, region)
+    with _lock:
+        _stats["received"] += 1
+        last = _last_written.get(key)
+        if (last is not None and last[0] == status_in
+                and abs(last[1] - rtt_value) < HEALTH_RTT_DEADBAND_MS
+                and now - last[2] < HEALTH_REFRESH_INTERVAL_S):
+            _stats["suppressed"] += 1
+            return None
+        _last_written[key] = (status_in, rtt_value, now)
+        _recent.setdefault((fqdn, target_id), {})[region] = (status_in, now)
+
+        iso_now = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+        # Update granular: NO sobrescribir otros países/regiones
+        fields: Dict[str, object] = {
+            # Target: últimos datos observados desde ESTA región
+            f"health.{target_id}.last_check": iso_now,
+            f"health.{target_id}.rtt.last_ms": rtt_value,
+            f"health.{target_id}.rtt.by_region.{region}": rtt_value,
+            f"health.{target_id}.status_by_region.{region}": status_in,
+
+            # Health del "agente" regional que reporta
+            f"health.{region}.status": status_in,
+            f"health.{region}.last_check": iso_now,
+            f"health.{region}.rtt.last_ms": rtt_value,
+            f"health.{region}.rtt.by_region.{region}": rtt_value,
+        }
+        _enqueue(fqdn, fields)
+        _aggregate.setdefault(fqdn, set()).add(target_id)
+        _placeholders.setdefault(fqdn, (target_id, target_ip))
+    return fields
+
+
+def submit_updates(fqdn: str, updates: Dict[str, object]):
+    """Encola un update arbitrario (formato nuevo); los campos repetidos se pisan. ValueError si un campo es invalido."""
+    if not updates:
+        raise ValueError("Empty updates")
+    for path in updates:
+        check_path(path)
+    with _lock:
+        _stats["received"] += 1
+        _enqueue(fqdn, dict(updates))
+        _placeholders.setdefault(fqdn, (None, None))
+
+
+def _placeholder(fqdn: str, hint: Tuple[Optional[str], Optional[str]]) -> dict:
+    """Record minimo para que los reportes de agentes no fallen si el fqdn no existe."""
+    target_id, target_ip = hint
+    targets = []
+    if target_id or target_ip:
+        t = {}
+        if target_id:
+            t["id"] = str(target_id)
+        if target_ip:
+            t["ip"] = str(target_ip)
+        # add placeholder geo_location to keep schemas consistent
+        t["geo_location"] = {"country": "ZZ", "region": "unknown"}
+        targets.append(t)
+    return {
+        "fqdn": fqdn,
+        "type": "single" if len(targets) <= 1 else "multi",
+        "ttl": 300,
+        "targets": targets,
+        "health": {},
+    }
+
+
+def _drop(fqdn: str, reason: str):
+    """Descarta lo pendiente de un record (con _lock tomado)."""
+    logger.error("health updates for %s dropped: %s", fqdn, reason)
+    _attempts.pop(fqdn, None)
+    _stats["dropped"] += 1
+    # Que el proximo reporte no lo suprima el deadband: este nunca se escribio
+    for key in [k for k in _last_written if k[0] == fqdn]:
+        del _last_written[key]
+
+
+def _requeue(pending: Dict[str, Dict[str, object]], placeholders: dict, aggregate: Dict[str, Set[str]],
+             failed: Set[str]):
+    """
+    Devuelve campos no escritos a la cola sin pisar reportes mas nuevos. Los
+    records de failed suman un intento; al llegar a HEALTH_MAX_ATTEMPTS se
+    descartan.
+    """
+    with _lock:
+        for fqdn, fields in pending.items():
+            if fqdn in failed:
+                _attempts[fqdn] = _attempts.get(fqdn, 0) + 1
+                if _attempts[fqdn] >= HEALTH_MAX_ATTEMPTS:
+                    _drop(fqdn, f"{_attempts[fqdn]} failed flushes")
+                    continue
+            current = _pending.setdefault(fqdn, {})
+            for k, v in fields.items():
+                current.setdefault(k, v)
+            if fqdn in placeholders:
+                _placeholders.setdefault(fqdn, placeholders[fqdn])
+            if fqdn in aggregate:
+                _aggregate.setdefault(fqdn, set()).update(aggregate[fqdn])
+
+
+def _current_records(store, fqdns) -> Dict[str, Optional[dict]]:
+    """
+    Record completo de cada fqdn (None = no existe). Sale del cache si esta
+    sincronizado, aunque el fqdn este dirty (los reportes propios se
+    superponen despues); el resto se lee del storage en una llamada.
+    """
+    records, unknown = {}, []
+    for fqdn in fqdns:
+        hit, record = record_cache.peek(fqdn)
+        if hit:
+            records[fqdn] = record
+        else:
+            unknown.append(fqdn)
+    if unknown:
+        records.update(store.get_records(unknown))
+    return records
+
+
+def _add_aggregates(pending: Dict[str, Dict[str, object]], aggregate: Dict[str, Set[str]],
+                    records: Dict[str, Optional[dict]]):
+    """Agrega health.<target>.status (mayoria de regiones) a los campos a escribir."""
+    now = time.monotonic()
+    with _lock:
+        for fqdn, targets in aggregate.items():
+            for target_id in targets:
+                agg_status = majority_status(_status_by_region(records.get(fqdn), fqdn, target_id, now))
+                if agg_status != "unknown":
+                    pending[fqdn][f"health.{target_id}.status"] = agg_status
+
+
+def _write_chunk(store, chunk: list) -> Tuple[List[str], Dict[str, Exception], Optional[Exception]]:
+    """
+    Escribe un lote. Si falla, lo reintenta de a un record para aislar el
+    update que lo rompe. Retorna (escritos, descartados -> error, error
+    transitorio); con error transitorio (storage caido) se deja de intentar y
+    el resto del lote queda sin escribir.
+    """
+    try:
+        store.write_record_updates(chunk)
+        return [fqdn for fqdn, _, _ in chunk], {}, None
+    except _PERMANENT_ERRORS as e:
+        if len(chunk) == 1:
+            return [], {chunk[0][0]: e}, None
+    except Exception as e:
+        if len(chunk) == 1:
+            return [], {}, e
+    written, rejected = [], {}
+    for item in chunk:
+        try:
+            store.write_record_updates([item])
+            written.append(item[0])
+        except _PERMANENT_ERRORS as e:
+            rejected[item[0]] = e
+        except Exception as e:
+            return written, rejected, e
+    return written, rejected, None
+
+
+def flush() -> int:
+    """Escribe la cola en el storage en lotes. Retorna la cantidad de records escritos."""
+    with _lock:
+        pending = dict(_pending)
+        placeholders = dict(_placeholders)
+        aggregate = dict(_aggregate)
+        _pending.clear()
+        _placeholders.clear()
+        _aggregate.clear()
+    if not pending:
+        return 0
+
+    done: Set[str] = set()
+    rejected: Dict[str, Exception] = {}
+    error: Optional[Exception] = None
+    try:
+        store = get_storage()
+        records = _current_records(store, pending)
+        missing = {fqdn for fqdn in pending if records.get(fqdn) is None}
+        _add_aggregates(pending, aggregate, records)
+        fqdns = list(pending)
+        chunk, ops = [], 0
+        for i, fqdn in enumerate(fqdns):
+            placeholder = None
+            if fqdn in missing:
+                logger.info("Record %s not found — creating minimal placeholder from payload", fqdn)
+                placeholder = _placeholder(fqdn, placeholders.get(fqdn, (None, None)))
+                ops += 1
+            chunk.append((fqdn, placeholder, pending[fqdn]))
+            ops += 1
+            if ops >= _MAX_BATCH_OPS or i == len(fqdns) - 1:
+                written, chunk_rejected, error = _write_chunk(store, chunk)
+                for fqdn_written in written:
+                    record_cache.invalidate(fqdn_written)
+                done.update(written)
+                rejected.update(chunk_rejected)
+                with _lock:
+                    _stats["batches"] += 1
+                if error is not None:
+                    break
+                chunk, ops = [], 0
+    except Exception as e:
+        error = e
+
+    with _lock:
+        for fqdn in done:
+            _attempts.pop(fqdn, None)
+        for fqdn, e in rejected.items():
+            _drop(fqdn, repr(e))
+        _stats["written"] += len(done)
+        if error is not None or rejected:
+            _stats["errors"] += 1
+    if error is not None:
+        logger.warning("health flush failed: %s", error)
+    left = {f: v for f, v in pending.items() if f not in done and f not in rejected}
+    if left:
+        # Sin error transitorio no queda nada sin intentar; con error, todos suman un intento
+        _requeue(left, placeholders, aggregate, set(left) if error is not None else set())
+    return len(done)
+
+
+def _flush_loop():
+    while not _stop.wait(HEALTH_FLUSH_INTERVAL_S):
+        flush()
+        _prune()
+
+
+def _prune():
+    """Olvida estado de deadband/overlay viejo (targets que dejaron de reportar)."""
+    cutoff = time.monotonic() - max(HEALTH_REFRESH_INTERVAL_S, _OVERLAY_S) * 2
+    with _lock:
+        for key in [k for k, v in _last_written.items() if v[2] < cutoff]:
+            del _last_written[key]
+        for key in list(_recent):
+            regions = {r: v for r, v in _recent[key].items() if v[1] >= cutoff}
+            if regions:
+                _recent[key] = regions
+            else:
+                del _recent[key]
+
+
+def start():
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    _stop.clear()
+    _flush_thread = threading.Thread(target=_flush_loop, name="health-flush", daemon=True)
+    _flush_thread.start()
+
+
+def stop():
+    """Detiene el thread y escribe lo que quede en cola."""
+    global _flush_thread
+    if _flush_thread is not None:
+        _stop.set()
+        _flush_thread.join(timeout=5)
+        _flush_thread = None
+    flush()
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, pending_records=len(_pending))
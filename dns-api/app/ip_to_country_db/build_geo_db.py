@@ -0,0 +1,92 @@
+"""
+Compila los rangos IP->pais a un archivo binario GEO1 para GEO_DB_PATH.
+
+El archivo guarda arrays uint32 ordenados (inicio/fin) y el codigo de pais de
+cada rango, con los rangos contiguos del mismo pais fusionados; los rangos
+IPv6 van en una seccion aparte de uint64 (parte alta/baja). La API lo mapea
+con mmap de solo lectura, asi los workers de uvicorn comparten una sola copia.
+
+Ejecutar desde la carpeta dns-api:
+    python -m app.ip_to_country_db.build_geo_db --csv app/ip_to_country_db/ip_country.csv -o data/ip_country.geodb
+    python -m app.ip_to_country_db.build_geo_db --json ip_to_country_export.json -o data/ip_country.geodb
+    python -m app.ip_to_country_db.build_geo_db --firestore -o data/ip_country.geodb
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+
+from app.geo_index import load_rows6_from_storage, load_rows_from_storage, write_geo_db
+from app.utils import parse_ip
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def rows_from_csv(path: str):
+    """Lee lineas start_ip,end_ip,country (mismo formato que load_ip_to_country.py): (version, inicio, fin, pais)."""
+    with open(path, newline="") as f:
+        for line in csv.reader(f):
+            if len(line) < 3:
+                continue
+            try:
+                version, s = parse_ip(line[0].strip())
+                end_version, e = parse_ip(line[1].strip())
+            except ValueError:
+                # cabecera o IP invalida
+                continue
+            if version == end_version:
+                yield version, s, e, line[2]
+
+
+def rows_from_export(path: str):
+    """Lee un export JSON de la coleccion ({doc_id: doc} o lista de docs): (version, inicio, fin, pais)."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    docs = data.values() if isinstance(data, dict) else data
+    for doc in docs:
+        try:
+            country = doc.get("country") or "unknown"
+            if doc.get("ip_version") == 6:
+                yield 6, int(doc["range_start_hex"], 16), int(doc["range_end_hex"], 16), country
+            else:
+                yield 4, int(doc["range_start"]), int(doc["range_end"]), country
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def split_versions(rows):
+    """Separa (version, inicio, fin, pais) en listas IPv4 e IPv6 de (inicio, fin, pais)."""
+    by_version = {4: [], 6: []}
+    for version, s, e, country in rows:
+        by_version[version].append((s, e, country))
+    return by_version[4], by_version[6]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compila ip_to_country a un archivo GEO1")
+    src = p.add_mutually_exclusive_group()
+    src.add_argument("--csv", help="CSV start_ip,end_ip,country (default: ip_country.csv)")
+    src.add_argument("--json", help="export JSON de la coleccion ip_to_country")
+    src.add_argument("--firestore", action="store_true", help="leer la coleccion del storage configurado (STORAGE_BACKEND)")
+    p.add_argument("-o", "--output", required=True, help="archivo de salida (ej: data/ip_country.geodb)")
+    args = p.parse_args()
+
+    start = time.monotonic()
+    if args.firestore:
+        rows, rows6 = load_rows_from_storage(), load_rows6_from_storage()
+    elif args.json:
+        rows, rows6 = split_versions(rows_from_export(args.json))
+    else:
+        rows, rows6 = split_versions(rows_from_csv(args.csv or os.path.join(script_dir, "ip_country.csv")))
+
+    written = write_geo_db(args.output, rows, rows6)
+    size_kb = os.path.getsize(args.output) / 1024
+    print(f"Rangos leidos: {len(rows)} IPv4, {len(rows6)} IPv6")
+    print(f"Rangos escritos (fusionados): {written}")
+    print(f"Archivo: {args.output} ({size_kb:.1f} KB) en {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
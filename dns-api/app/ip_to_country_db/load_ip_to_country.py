@@ -0,0 +1,210 @@
+"""
+Carga el CSV de rangos IP->pais en la coleccion ip_to_country del storage
+configurado (STORAGE_BACKEND: Firestore o SQLite). Reemplaza a
+csv_to_firestore.py y check_db_count.py.
+
+- Lee el CSV en streaming y escribe lotes de hasta 500 documentos con
+  --workers commits en paralelo.
+- Guarda en un archivo de estado (SQLite local) el hash del contenido de cada
+  rango ya escrito. Si la carga se corta, volver a correr el mismo comando
+  retoma donde quedo, y en cargas siguientes solo se escriben los rangos
+  nuevos o modificados.
+- Reporta el throughput durante la carga y al final verifica la cantidad de
+  documentos de la coleccion.
+
+Ejecutar desde la carpeta dns-api:
+    python -m app.ip_to_country_db.load_ip_to_country
+    python -m app.ip_to_country_db.load_ip_to_country --csv otro.csv --workers 16
+    python -m app.ip_to_country_db.load_ip_to_country --reset      # ignora el estado, reescribe todo
+    python -m app.ip_to_country_db.load_ip_to_country --verify-only
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.config import STORAGE_BACKEND
+from app.storage import get_storage
+from app.utils import ip_range_doc
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Limite de operaciones por commit de Firestore
+BATCH_SIZE = 500
+
+
+def ranges_from_csv(path: str) -> Iterator[Tuple[str, dict]]:
+    """(doc_id, documento) por cada linea start_ip,end_ip,country valida (IPv4 o IPv6)."""
+    with open(path, newline="") as f:
+        for line in csv.reader(f):
+            if len(line) < 3:
+                continue
+            start_ip, end_ip, country = line[0].strip(), line[1].strip(), line[2].strip()
+            try:
+                yield ip_range_doc(start_ip, end_ip, country)
+            except ValueError:
+                # cabecera o IP invalida
+                continue
+
+
+def content_hash(doc: dict) -> str:
+    return hashlib.sha1(json.dumps(doc, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class LoadState:
+    """Hash de cada rango confirmado en el storage; se actualiza al terminar cada lote."""
+
+    def __init__(self, path: str, reset: bool = False):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS loaded (id TEXT PRIMARY KEY, hash TEXT NOT NULL) WITHOUT ROWID")
+        if reset:
+            self.conn.execute("DELETE FROM loaded")
+        self.conn.commit()
+
+    def hashes(self) -> Dict[str, str]:
+        return dict(self.conn.execute("SELECT id, hash FROM loaded"))
+
+    def mark(self, items: List[Tuple[str, str]]):
+        self.conn.executemany("INSERT OR REPLACE INTO loaded (id, hash) VALUES (?, ?)", items)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class Progress:
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.read = 0
+        self.skipped = 0
+        self.written = 0
+        self.failed = 0
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval_s:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        print(f"leidos {self.read}  sin cambios {self.skipped}  escritos {self.written}  "
+              f"con error {self.failed}  ({self.written / elapsed:.0f} docs/s)", flush=True)
+
+
+def _write_batch(store, batch: List[Tuple[str, dict, str]], retries: int):
+    """Escribe un lote con reintentos (backoff exponencial)."""
+    for attempt in range(retries + 1):
+        try:
+            store.set_ip_ranges((doc_id, doc) for doc_id, doc, _ in batch)
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+
+
+def load(csv_path: str, state: LoadState, workers: int, retries: int, progress: Progress) -> int:
+    """Carga el CSV. Retorna la cantidad de rangos distintos del archivo."""
+    store = get_storage()
+    known = state.hashes()
+    seen = set()
+    inflight: Dict[Future, List[Tuple[str, dict, str]]] = {}
+
+    def collect(done):
+        for future in done:
+            batch = inflight.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                # El lote queda sin marcar: se reintenta en la proxima corrida
+                progress.failed += len(batch)
+                print(f"lote con error: {e}", file=sys.stderr, flush=True)
+                continue
+            state.mark([(doc_id, h) for doc_id, _, h in batch])
+            progress.written += len(batch)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batch: List[Tuple[str, dict, str]] = []
+        for doc_id, doc in ranges_from_csv(csv_path):
+            progress.read += 1
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            h = content_hash(doc)
+            if known.get(doc_id) == h:
+                progress.skipped += 1
+                continue
+            batch.append((doc_id, doc, h))
+            if len(batch) < BATCH_SIZE:
+                continue
+            # Como maximo 2 lotes en espera por worker: el CSV no se carga entero en memoria
+            while len(inflight) >= workers * 2:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(done)
+            inflight[pool.submit(_write_batch, store, batch, retries)] = batch
+            batch = []
+            collect([f for f in list(inflight) if f.done()])
+            progress.report()
+        if batch:
+            inflight[pool.submit(_write_batch, store, batch, retries)] = batch
+        while inflight:
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            collect(done)
+            progress.report()
+    progress.report(force=True)
+    return len(seen)
+
+
+def verify(expected: Optional[int]) -> bool:
+    """Compara la cantidad de documentos de la coleccion con la esperada."""
+    total = get_storage().count_ip_ranges()
+    print(f"Documentos en ip_to_country: {total}" + (f" (esperados {expected})" if expected is not None else ""))
+    if expected is None:
+        return True
+    if total < expected:
+        print("Faltan documentos: volver a correr la carga para completarla", file=sys.stderr)
+        return False
+    if total > expected:
+        print(f"Hay {total - expected} documentos que no estan en el CSV (rangos viejos)")
+    return True
+
+
+def main():
+    p = argparse.ArgumentParser(description="Carga ip_to_country desde un CSV start_ip,end_ip,country")
+    p.add_argument("--csv", default=os.path.join(script_dir, "ip_country.csv"))
+    p.add_argument("--workers", type=int, default=8, help="commits en paralelo")
+    p.add_argument("--retries", type=int, default=3, help="reintentos por lote")
+    p.add_argument("--state", help=f"archivo de estado (default: <csv>.{STORAGE_BACKEND}.state)")
+    p.add_argument("--reset", action="store_true", help="ignorar el estado y reescribir todos los rangos")
+    p.add_argument("--verify-only", action="store_true", help="solo contar los documentos de la coleccion")
+    p.add_argument("--progress-s", type=float, default=5.0, help="intervalo de los reportes de avance")
+    args = p.parse_args()
+
+    if args.verify_only:
+        expected = len({doc_id for doc_id, _ in ranges_from_csv(args.csv)}) if os.path.exists(args.csv) else None
+        sys.exit(0 if verify(expected) else 1)
+
+    state = LoadState(args.state or f"{args.csv}.{STORAGE_BACKEND}.state", reset=args.reset)
+    progress = Progress(args.progress_s)
+    try:
+        expected = load(args.csv, state, max(1, args.workers), args.retries, progress)
+    finally:
+        state.close()
+
+    elapsed = time.monotonic() - progress.started
+    print(f"Rangos en el CSV: {expected}  escritos: {progress.written}  sin cambios: {progress.skipped}  "
+          f"en {elapsed:.1f}s")
+    ok = verify(expected) and progress.failed == 0
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Logging estructurado sin I/O en el thread de la request.
+
+Los modulos piden un logger por categoria (get_logger("crud")). Todos
+cuelgan de "dns_api" y tienen un unico handler que solo encola el registro
+(put_nowait): un QueueListener en un thread aparte formatea y escribe a
+stdout. Si la cola esta llena el registro se descarta y se cuenta.
+
+- Nivel por categoria: LOG_LEVEL (global) y LOG_LEVELS="resolve=WARNING,health=DEBUG".
+- Lineas por query (get_query_logger): muestreo con tope de
+  LOG_QUERY_RATE_PER_S lineas por segundo por categoria (token bucket).
+- LOG_FORMAT=json emite una linea JSON por registro, incluyendo los campos
+  pasados en extra={...}.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_QUERY_RATE_PER_S
+except ImportError:
+    from .config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_QUERY_RATE_PER_S
+
+ROOT = "dns_api"
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_stats = {"dropped": 0, "sampled_out": 0}
+_stats_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _stats_lock:
+                _stats["dropped"] += 1
+
+    def prepare(self, record):
+        # El mensaje se arma en el thread del listener (args son valores inmutables);
+        # solo las excepciones se formatean aca, antes de que cambie el estado
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Al cerrar se espera lugar en la cola (la original usa put_nowait)
+        self.queue.put(self._sentinel, timeout=5)
+
+
+class _TokenBucket:
+    """Como maximo rate eventos por segundo (rafagas de hasta rate)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+        with _stats_lock:
+            _stats["sampled_out"] += 1
+        return False
+
+
+class QueryLogger:
+    """
+    Logger muestreado para lineas por query. El nivel y el muestreo se
+    verifican antes de crear el LogRecord, asi una linea descartada casi no cuesta.
+    """
+
+    def __init__(self, logger: logging.Logger, rate: float):
+        self.logger = logger
+        self._bucket = _TokenBucket(rate)
+
+    def _log(self, level: int, msg: str, args, kwargs):
+        if self.logger.isEnabledFor(level) and self._bucket.take():
+            self.logger._log(level, msg, args, **kwargs)
+
+    def debug(self, msg: str, *args, **kwargs):
+        self._log(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg: str, *args, **kwargs):
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg: str, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, kwargs)
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "category": record.name[len(ROOT) + 1:] or ROOT,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def _level(name: str) -> Optional[int]:
+    value = logging.getLevelName(name.strip().upper())
+    return value if isinstance(value, int) else None
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        category, _, level = item.partition("=")
+        if _level(level) is not None:
+            levels[category.strip()] = _level(level)
+    return levels
+
+
+def get_logger(category: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{category}")
+
+
+_query_loggers: Dict[str, QueryLogger] = {}
+
+
+def get_query_logger(category: str) -> QueryLogger:
+    """Logger para lineas por query: nivel de la categoria, con muestreo."""
+    logger = _query_loggers.get(category)
+    if logger is None:
+        logger = _query_loggers[category] = QueryLogger(get_logger(category), LOG_QUERY_RATE_PER_S)
+    return logger
+
+
+def setup():
+    """
+    Configura la cola y arranca el listener (una vez por proceso; en un
+    worker creado con fork hay que llamarlo de nuevo, el thread no se hereda).
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger(ROOT)
+        root.setLevel(_level(LOG_LEVEL) or logging.INFO)
+        root.propagate = False
+        for category, level in _parse_levels(LOG_LEVELS).items():
+            logging.getLogger(f"{ROOT}.{category}").setLevel(level)
+
+        stream = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == "json":
+            stream.setFormatter(_JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_NonBlockingQueueHandler(log_queue))
+        _listener = _Listener(log_queue, stream, respect_handler_level=False)
+        _listener.start()
+
+
+def shutdown():
+    """Detiene el listener escribiendo lo que quede en la cola."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def after_fork():
+    """En el hijo de un fork: el listener del padre no existe, se crea uno nuevo."""
+    global _listener
+    _listener = None
+    setup()
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
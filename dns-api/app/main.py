@@ -1,11 +1,17 @@
-from fastapi import FastAPI, Query, HTTPException, status, Request
+from fastapi import FastAPI, Query, HTTPException, status, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, Dict
-from datetime import datetime
+from typing import Optional, Dict, List
+import base64
+import binascii
+import json
+import time
+from contextlib import asynccontextmanager
 
 # Importar funciones CRUD con alias para evitar shadowing
 from app.crud import get_record
-from app.crud import get_all_records
+from app.crud import get_records as crud_get_records
+from app.crud import get_records_snapshot
+from app.crud import get_records_since
 from app.crud import create_record as crud_create_record
 from app.crud import update_record as crud_update_record
 from app.crud import delete_record as crud_delete_record
@@ -16,14 +22,44 @@ from app.crud import update_ip_to_country
 from app.crud import delete_ip_to_country
 
 from app.schemas import *
-from app.resolver_logic import process_dns_query_from_base64
-from app.resolve_ip import resolve
-from app.utils import get_geo_location_from_db
-from app.firebase_client import get_client
+from app.resolver_logic import process_dns_query_from_base64, upstream_flights, MAX_PAYLOAD_BYTES
+from app.dns_handler import handle_dns_query
+from app import dns_wire
+from app.resolve_ip import resolve_async
+from app.utils import get_geo_location_from_db_async
+from app import geo_index
+from app import record_cache
+from app import rr_state
+from app import health_ingest
+from app import logs
+from app import metrics
+from app.answer_cache import answer_cache
+from app.decision_cache import decision_cache
+from app import upstream
+from app.storage import get_storage
 
 # Conjunto de regiones "simuladas" por el healthchecker
 REGIONS = {"na", "eu", "sa", "ca", "as"}
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Logging: cola + thread escritor (sin I/O en el thread de la request)
+    logs.setup()
+    # Indice IP->pais: mmap del archivo compilado o carga en background
+    geo_index.start()
+    # Cache de records alimentado por el listener on_snapshot
+    record_cache.start()
+    rr_state.start()
+    # Reportes de health: cola en memoria + escritura en lotes
+    health_ingest.start()
+    yield
+    health_ingest.stop()
+    rr_state.stop()
+    record_cache.stop()
+    upstream.close_all()
+    logs.shutdown()
+    metrics.process_exit()
+
 app = FastAPI(
     title="DNS API Inteligente",
     description="""
@@ -37,24 +73,59 @@ app = FastAPI(
     * roundtrip: Selección por menor tiempo de respuesta
     """,
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Plantilla de la ruta (ej. /api/records/{fqdn}) para no explotar la cardinalidad
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        metrics.http_requests.labels(request.method, endpoint, str(status_code)).inc()
+        metrics.http_duration.labels(request.method, endpoint).observe(time.perf_counter() - start)
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/", summary="Health Check", tags=["Health"], status_code=status.HTTP_200_OK)
-def is_running():
+async def is_running():
     return {"running": "ok"}
 
 @app.get("/healthz", summary="Health Status", tags=["Health"], status_code=status.HTTP_200_OK)
-def health_status():
+async def health_status():
     return {"status": "ok"}
 
+@app.get("/api/stats", summary="Estadisticas de caches", tags=["Health"], status_code=status.HTTP_200_OK)
+async def cache_stats():
+    return {
+        "storage": get_storage().name,
+        "answer_cache": answer_cache.stats(),
+        "upstream": upstream.pool_stats(),
+        "upstream_coalescing": upstream_flights.stats(),
+        "decision_cache": decision_cache.stats(),
+        "record_cache": record_cache.stats(),
+        "rr_state": rr_state.stats(),
+        "health_ingest": health_ingest.stats(),
+        "logging": logs.stats(),
+    }
+
 @app.get("/api/exists",
          response_model=ExistsOut,
          summary="Verificar Existencia de Record",
          tags=["DNS Records"], status_code=status.HTTP_200_OK)
-def exists(host: Optional[str] = Query(None, min_length=3, max_length=255)):
+async def exists(host: Optional[str] = Query(None, min_length=3, max_length=255)):
     if not host:
         raise HTTPException(status_code=400, detail="host parameter is required")
-    record = get_record(host)
+    record = await get_record(host)
     if record:
         return {"exists": True, "record_type": record.get("type", "unknown")}
     return {"exists": False}
@@ -63,8 +134,8 @@ def exists(host: Optional[str] = Query(None, min_length=3, max_length=255)):
           response_model=DNSResolverOut,
           summary="Resolver DNS Base64",
           tags=["DNS Resolution"], status_code=status.HTTP_200_OK)
-def dns_resolver(request: DNSResolverIn):
-    dns_response = process_dns_query_from_base64(request.base64_data, request.timeout_ms)
+async def dns_resolver(request: DNSResolverIn):
+    dns_response = await process_dns_query_from_base64(request.base64_data, request.timeout_ms)
     return {
         "response_base64": dns_response["payload_b64"],
         "contacted_server": dns_response["server"],
@@ -75,89 +146,200 @@ def dns_resolver(request: DNSResolverIn):
           response_model=DNSResolveOut,
           summary="Resolver DNS Inteligente",
           tags=["DNS Resolution"], status_code=status.HTTP_200_OK)
-def dns_resolve(request: DNSResolveIn):
-    record = get_record(request.host)
+async def dns_resolve(request: DNSResolveIn):
+    record = await get_record(request.host)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
-    dns_response = resolve(record, request.client_ip)
+    dns_response = await resolve_async(record, request.client_ip)
     if not dns_response:
         raise HTTPException(status_code=503, detail="No healthy targets available")
     return {**dns_response}
 
+# DNS over HTTPS (RFC 8484): wire format directo, sin base64/JSON ni segundo round trip
+DNS_MESSAGE_TYPE = "application/dns-message"
+
+def _doh_client_ip(request: Request) -> str:
+    # Detras de un proxy/interceptor, el cliente real viene en X-Forwarded-For
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+async def _doh_answer(query: bytes, request: Request) -> Response:
+    if len(query) < dns_wire.HEADER_LEN or len(query) > MAX_PAYLOAD_BYTES:
+        raise HTTPException(status_code=400, detail="Invalid DNS message")
+    response = await handle_dns_query(query, _doh_client_ip(request))
+    headers = {}
+    ttl = dns_wire.response_min_ttl(response)
+    if ttl is not None:
+        headers["Cache-Control"] = f"max-age={ttl}"
+    return Response(content=response, media_type=DNS_MESSAGE_TYPE, headers=headers)
+
+@app.get("/dns-query", summary="DNS over HTTPS (GET)", tags=["DNS Resolution"], response_class=Response)
+async def doh_get(request: Request, dns: str = Query(..., description="Query DNS en base64url sin padding")):
+    try:
+        query = base64.urlsafe_b64decode(dns + "=" * (-len(dns) % 4))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid base64url in dns parameter")
+    return await _doh_answer(query, request)
+
+@app.post("/dns-query", summary="DNS over HTTPS (POST)", tags=["DNS Resolution"], response_class=Response)
+async def doh_post(request: Request):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != DNS_MESSAGE_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {DNS_MESSAGE_TYPE}")
+    return await _doh_answer(await request.body(), request)
+
+MAX_BATCH_SIZE = 1000
+
+@app.post("/api/resolve/batch",
+          response_model=DNSResolveBatchOut,
+          summary="Resolver DNS Inteligente en lote",
+          tags=["DNS Resolution"], status_code=status.HTTP_200_OK)
+async def dns_resolve_batch(items: List[DNSResolveIn]):
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE})")
+
+    # Una sola lectura para todos los records que no estan en cache
+    records = await crud_get_records([item.host for item in items])
+
+    # Geolocalizacion una vez por IP de cliente (solo geo/roundtrip sin decision cacheada)
+    geo_by_ip: Dict[str, dict] = {}
+    results = []
+    for item in items:
+        record = records.get(item.host)
+        if not record:
+            results.append({"host": item.host, "status_code": 404, "error": "Record not found"})
+            continue
+        try:
+            dns_response = await resolve_async(record, item.client_ip, geo_by_ip)
+        except Exception as e:
+            results.append({"host": item.host, "status_code": 500, "error": str(e)})
+            continue
+        if not dns_response:
+            results.append({"host": item.host, "status_code": 503, "error": "No healthy targets available"})
+            continue
+        results.append({"host": item.host, **dns_response})
+    return {"results": results}
+
 # CRUD Records
 @app.get("/api/ip-geo/{ip_address}", summary="Get geolocation by IP address", tags=["CRUD"])
-def get_geolocation(ip_address: str):
-    return get_geo_location_from_db(ip_address)
+async def get_geolocation(ip_address: str):
+    return await get_geo_location_from_db_async(ip_address)
 
-@app.get("/api/records", summary="Listar todos los records DNS", tags=["CRUD"])
-def get_records():
+def _records_mapping(records: list, fields: Optional[tuple]) -> dict:
     # The Firestore CRUD returns a list of record objects. For some tools
     # (exported JSON, healthchecker) it's more convenient to have a mapping
-    # keyed by fqdn. Return a mapping when possible to keep clients simple.
-    records = get_all_records()
-    if isinstance(records, list):
-        mapped = {}
-        for r in records:
-            # prefer explicit fqdn field, fall back to keys that might exist
-            fqdn = r.get("fqdn") or r.get("domain")
-            if not fqdn:
-                # skip malformed records without fqdn
-                continue
-            mapped[fqdn] = r
-        return mapped
-    # already a mapping or other shape - return as-is
-    return records
+    # keyed by fqdn.
+    mapped = {}
+    for r in records:
+        # prefer explicit fqdn field, fall back to keys that might exist
+        fqdn = r.get("fqdn") or r.get("domain")
+        if not fqdn:
+            # skip malformed records without fqdn
+            continue
+        mapped[fqdn] = record_cache.project(r, fields)
+    return mapped
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _not_modified(etag: str) -> Response:
+    metrics.records_feed.labels("not_modified").inc()
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+@app.get("/api/records", summary="Listar todos los records DNS", tags=["CRUD"])
+async def get_records(
+    request: Request,
+    response: Response,
+    since: Optional[str] = Query(None, description="Version (X-Records-Version) desde la cual devolver solo los cambios"),
+    fields: Optional[str] = Query(None, description="Campos de cada record, separados por coma (ej: fqdn,targets)"),
+):
+    """
+    Sin since: mapping fqdn -> record con ETag (304 si If-None-Match coincide)
+    y la version en X-Records-Version.
+    Con since: {"version", "full", "records", "deleted"} con solo los records
+    cuyos campos pedidos cambiaron; full=true (todo) si la version ya no se
+    recuerda. ETag y version son el digest del contenido proyectado: iguales
+    en todos los workers y solo cambian si cambian esos campos.
+    """
+    projection = record_cache.normalize_fields([f.strip() for f in fields.split(",") if f.strip()] if fields else None)
+
+    if since is not None:
+        version, full, records, deleted = await get_records_since(since, projection)
+        metrics.records_feed.labels("resync" if full else "delta").inc()
+        return {"version": version, "full": full, "records": _records_mapping(records, projection), "deleted": deleted}
+
+    if_none_match = request.headers.get("if-none-match")
+    version = record_cache.feed_state(projection)
+    if version is not None and _etag_matches(if_none_match, f'"{version}"'):
+        return _not_modified(f'"{version}"')
+
+    version, records = await get_records_snapshot(projection)
+    etag = f'"{version}"'
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    metrics.records_feed.labels("full").inc()
+    response.headers["ETag"] = etag
+    response.headers["X-Records-Version"] = version
+    return _records_mapping(records, projection)
 
 @app.get("/api/records/{hostname}", summary="Obtener record DNS por hostname", tags=["CRUD"])
-def get_record_by_hostname(hostname: str):
-    return get_record(hostname)
+async def get_record_by_hostname(hostname: str):
+    return await get_record(hostname)
 
 @app.post("/api/records", summary="Crear record DNS", tags=["CRUD"], status_code=status.HTTP_201_CREATED)
-def create_dns_record(data: dict):
-    return crud_create_record(data)
+async def create_dns_record(data: dict):
+    return await crud_create_record(data)
 
 @app.put("/api/records/{host}", summary="Actualizar record DNS", tags=["CRUD"])
-def update_dns_record(host: str, data: dict):
-    return crud_update_record(host, data)
+async def update_dns_record(host: str, data: dict):
+    return await crud_update_record(host, data)
 
 @app.delete("/api/records/{host}", summary="Eliminar record DNS", tags=["CRUD"], status_code=status.HTTP_204_NO_CONTENT)
-def delete_dns_record(host: str):
-    return crud_delete_record(host)
+async def delete_dns_record(host: str):
+    return await crud_delete_record(host)
 
 # CRUD ip_to_country
 @app.get("/api/ip_to_country", summary="Listar rangos IP->pais", tags=["CRUD"])
-def list_ip_to_country(
+async def list_ip_to_country(
     limit: int = Query(100, ge=1, le=1000),
     start_after: Optional[str] = Query(None)
 ):
-    return get_all_ip_to_country(limit=limit, start_after=start_after)
+    return await get_all_ip_to_country(limit=limit, start_after=start_after)
 
 @app.get("/api/ip_to_country/{ip_or_id}", summary="Obtener mapeo IP->pais", tags=["CRUD"])
-def get_ip_country_mapping(ip_or_id: str):
-    result = get_ip_to_country(ip_or_id)
+async def get_ip_country_mapping(ip_or_id: str):
+    result = await get_ip_to_country(ip_or_id)
     if not result:
         raise HTTPException(status_code=404, detail="IP mapping not found")
     return result
 
 @app.post("/api/ip_to_country", summary="Crear rango IP->pais", tags=["CRUD"], status_code=status.HTTP_201_CREATED)
-def create_ip_country_mapping(data: dict):
-    ok = create_ip_to_country(data)
+async def create_ip_country_mapping(data: dict):
+    ok = await create_ip_to_country(data)
     if not ok:
         raise HTTPException(status_code=500, detail="Failed to create IP mapping")
+    geo_index.schedule_rebuild()
     return {"created": True}
 
 @app.put("/api/ip_to_country/{ip_or_id}", summary="Actualizar rango IP->pais", tags=["CRUD"])
-def update_ip_country_mapping(ip_or_id: str, data: dict):
-    ok = update_ip_to_country(ip_or_id, data)
+async def update_ip_country_mapping(ip_or_id: str, data: dict):
+    ok = await update_ip_to_country(ip_or_id, data)
     if not ok:
         raise HTTPException(status_code=500, detail="Failed to update IP mapping")
+    geo_index.schedule_rebuild()
     return {"updated": True}
 
 @app.delete("/api/ip_to_country/{ip_or_id}", summary="Eliminar rango IP->pais", tags=["CRUD"], status_code=status.HTTP_204_NO_CONTENT)
-def delete_ip_country_mapping(ip_or_id: str):
-    ok = delete_ip_to_country(ip_or_id)
+async def delete_ip_country_mapping(ip_or_id: str):
+    ok = await delete_ip_to_country(ip_or_id)
     if not ok:
         raise HTTPException(status_code=500, detail="Failed to delete IP mapping")
+    geo_index.schedule_rebuild()
     return {"deleted": True}
 
 # CORS
@@ -167,86 +349,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Records-Version"],
 )
 
-def _majority_status(status_by_region: Dict[str, str]) -> str:
-    # Mayoría estricta de "healthy"
-    total = len(status_by_region) if status_by_region else 0
-    if total == 0:
-        return "unknown"
-    healthy = sum(1 for v in status_by_region.values() if v == "healthy")
-    # Umbral: mitad + 1 sobre las regiones que ya reportaron
-    threshold = (total // 2) + 1
-    return "healthy" if healthy >= threshold else "unhealthy"
-
 @app.post("/api/update_health")
 async def update_health(request: Request, data: dict = None):
-    try:
-        client_host = request.client.host if request.client else "unknown"
-    except Exception:
-        client_host = "unknown"
-    headers = dict(request.headers)
-    user_agent = headers.get("user-agent", "")
-    body_bytes = await request.body()
-    body_text = body_bytes.decode(errors="replace") if body_bytes else None
-    print(f"[API:DBG] update_health called from {client_host} UA='{user_agent}' headers={{{', '.join(list(headers.keys())[:5]) + (', ...' if len(headers)>5 else '')}}}")
-    if body_text:
-        print(f"[API:DBG] body={body_text}")
-
-    if data is None and body_text:
+    """
+    Encola el reporte y responde de inmediato; health_ingest lo escribe en
+    Firestore en lotes (dedupe por fqdn/target/region y deadband).
+    """
+    if data is None:
+        body_bytes = await request.body()
         try:
-            import json as _json
-            data = _json.loads(body_text)
-        except Exception:
+            data = json.loads(body_bytes) if body_bytes else {}
+        except ValueError:
             data = {}
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Invalid body")
 
-    db = get_client()
     fqdn = data.get("fqdn")
     if not fqdn:
         raise HTTPException(status_code=400, detail="Missing fqdn")
 
-    doc_ref = db.collection("records").document(fqdn)
-    snap = doc_ref.get()
-    if not snap.exists:
-        # Auto-create a minimal record so health updates from agents don't fail
-        # Payload usually contains at least target_id and optionally ip.
-        print(f"[API] Record {fqdn} not found — creating minimal placeholder from payload")
-        target_id = data.get("target_id") if isinstance(data, dict) else None
-        target_ip = data.get("ip") if isinstance(data, dict) else None
-        targets = []
-        if target_id or target_ip:
-            t = {}
-            if target_id:
-                t["id"] = str(target_id)
-            if target_ip:
-                t["ip"] = str(target_ip)
-            # add placeholder geo_location to keep schemas consistent
-            t["geo_location"] = {"country": "ZZ", "region": "unknown"}
-            targets.append(t)
-
-        minimal = {
-            "fqdn": fqdn,
-            "type": "single" if len(targets) <= 1 else "multi",
-            "ttl": 300,
-            "targets": targets,
-            "health": {}
-        }
-        try:
-            doc_ref.set(minimal)
-            snap = doc_ref.get()
-            record = snap.to_dict() or {}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to create placeholder record: {e}")
-    else:
-        record = snap.to_dict() or {}
-
     # Caso 1: formato nuevo
     if "updates" in data and isinstance(data["updates"], dict):
         try:
-            doc_ref.update(data["updates"])
-            return {"success": True, "updated": data["updates"], "format": "new"}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Firestore update failed: {str(e)}")
+            health_ingest.submit_updates(fqdn, data["updates"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"success": True, "updated": data["updates"], "format": "new", "queued": True}
 
     # Caso 2: formato antiguo
     required = ["target_id", "region", "status", "rtt"]
@@ -262,42 +393,12 @@ async def update_health(request: Request, data: dict = None):
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid rtt")
 
-    if region not in REGIONS:
-        # Permitimos regiones inesperadas pero no las usamos para mayoría “global”
-        pass
-
-    now = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
-
-    # Construir update granular (NO sobrescribir otros países/regiones)
-    update_data: Dict[str, object] = {
-        # Target: últimos datos observados desde ESTA región
-        f"health.{target_id}.last_check": now,
-        f"health.{target_id}.rtt.last_ms": rtt if status_in == "healthy" else 999.0,
-        f"health.{target_id}.rtt.by_region.{region}": rtt if status_in == "healthy" else 999.0,
-
-        # Health del "agente" regional que reporta
-        f"health.{region}.status": status_in,
-        f"health.{region}.last_check": now,
-        f"health.{region}.rtt.last_ms": rtt if status_in == "healthy" else 999.0,
-        f"health.{region}.rtt.by_region.{region}": rtt if status_in == "healthy" else 999.0,
-    }
-
-    # Mantener status por región para el TARGET y derivar mayoría
-    target_health: Dict = (record.get("health", {}).get(target_id) or {})
-    status_by_region: Dict[str, str] = dict(target_health.get("status_by_region") or {})
-    status_by_region[region] = status_in
-
-    agg_status = _majority_status(status_by_region)
-    update_data[f"health.{target_id}.status_by_region"] = status_by_region
-    if agg_status != "unknown":
-        update_data[f"health.{target_id}.status"] = agg_status
-
+    # Regiones fuera de REGIONS se aceptan igual (el healthchecker puede agregar nuevas)
     # No actualizar geo de targets aunque venga en el payload
-    # Los targets mantienen la región y país original con la que fueron creados
-
+    target_ip = data.get("ip")
     try:
-        doc_ref.update(update_data)
-        print(f"[API] Updated {fqdn} ({target_id} -> {region}, {status_in}, {rtt}ms)")
-        return {"success": True, "updated": update_data, "format": "expanded"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Firestore update failed: {str(e)}")
+        update_data = health_ingest.submit_report(fqdn, target_id, region, status_in, rtt,
+                                                  str(target_ip) if target_ip else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "updated": update_data or {}, "format": "expanded", "queued": update_data is not None}
@@ -0,0 +1,102 @@
+"""
+Metricas Prometheus (/metrics).
+
+Con PROMETHEUS_MULTIPROC_DIR definido (por defecto en Docker) cada worker
+escribe sus valores en archivos mmap de ese directorio y /metrics los
+agrega con MultiProcessCollector, asi el resultado es el mismo sin importar
+que worker atienda el scrape. El directorio se vacia al arrancar el
+contenedor. Sin la variable, las metricas son del proceso.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+
+try:
+    import config  # noqa: F401  (carga .env antes de que prometheus_client lea PROMETHEUS_MULTIPROC_DIR)
+except ImportError:
+    from . import config  # noqa: F401
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+
+_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+_NETWORK_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# HTTP: endpoint = plantilla de la ruta (/api/records/{fqdn}), no la URL
+http_requests = Counter(
+    "dns_api_http_requests_total", "Requests HTTP por endpoint y status", ["method", "endpoint", "status"]
+)
+http_duration = Histogram(
+    "dns_api_http_request_duration_seconds", "Latencia de requests HTTP por endpoint", ["method", "endpoint"],
+    buckets=_FAST_BUCKETS,
+)
+
+# resolve(): por tipo de record; outcome = ok | no_healthy
+resolve_total = Counter("dns_api_resolve_total", "Resoluciones por tipo de record", ["type", "outcome"])
+resolve_duration = Histogram(
+    "dns_api_resolve_duration_seconds", "Latencia de resolve() por tipo de record", ["type"], buckets=_FAST_BUCKETS
+)
+
+firestore_duration = Histogram(
+    "dns_api_firestore_duration_seconds", "Latencia de llamadas a Firestore", ["collection", "op"],
+    buckets=_NETWORK_BUCKETS,
+)
+firestore_errors = Counter("dns_api_firestore_errors_total", "Llamadas a Firestore con error", ["collection", "op"])
+
+upstream_rtt = Histogram(
+    "dns_api_upstream_rtt_seconds", "RTT de queries reenviadas al upstream", ["server", "proto"],
+    buckets=_NETWORK_BUCKETS,
+)
+upstream_timeouts = Counter("dns_api_upstream_timeouts_total", "Timeouts del upstream", ["server", "proto"])
+upstream_tcp_fallback = Counter(
+    "dns_api_upstream_tcp_fallback_total", "Respuestas UDP truncadas reintentadas por TCP", ["server"]
+)
+upstream_hedges = Counter(
+    "dns_api_upstream_hedges_total", "Copias de queries enviadas a otro upstream (sent) y las que respondieron primero (won)",
+    ["outcome"],
+)
+upstream_coalesced = Counter(
+    "dns_api_upstream_coalesced_total", "Queries upstream que esperaron una query identica en vuelo en lugar de enviarse"
+)
+answer_cache_lookups = Counter("dns_api_answer_cache_lookups_total", "Lookups del cache de respuestas", ["result"])
+answer_cache_prefetches = Counter(
+    "dns_api_answer_cache_prefetch_total", "Refrescos anticipados de respuestas cacheadas", ["outcome"]
+)
+answer_cache_stale_served = Counter(
+    "dns_api_answer_cache_stale_served_total", "Respuestas vencidas servidas (RFC 8767) por motivo", ["reason"]
+)
+# GET /api/records: not_modified (304) | full | delta | resync (version desconocida)
+records_feed = Counter("dns_api_records_feed_total", "Respuestas de GET /api/records por tipo", ["kind"])
+
+
+@contextmanager
+def firestore_timer(collection: str, op: str):
+    """Mide una llamada a Firestore (y cuenta el error si lanza)."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        firestore_errors.labels(collection, op).inc()
+        raise
+    finally:
+        firestore_duration.labels(collection, op).observe(time.perf_counter() - start)
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposicion en formato texto de Prometheus (agregada entre workers si corresponde)."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def process_exit():
+    """Al terminar un worker: limpia sus gauges 'live' del directorio compartido."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
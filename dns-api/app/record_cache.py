@@ -0,0 +1,399 @@
+"""
+Cache por proceso de la coleccion records.
+Se mantiene al dia con storage.watch_records (on_snapshot de Firestore, o el
+log de cambios de SQLite), asi get_record/get_all_records/exists leen de
+memoria en vez de ir al storage por request. Si el listener se cae, las
+lecturas vuelven a ir directo al storage hasta que se reconecta (verificacion
+cada RECORD_CACHE_CHECK_INTERVAL_S).
+
+Feed de cambios para GET /api/records, por proyeccion (lista de campos; la
+coleccion completa es la proyeccion None):
+- digest: XOR de un hash por record (fqdn + campos proyectados), actualizado
+  en cada cambio. Depende solo del contenido, asi que es el mismo en todos
+  los workers sincronizados: es el ETag y tambien la version del feed.
+  rr_index no cuenta (UNVERSIONED_FIELDS): un cambio solo de rr_index no
+  cambia el ETag ni aparece en los deltas.
+- log: seq del ultimo cambio de cada fqdn en esa proyeccion (los borrados
+  quedan como tombstones) e historial digest -> seq de las versiones
+  recientes, asi changes_since() recorre solo lo que cambio en los campos
+  pedidos; un cambio de health no aparece en la proyeccion fqdn,targets.
+  Una version que no esta en el historial (muy vieja, o de un worker que
+  vio otros estados intermedios) pide la coleccion completa.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import resolve_plan
+    from storage import get_storage
+    from config import (
+        RECORD_CACHE_ENABLED, RECORD_CACHE_CHECK_INTERVAL_S, RECORD_CACHE_DIRTY_TIMEOUT_S, RECORD_FEED_HISTORY,
+        RECORD_FEED_MAX_PROJECTIONS, RECORD_FEED_MAX_TOMBSTONES,
+    )
+    from logs import get_logger
+except ImportError:
+    from . import resolve_plan
+    from .storage import get_storage
+    from .config import (
+        RECORD_CACHE_ENABLED, RECORD_CACHE_CHECK_INTERVAL_S, RECORD_CACHE_DIRTY_TIMEOUT_S, RECORD_FEED_HISTORY,
+        RECORD_FEED_MAX_PROJECTIONS, RECORD_FEED_MAX_TOMBSTONES,
+    )
+    from .logs import get_logger
+
+logger = get_logger("records")
+
+
+_records: Dict[str, dict] = {}
+# fqdn escritos por este proceso, pendientes del evento del listener -> vencimiento
+# (orden de vencimiento: se recorta desde el principio)
+_dirty: "OrderedDict[str, float]" = OrderedDict()
+_synced = False         # True cuando el listener entrego el snapshot completo
+_needs_reset = True     # el proximo snapshot reemplaza todo el contenido
+_lock = threading.Lock()
+_watch = None
+_supervisor: Optional[threading.Thread] = None
+_stop = threading.Event()
+_last_event = 0.0
+
+Fields = Optional[Tuple[str, ...]]
+
+# Campos que no cuentan para digest/version: el checkpoint de rr_index
+# (RR_CHECKPOINT_INTERVAL_S) no debe cambiar el ETag en cada intervalo
+UNVERSIONED_FIELDS = ("rr_index",)
+
+
+def project(record: dict, fields: Fields) -> dict:
+    """Solo los campos pedidos del record (fields None = todo)."""
+    if fields is None:
+        return record
+    return {k: record[k] for k in fields if k in record}
+
+
+def record_hash(fqdn: str, record: dict) -> int:
+    if any(k in record for k in UNVERSIONED_FIELDS):
+        record = {k: v for k, v in record.items() if k not in UNVERSIONED_FIELDS}
+    body = json.dumps([fqdn, record], sort_keys=True, separators=(",", ":"), default=str)
+    return int.from_bytes(hashlib.blake2b(body.encode(), digest_size=8).digest(), "big")
+
+
+def digest_of(records: List[dict], fields: Fields = None) -> str:
+    """Digest de una lista de records leida del storage (mismo valor que el del cache)."""
+    digest = 0
+    for record in records:
+        fqdn = record.get("fqdn")
+        if fqdn:
+            digest ^= record_hash(fqdn, project(record, fields))
+    return f"{digest:016x}"
+
+
+class _Feed:
+    """Digest, log de cambios e historial de versiones de una proyeccion."""
+
+    def __init__(self, fields: Fields):
+        self.fields = fields
+        self.reset()
+
+    def reset(self):
+        self.hashes = {fqdn: record_hash(fqdn, project(record, self.fields)) for fqdn, record in _records.items()}
+        self.digest = 0
+        for h in self.hashes.values():
+            self.digest ^= h
+        self.seq = self.floor = 0     # floor: seq mas viejo que changes_since puede responder
+        self.log: "OrderedDict[str, int]" = OrderedDict((fqdn, 0) for fqdn in _records)
+        self.history: "OrderedDict[str, int]" = OrderedDict([(self.version(), 0)])
+
+    def version(self) -> str:
+        return f"{self.digest:016x}"
+
+    def apply(self, fqdn: str, record: Optional[dict]) -> bool:
+        """Registra el cambio (record None = borrado). False si la proyeccion no cambio."""
+        old = self.hashes.get(fqdn)
+        if record is None:
+            if old is None:
+                return False
+            del self.hashes[fqdn]
+            self.digest ^= old
+        else:
+            new = record_hash(fqdn, project(record, self.fields))
+            if new == old:
+                return False
+            self.hashes[fqdn] = new
+            self.digest ^= new if old is None else old ^ new
+        self.seq += 1
+        self.log[fqdn] = self.seq
+        self.log.move_to_end(fqdn)
+        # Recortar tombstones viejos: quien pida una version anterior recibe todo
+        while len(self.log) > len(_records) + RECORD_FEED_MAX_TOMBSTONES:
+            _, self.floor = self.log.popitem(last=False)
+        version = self.version()
+        self.history[version] = self.seq
+        self.history.move_to_end(version)
+        while len(self.history) > RECORD_FEED_HISTORY:
+            self.history.popitem(last=False)
+        return True
+
+    def since(self, version: str) -> Tuple[bool, List[dict], List[str]]:
+        seq = self.history.get(version)
+        if seq is None or seq < self.floor:
+            return True, list(_records.values()), []
+        records, deleted = [], []
+        for fqdn in reversed(self.log):
+            if self.log[fqdn] <= seq:
+                break
+            record = _records.get(fqdn)
+            if record is None:
+                deleted.append(fqdn)
+            else:
+                records.append(record)
+        return False, records, deleted
+
+
+# Feeds por proyeccion (LRU; None = coleccion completa, siempre presente). Con _lock tomado
+_feeds: "OrderedDict[Fields, _Feed]" = OrderedDict()
+_generation = 0         # crece en cada resincronizacion completa
+
+
+def _feed(fields: Fields) -> _Feed:
+    feed = _feeds.get(fields)
+    if feed is None:
+        feed = _feeds[fields] = _Feed(fields)
+        while len(_feeds) > RECORD_FEED_MAX_PROJECTIONS + 1:
+            oldest = next(k for k in _feeds if k is not None)
+            del _feeds[oldest]
+    _feeds.move_to_end(fields)
+    return feed
+
+
+def _reset_feeds():
+    global _generation
+    _generation += 1
+    _feed(None)
+    for feed in _feeds.values():
+        feed.reset()
+
+
+def _put(fqdn: str, record: Optional[dict]):
+    """Aplica un cambio al cache y a los feeds (record None = borrado)."""
+    if record is None:
+        _records.pop(fqdn, None)
+        resolve_plan.forget(fqdn)
+    else:
+        _records[fqdn] = record
+    # Si el record completo no cambio, ninguna proyeccion cambio
+    if not _feed(None).apply(fqdn, record):
+        return
+    for fields, feed in _feeds.items():
+        if fields is not None:
+            feed.apply(fqdn, record)
+
+
+def _on_snapshot(col_snapshot, changes, read_time):
+    """Callback del listener (corre en un thread del backend)."""
+    global _records, _synced, _needs_reset, _last_event
+    with _lock:
+        if _needs_reset:
+            # Primer snapshot tras (re)conectar: reemplaza todo, descarta borrados perdidos
+            _records = {doc.id: doc.to_dict() for doc in col_snapshot}
+            _dirty.clear()
+            _reset_feeds()
+            resolve_plan.forget()
+            _needs_reset = False
+        else:
+            for change in changes:
+                doc = change.document
+                _put(doc.id, None if change.type.name == "REMOVED" else doc.to_dict())
+                _dirty.pop(doc.id, None)
+        _synced = True
+        _last_event = time.monotonic()
+
+
+def _subscribe():
+    global _watch, _synced, _needs_reset
+    with _lock:
+        _synced = False
+        _needs_reset = True
+    old, _watch = _watch, None
+    if old is not None:
+        try:
+            old.unsubscribe()
+        except Exception:
+            pass
+    _watch = get_storage().watch_records(_on_snapshot)
+
+
+def _supervise():
+    """Reconecta el listener si se cerro; mientras tanto las lecturas van directo."""
+    global _synced
+    while not _stop.wait(RECORD_CACHE_CHECK_INTERVAL_S):
+        if _watch is not None and _watch.is_active:
+            continue
+        _synced = False
+        try:
+            _subscribe()
+            logger.info("Listener de records reconectado")
+        except Exception as e:
+            logger.warning("records listener restart failed: %s", e)
+
+
+def start():
+    """Inicia el listener y el supervisor (una vez por worker)."""
+    global _supervisor
+    if not RECORD_CACHE_ENABLED or _supervisor is not None:
+        return
+    try:
+        _subscribe()
+    except Exception as e:
+        logger.warning("records listener could not start: %s", e)
+    _stop.clear()
+    _supervisor = threading.Thread(target=_supervise, name="records-cache-supervisor", daemon=True)
+    _supervisor.start()
+
+
+def stop():
+    global _watch, _supervisor, _synced
+    _stop.set()
+    _supervisor = None
+    _synced = False
+    if _watch is not None:
+        try:
+            _watch.unsubscribe()
+        except Exception:
+            pass
+        _watch = None
+
+
+def is_synced() -> bool:
+    return _synced
+
+
+def lookup(fqdn: str) -> Tuple[bool, Optional[dict]]:
+    """
+    Retorna (hit, record). Solo hay hits con el cache sincronizado; ahi la
+    ausencia de un fqdn tambien es un hit (record = None). Los records
+    retornados son compartidos: no se deben modificar.
+    """
+    if not _synced or _dirty.get(fqdn, 0.0) > time.monotonic():
+        return False, None
+    return True, _records.get(fqdn)
+
+
+def peek(fqdn: str) -> Tuple[bool, Optional[dict]]:
+    """Como lookup, pero tambien retorna el record en memoria de un fqdn dirty."""
+    if not _synced:
+        return False, None
+    return True, _records.get(fqdn)
+
+
+def read_token() -> Tuple[int, int]:
+    """Tomar antes de una lectura directa y pasarlo a store()."""
+    with _lock:
+        return _generation, _feed(None).seq
+
+
+def store(fqdn: str, record: Optional[dict], token: Tuple[int, int]):
+    """
+    Guarda el resultado de una lectura directa (tras un miss). No hace nada si
+    el cache no esta sincronizado (deshabilitado o listener caido: las lecturas
+    siguen yendo al storage) ni si el listener cambio el fqdn despues de tomar
+    token (la lectura puede ser mas vieja que lo que ya hay en memoria).
+    """
+    generation, seq = token
+    with _lock:
+        base = _feed(None)
+        if not _synced or generation != _generation or seq < base.floor or base.log.get(fqdn, 0) > seq:
+            return
+        _put(fqdn, record)
+        _dirty.pop(fqdn, None)
+
+
+def _clean() -> bool:
+    """Sincronizado y sin fqdn dirty vigentes (con _lock tomado); descarta las marcas vencidas."""
+    if not _synced:
+        return False
+    now = time.monotonic()
+    while _dirty:
+        fqdn, deadline = next(iter(_dirty.items()))
+        if deadline > now:
+            return False
+        del _dirty[fqdn]
+    return True
+
+
+def all_records() -> Optional[List[dict]]:
+    """Todos los records si el cache esta sincronizado y limpio, si no None."""
+    with _lock:
+        if not _clean():
+            return None
+        return list(_records.values())
+
+
+def normalize_fields(fields: Optional[Sequence[str]]) -> Fields:
+    """Proyeccion canonica: mismos campos en cualquier orden = mismo feed y ETag."""
+    if not fields:
+        return None
+    return tuple(sorted(set(fields)))
+
+
+def feed_state(fields: Fields = None) -> Optional[str]:
+    """Version (digest) de la proyeccion si el cache esta sincronizado y limpio, si no None."""
+    with _lock:
+        if not _clean():
+            return None
+        return _feed(fields).version()
+
+
+def snapshot(fields: Fields = None) -> Optional[Tuple[str, List[dict]]]:
+    """(version, records) consistentes entre si, o None como feed_state."""
+    with _lock:
+        if not _clean():
+            return None
+        return _feed(fields).version(), list(_records.values())
+
+
+def changes_since(version: str, fields: Fields = None) -> Optional[Tuple[str, bool, List[dict], List[str]]]:
+    """
+    (version, full, records, borrados) con los records cuya proyeccion cambio
+    despues de version. full=True si version no esta en el historial: records
+    trae entonces la coleccion completa. None si el cache no esta
+    sincronizado (leer del storage). Los records vienen completos: proyectar
+    con project().
+    """
+    with _lock:
+        if not _clean():
+            return None
+        feed = _feed(fields)
+        full, records, deleted = feed.since(version)
+        return feed.version(), full, records, deleted
+
+
+def invalidate(fqdn: Optional[str] = None):
+    """
+    Marca un fqdn (o todos) como escrito localmente: las lecturas de este
+    proceso iran directo al storage hasta que llegue el evento del listener,
+    o hasta RECORD_CACHE_DIRTY_TIMEOUT_S si no llega (la escritura no cambio
+    el documento, o el evento llego antes que esta marca).
+    """
+    deadline = time.monotonic() + RECORD_CACHE_DIRTY_TIMEOUT_S
+    with _lock:
+        for key in (list(_records) if fqdn is None else [fqdn]):
+            _dirty[key] = deadline
+            _dirty.move_to_end(key)
+    resolve_plan.forget(fqdn)
+
+
+def stats() -> dict:
+    return {
+        "enabled": RECORD_CACHE_ENABLED,
+        "synced": _synced,
+        "records": len(_records),
+        "dirty": len(_dirty),
+        "version": _feeds[None].version() if _synced and None in _feeds else None,
+        "feed_log": len(_feeds[None].log) if None in _feeds else 0,
+        "feed_projections": len(_feeds) - 1 if _feeds else 0,
+        "last_event_age_s": round(time.monotonic() - _last_event, 3) if _last_event else None,
+    }
@@ -8,107 +8,114 @@ Resolución DNS con algoritmos de balanceo inteligente:
 
 Todos verifican health antes de retornar.
 Si no hay targets healthy, retorna None.
+
+Los algoritmos trabajan sobre el plan compilado del record (resolve_plan):
+targets healthy ya filtrados y tablas por país/región/RTT precalculadas.
 """
 
+import asyncio
 import time
-import random
-from google.cloud import firestore
 
 try:
-    from utils import get_geo_location_from_db, get_geo_location_from_api
+    from utils import get_geo_location_from_db, get_geo_location_from_db_async, get_geo_location_from_api
+except ImportError:
+    from .utils import get_geo_location_from_db, get_geo_location_from_db_async, get_geo_location_from_api
+
+try:
+    import rr_state
+    from resolve_plan import get_plan
+    from decision_cache import decision_cache
 except ImportError:
-    from .utils import get_geo_location_from_db, get_geo_location_from_api
+    from . import rr_state
+    from .resolve_plan import get_plan
+    from .decision_cache import decision_cache
 
 try:
-    from firebase_client import get_client
+    import metrics
+    from logs import get_logger, get_query_logger
 except ImportError:
-    from .firebase_client import get_client
+    from . import metrics
+    from .logs import get_logger, get_query_logger
+
+RECORD_TYPES = ("single", "multi", "weight", "geo", "roundtrip")
+
+logger = get_logger("resolve")
+# Una linea por resolucion: muestreada (LOG_QUERY_RATE_PER_S)
+qlog = get_query_logger("resolve")
 
 
 # ---------------------------------------------------------------------------
 # FUNCIONES AUXILIARES
 # ---------------------------------------------------------------------------
 
-def get_record(fqdn: str):
-    """Obtiene un record DNS desde Firestore por FQDN."""
-    client = get_client()
-    if not client:
-        return None
-    doc = client.collection("records").document(fqdn).get()
-    return doc.to_dict() if doc.exists else None
-
-
 def get_health_record(record: dict, target_id: str):
     """Obtiene información de health de un target."""
     return record.get("health", {}).get(target_id)
 
 
+def _client_location(client_ip: str, geo_memo: dict = None) -> dict:
+    """Geolocalizacion del cliente; geo_memo (ej. en batch) evita repetirla por IP."""
+    if geo_memo is None:
+        return get_geo_location_from_db(client_ip)
+    info = geo_memo.get(client_ip)
+    if info is None:
+        info = geo_memo[client_ip] = get_geo_location_from_db(client_ip)
+    return info
+
+
 # ---------------------------------------------------------------------------
 # ALGORITMOS DE RESOLUCIÓN
 # ---------------------------------------------------------------------------
 
+def _result(target, rtype: str) -> dict:
+    return {"ip": target.ip, "target_id": target.id, "type": rtype}
+
+
 def resolve_single(record: dict):
     """Devuelve siempre el mismo IP si está healthy."""
-    targets = record.get("targets", [])
-    if not targets:
-        return None
-
-    target = targets[0]
-    health = get_health_record(record, target["id"])
-    if not health or health.get("status") != "healthy":
+    target = get_plan(record).single
+    if target is None:
         return None
 
-    print(f"[SINGLE] Retornando {target['ip']} (healthy)")
-    return {"ip": target["ip"], "target_id": target["id"], "type": "single"}
+    qlog.info("[SINGLE] Retornando %s (healthy)", target.ip)
+    return _result(target, "single")
 
 
 def resolve_multi(record: dict):
     """Round-robin entre targets healthy."""
-    targets = record.get("targets", [])
-    if not targets:
+    plan = get_plan(record)
+    if not plan.healthy:
         return None
 
-    healthy = [t for t in targets if get_health_record(record, t["id"]) and get_health_record(record, t["id"]).get("status") == "healthy"]
-    if not healthy:
-        return None
-
-    rr_index = record.get("rr_index", 0)
-    selected = healthy[rr_index % len(healthy)]
-
-    # Actualiza índice para la próxima resolución
-    client = get_client()
-    if client:
-        client.collection("records").document(record["fqdn"]).update({"rr_index": (rr_index + 1) % len(healthy)})
+    # Contador fuera de Firestore (ver rr_state); rr_index guardado solo sirve de semilla
+    rr_index = rr_state.next_index(plan.fqdn, plan.rr_seed)
+    selected = plan.healthy[rr_index % len(plan.healthy)]
 
-    print(f"[MULTI] Seleccionado {selected['ip']} (RR index {rr_index})")
-    return {"ip": selected["ip"], "target_id": selected["id"], "type": "multi"}
+    qlog.info("[MULTI] Seleccionado %s (RR index %d)", selected.ip, rr_index)
+    return _result(selected, "multi")
 
 
 def resolve_weight(record: dict):
-    """Distribución ponderada por pesos."""
-    targets = record.get("targets", [])
-    if not targets:
+    """Distribución ponderada por pesos (tabla alias del plan, O(1) por query)."""
+    plan = get_plan(record)
+    if plan.alias is None:
         return None
 
-    healthy = [t for t in targets if get_health_record(record, t["id"]) and get_health_record(record, t["id"]).get("status") == "healthy"]
-    if not healthy:
-        return None
-
-    total_weight = sum(t.get("weight", 1) for t in healthy)
-    rand_value = random.uniform(0, total_weight)
-    cumulative = 0
-    for target in healthy:
-        cumulative += target.get("weight", 1)
-        if rand_value <= cumulative:
-            print(f"[WEIGHT] Seleccionado {target['ip']} con peso {target.get('weight', 1)}")
-            return {"ip": target["ip"], "target_id": target["id"], "type": "weight"}
+    target = plan.alias.sample()
+    qlog.info("[WEIGHT] Seleccionado %s con peso %s", target.ip, target.weight)
+    return _result(target, "weight")
 
-    return None
 
+def resolve_geo(record: dict, client_ip: str, geo_memo: dict = None):
+    """
+    Selección por país/región del cliente.
+    geo_memo: cache ip -> geolocalizacion compartido entre llamadas (ej. en batch).
+    """
+    plan = get_plan(record)
+    if not plan.healthy:
+        return None
 
-def resolve_geo(record: dict, client_ip: str):
-    """Selección por país/región del cliente."""
-    client_info = get_geo_location_from_db(client_ip)
+    client_info = _client_location(client_ip, geo_memo)
     country = client_info.get("country", "unknown")
     region = client_info.get("region", "unknown")
 
@@ -117,75 +124,95 @@ def resolve_geo(record: dict, client_ip: str):
         country = client_info.get("country", "unknown")
         region = client_info.get("region", "unknown")
 
-    targets = record.get("targets", [])
-    healthy_targets = []
-    for t in targets:
-        health = get_health_record(record, t["id"])
-        if health and health.get("status") == "healthy":
-            geo = t.get("geo_location", {})
-            if geo.get("country") == country or geo.get("region") == region:
-                healthy_targets.append(t)
+    selected = plan.geo_target(country, region)
+    qlog.info("[GEO] Cliente %s -> %s (%s, %s)", client_ip, selected.ip, region, country)
+    return _result(selected, "geo")
 
-    if not healthy_targets:
-        healthy_targets = [t for t in targets if get_health_record(record, t["id"]).get("status") == "healthy"]
 
-    if not healthy_targets:
-        return None
-
-    selected = healthy_targets[0]
-    print(f"[GEO] Cliente {client_ip} -> {selected['ip']} ({region}, {country})")
-    return {"ip": selected["ip"], "target_id": selected["id"], "type": "geo"}
-
-
-def resolve_roundtrip(record: dict, client_ip: str):
+def resolve_roundtrip(record: dict, client_ip: str, geo_memo: dict = None):
     """
     Selección por menor RTT de la región del cliente.
     Simula comportamiento real de Health Checkers distribuidos.
     """
-    client_info = get_geo_location_from_db(client_ip)
+    plan = get_plan(record)
+    if not plan.healthy:
+        return None
+
+    client_info = _client_location(client_ip, geo_memo)
     client_region = client_info.get("region", "unknown")
 
     if client_region == "unknown":
-        print(f"[ROUNDTRIP] Región desconocida para IP {client_ip}. Usando RTT general.")
+        qlog.info("[ROUNDTRIP] Región desconocida para IP %s. Usando RTT general.", client_ip)
         client_region = "na"  # fallback default
 
-    targets = record.get("targets", [])
-    if not targets:
-        return None
-
-    best_target = None
-    best_rtt = float("inf")
-
-    for target in targets:
-        health = get_health_record(record, target["id"])
-        if not health or health.get("status") != "healthy":
-            continue
-
-        rtt_info = health.get("rtt", {})
-        rtt_by_region = rtt_info.get("by_region", {})
-        rtt_value = rtt_by_region.get(client_region, rtt_info.get("last_ms", 999))
-
-        if rtt_value < best_rtt:
-            best_target = target
-            best_rtt = rtt_value
-
-    if not best_target:
+    best = plan.roundtrip_target(client_region)
+    if best is None:
         return None
+    best_target, best_rtt = best
 
-    print(f"[ROUNDTRIP] Cliente región={client_region} → {best_target['ip']} (RTT={best_rtt} ms)")
-    return {"ip": best_target["ip"], "target_id": best_target["id"], "type": "roundtrip"}
+    qlog.info("[ROUNDTRIP] Cliente región=%s → %s (RTT=%s ms)", client_region, best_target.ip, best_rtt)
+    return _result(best_target, "roundtrip")
 
 
 # ---------------------------------------------------------------------------
 # DISPATCHER PRINCIPAL
 # ---------------------------------------------------------------------------
 
-def resolve(record: dict, client_ip: str):
-    """Despacha según el tipo de record."""
+def _resolve_cached(resolver, record: dict, client_ip: str, geo_memo: dict = None):
+    """
+    geo/roundtrip: la decision solo depende del record y de la red del cliente,
+    se reutiliza por (fqdn, prefijo) mientras el plan del record sea el mismo.
+    """
+    plan = get_plan(record)
+    key = decision_cache.make_key(plan.fqdn, client_ip)
+    if key is not None:
+        cached = decision_cache.get(key, plan)
+        if cached is not None:
+            return cached
+    result = resolver(record, client_ip, geo_memo)
+    if key is not None and result is not None:
+        decision_cache.put(key, plan, result)
+    return result
+
+
+def resolve(record: dict, client_ip: str, geo_memo: dict = None):
+    """
+    Despacha según el tipo de record.
+    geo_memo (opcional): dict ip -> geolocalizacion compartido entre llamadas.
+    """
     if not record or "type" not in record:
         return None
 
     rtype = record["type"]
+    start = time.perf_counter()
+    result = _dispatch(rtype, record, client_ip, geo_memo)
+    if rtype in RECORD_TYPES:
+        metrics.resolve_duration.labels(rtype).observe(time.perf_counter() - start)
+        metrics.resolve_total.labels(rtype, "ok" if result else "no_healthy").inc()
+    return result
+
+
+async def resolve_async(record: dict, client_ip: str, geo_memo: dict = None):
+    """
+    resolve() para el event loop. Todo es CPU en memoria salvo la ubicacion
+    del cliente: se busca antes con la variante async del storage (dejandola
+    en geo_memo) y, si un record geo igual necesitaria ip-api, la resolucion
+    va a un thread.
+    """
+    if not record or record.get("type") not in ("geo", "roundtrip"):
+        return resolve(record, client_ip, geo_memo)
+
+    if geo_memo is None:
+        geo_memo = {}
+    info = geo_memo.get(client_ip)
+    if info is None:
+        info = geo_memo[client_ip] = await get_geo_location_from_db_async(client_ip)
+    if record["type"] == "geo" and info.get("country", "unknown") == "unknown" and info.get("region", "unknown") == "unknown":
+        return await asyncio.to_thread(resolve, record, client_ip, geo_memo)
+    return resolve(record, client_ip, geo_memo)
+
+
+def _dispatch(rtype: str, record: dict, client_ip: str, geo_memo: dict = None):
     if rtype == "single":
         return resolve_single(record)
     elif rtype == "multi":
@@ -193,9 +220,9 @@ def resolve(record: dict, client_ip: str):
     elif rtype == "weight":
         return resolve_weight(record)
     elif rtype == "geo":
-        return resolve_geo(record, client_ip)
+        return _resolve_cached(resolve_geo, record, client_ip, geo_memo)
     elif rtype == "roundtrip":
-        return resolve_roundtrip(record, client_ip)
+        return _resolve_cached(resolve_roundtrip, record, client_ip, geo_memo)
     else:
-        print(f"[WARN] Tipo de record desconocido: {rtype}")
+        logger.warning("Tipo de record desconocido: %s", rtype)
         return None
@@ -0,0 +1,153 @@
+"""
+Plan de resolucion compilado por record.
+
+Cada record se compila una vez (cuando cambia) a una estructura inmutable
+con todo lo que necesitan los algoritmos de resolve_ip, asi una query no
+recorre los dicts anidados de Firestore:
+- healthy: targets healthy en el orden del record (tuplas compactas).
+- weight: tabla alias sobre los healthy.
+- geo: primer target healthy por pais y por region.
+- roundtrip: mejor target (y su RTT) por region del cliente.
+
+Los records de record_cache se reemplazan por un dict nuevo en cada cambio,
+asi que la identidad del dict alcanza para saber si el plan sigue vigente.
+Si cambio el dict pero solo en rr_index (checkpoint de rr_state), el plan
+se reusa con la semilla nueva en vez de recompilarlo.
+record_cache llama a forget() cuando un record se borra o se invalida, asi
+los planes de fqdn que ya no existen no quedan en memoria.
+"""
+
+from typing import Dict, NamedTuple, Optional, Tuple
+
+try:
+    from alias_table import AliasTable
+except ImportError:
+    from .alias_table import AliasTable
+
+DEFAULT_RTT_MS = 999
+
+
+class Target(NamedTuple):
+    id: str
+    ip: str
+    weight: float
+
+
+class RecordPlan:
+    __slots__ = ("fqdn", "type", "single", "healthy", "rr_seed", "alias",
+                 "first_by_country", "first_by_region", "rtt_by_region", "rtt_default")
+
+    def __init__(self, record: dict):
+        self.fqdn = record.get("fqdn")
+        self.type = record.get("type")
+        health = record.get("health") or {}
+        targets = record.get("targets") or []
+
+        pairs = []  # (Target, health del target) de los healthy
+        for t in targets:
+            h = health.get(t.get("id"))
+            if h and h.get("status") == "healthy":
+                pairs.append((Target(t.get("id"), t.get("ip"), t.get("weight", 1)), h))
+        self.healthy: Tuple[Target, ...] = tuple(p[0] for p in pairs)
+
+        # single: solo cuenta el primer target del record
+        self.single: Optional[Target] = None
+        if targets and pairs and pairs[0][0].id == targets[0].get("id"):
+            self.single = pairs[0][0]
+
+        self.rr_seed = record.get("rr_index", 0)
+        self.alias: Optional[AliasTable] = None
+        self.first_by_country: Dict[str, int] = {}
+        self.first_by_region: Dict[str, int] = {}
+        self.rtt_by_region: Dict[str, Tuple[Target, float]] = {}
+        self.rtt_default: Optional[Tuple[Target, float]] = None
+
+        if self.type == "weight" and self.healthy:
+            self.alias = AliasTable(self.healthy, [t.weight for t in self.healthy])
+        elif self.type == "geo":
+            self._compile_geo(targets, health)
+        elif self.type == "roundtrip":
+            self._compile_roundtrip(pairs)
+
+    def _compile_geo(self, targets, health):
+        index = 0
+        for t in targets:
+            h = health.get(t.get("id"))
+            if not (h and h.get("status") == "healthy"):
+                continue
+            geo = t.get("geo_location") or {}
+            if geo.get("country") is not None:
+                self.first_by_country.setdefault(geo["country"], index)
+            if geo.get("region") is not None:
+                self.first_by_region.setdefault(geo["region"], index)
+            index += 1
+
+    def _compile_roundtrip(self, pairs):
+        rows = []
+        regions = set()
+        for target, h in pairs:
+            rtt_info = h.get("rtt") or {}
+            by_region = rtt_info.get("by_region") or {}
+            rows.append((target, by_region, rtt_info.get("last_ms", DEFAULT_RTT_MS)))
+            regions.update(by_region)
+
+        def best(region):
+            # Regiones sin medicion propia usan last_ms del target; empate: el primero
+            best_target, best_rtt = None, float("inf")
+            for target, by_region, last_ms in rows:
+                rtt = by_region.get(region, last_ms)
+                if rtt < best_rtt:
+                    best_target, best_rtt = target, rtt
+            return (best_target, best_rtt) if best_target is not None else None
+
+        self.rtt_by_region = {region: best(region) for region in regions}
+        self.rtt_default = best(None)
+
+    def geo_target(self, country: str, region: str) -> Optional[Target]:
+        """Primer healthy del pais o region del cliente; si no hay, el primer healthy."""
+        if not self.healthy:
+            return None
+        i = min(self.first_by_country.get(country, len(self.healthy)),
+                self.first_by_region.get(region, len(self.healthy)))
+        return self.healthy[i] if i < len(self.healthy) else self.healthy[0]
+
+    def roundtrip_target(self, region: str) -> Optional[Tuple[Target, float]]:
+        return self.rtt_by_region.get(region, self.rtt_default)
+
+
+_plans: Dict[str, Tuple[dict, RecordPlan]] = {}
+
+
+def get_plan(record: dict) -> RecordPlan:
+    """Plan del record; se recompila solo si el dict cambio."""
+    fqdn = record.get("fqdn")
+    cached = _plans.get(fqdn)
+    if cached is not None and cached[0] is record:
+        return cached[1]
+    if cached is not None and _same_except_rr(cached[0], record):
+        plan = cached[1]
+        plan.rr_seed = record.get("rr_index", 0)
+        _plans[fqdn] = (record, plan)
+        return plan
+    plan = RecordPlan(record)
+    if fqdn is not None:
+        _plans[fqdn] = (record, plan)
+    return plan
+
+
+def _same_except_rr(old: dict, new: dict) -> bool:
+    if old.keys() - {"rr_index"} != new.keys() - {"rr_index"}:
+        return False
+    return all(old[k] == new[k] for k in old if k != "rr_index")
+
+
+def forget(fqdn: Optional[str] = None):
+    """Descarta el plan de un fqdn (o todos)."""
+    if fqdn is None:
+        _plans.clear()
+    else:
+        _plans.pop(fqdn, None)
+
+
+def clear():
+    _plans.clear()
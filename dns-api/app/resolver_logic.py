@@ -1,20 +1,44 @@
 """
-Reenvio de queries DNS a servidores upstream via UDP/TCP.
+Reenvio de queries DNS a servidores upstream via UDP/TCP (asincrono, ver upstream.py).
 Maneja queries no-estandar o que no existen en Firebase.
+Por defecto usa el pool de UPSTREAM_DNS (mejor servidor + hedging al siguiente).
 Soporta fallback TCP cuando respuesta UDP esta truncada.
+Las respuestas se cachean respetando su TTL (ver answer_cache.py).
+Queries iguales en vuelo al mismo tiempo comparten un solo intercambio con el
+upstream (ver single_flight.py).
+Las entradas populares se refrescan en background antes de vencer, y si el
+upstream no responde se sirve la respuesta vencida (RFC 8767).
 """
 
+import asyncio
 import base64
 import socket
 import time
-from typing import Tuple
+from typing import Optional, Set
+
+try:
+    import dns_wire
+    import metrics
+    from answer_cache import answer_cache, make_key
+    from config import DEFAULT_TIMEOUT_MS, ANSWER_CACHE_PREFETCH_MAX_INFLIGHT, ANSWER_CACHE_STALE_WAIT_MS
+    from single_flight import SingleFlight
+    from upstream import get_tcp_forwarder, get_upstream_pool
+except ImportError:
+    from . import dns_wire
+    from . import metrics
+    from .answer_cache import answer_cache, make_key
+    from .config import DEFAULT_TIMEOUT_MS, ANSWER_CACHE_PREFETCH_MAX_INFLIGHT, ANSWER_CACHE_STALE_WAIT_MS
+    from .single_flight import SingleFlight
+    from .upstream import get_tcp_forwarder, get_upstream_pool
 
 # --- CONFIGURACION ---
-UPSTREAM_HOST = "8.8.8.8"    # Servidor DNS upstream (Google DNS por defecto)
 UPSTREAM_PORT = 53           # Puerto DNS estandar
-DEFAULT_TIMEOUT_MS = 2000    # Timeout por defecto en milisegundos
 MAX_PAYLOAD_BYTES = 65535    # Limite razonable para un paquete DNS (64KB)
-RECV_BUF = 65535             # Tamaño de buffer para recvfrom
+
+# Intercambios con el upstream en vuelo por (pregunta, bit DO, flags RD/CD, servidor)
+upstream_flights = SingleFlight()
+# Refrescos anticipados en curso (referencia fuerte para que no se recolecten)
+_prefetch_tasks: Set[asyncio.Task] = set()
 
 # --- FUNCIONES AUXILIARES ---
 
@@ -29,91 +53,152 @@ def _check_if_dns_response_is_truncated(dns_response_bytes: bytes) -> bool:
     dns_header_flags = int.from_bytes(dns_response_bytes[2:4], "big")
     return (dns_header_flags & 0x0200) != 0
 
-def send_dns_query_via_udp(dns_query_payload: bytes, upstream_server: str, server_port: int, timeout_milliseconds: int) -> Tuple[bytes, int, str]:
-    """Envia query DNS via UDP y retorna (response_bytes, rtt_ms, server_address)."""
-    timeout_seconds = _convert_milliseconds_to_seconds(timeout_milliseconds)
-    query_start_time = time.monotonic()
+def _adapt_shared_response(dns_response_bytes: bytes, dns_query_bytes: bytes, question_end: int) -> bytes:
+    """Respuesta de otro llamador con el ID y el case de la pregunta de esta query."""
+    out = bytearray(dns_response_bytes)
+    out[0:2] = dns_query_bytes[0:2]
+    try:
+        if dns_wire.parse_question(dns_response_bytes).end == question_end:
+            out[dns_wire.HEADER_LEN:question_end] = dns_query_bytes[dns_wire.HEADER_LEN:question_end]
+    except (ValueError, IndexError):
+        pass
+    return bytes(out)
+
+def _flight_key(dns_query_bytes: bytes, cache_key, upstream_dns_server: Optional[str], dns_server_port: int):
+    return (
+        cache_key,
+        dns_wire.get_flags(dns_query_bytes) & (dns_wire.FLAG_RD | dns_wire.FLAG_CD),
+        upstream_dns_server,
+        dns_server_port,
+    )
+
+def _start_prefetch(dns_query_bytes: bytes, cache_key, timeout_milliseconds: int,
+                    upstream_dns_server: Optional[str], dns_server_port: int):
+    """Refresca en background una entrada del cache que esta por vencer."""
+    async def prefetch():
+        try:
+            await upstream_flights.do(
+                _flight_key(dns_query_bytes, cache_key, upstream_dns_server, dns_server_port),
+                lambda: _exchange(dns_query_bytes, timeout_milliseconds, upstream_dns_server, dns_server_port, cache_key),
+            )
+            metrics.answer_cache_prefetches.labels("done").inc()
+        except Exception:
+            metrics.answer_cache_prefetches.labels("failed").inc()
 
-    # Resolver direccion del servidor (soporta nombres DNS e IPs)
-    # Retorna lista de posibles direcciones
-    address_info_list = socket.getaddrinfo(upstream_server, server_port, proto=socket.IPPROTO_UDP)
-    
-    # Usar la primera direccion disponible
-    socket_family, socket_type, protocol, canonical_name, socket_address = address_info_list[0]
+    metrics.answer_cache_prefetches.labels("started").inc()
+    task = asyncio.ensure_future(prefetch())
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
 
-    # Crear socket UDP, enviar query y esperar respuesta
-    with socket.socket(socket_family, socket.SOCK_DGRAM) as udp_socket:
-        udp_socket.settimeout(timeout_seconds)
+def _serve_stale(dns_query_bytes: bytes, question_key, reason: str):
+    stale_response = answer_cache.get_stale(question_key[0], dns_query_bytes, question_key[1])
+    if stale_response is not None:
+        metrics.answer_cache_stale_served.labels(reason).inc()
+    return stale_response
+
+# --- FUNCION PRINCIPAL ---
+
+async def forward_dns_query(dns_query_bytes: bytes, timeout_milliseconds: int = DEFAULT_TIMEOUT_MS, upstream_dns_server: Optional[str] = None, dns_server_port: int = UPSTREAM_PORT):
+    """
+    Reenvia una query DNS (bytes wire) al upstream. Retorna (response_bytes, rtt_ms, server).
+    Sin upstream_dns_server usa el pool de UPSTREAM_DNS.
+    """
+    # 1) Buscar en el cache de respuestas (la misma pregunta ya resuelta)
+    question_key = make_key(dns_query_bytes)
+    use_cache = question_key is not None and answer_cache.max_entries > 0
+    stale_available = False
+    if use_cache:
+        cached_response = answer_cache.get(question_key[0], dns_query_bytes, question_key[1])
+        metrics.answer_cache_lookups.labels("hit" if cached_response is not None else "miss").inc()
+        if cached_response is not None:
+            # Popular y por vencer: refrescar en background (el cliente no espera)
+            if len(_prefetch_tasks) < ANSWER_CACHE_PREFETCH_MAX_INFLIGHT and answer_cache.should_prefetch(question_key[0]):
+                _start_prefetch(dns_query_bytes, question_key[0], timeout_milliseconds, upstream_dns_server, dns_server_port)
+            return cached_response, 0, "cache"
+        # El upstream fallo hace poco para esta pregunta: respuesta vencida sin volver a esperar
+        if answer_cache.recently_failed(question_key[0]):
+            stale_response = _serve_stale(dns_query_bytes, question_key, "recheck")
+            if stale_response is not None:
+                return stale_response, 0, "cache (stale)"
+        stale_available = answer_cache.has_stale(question_key[0])
+
+    if question_key is None:
+        # Sin pregunta parseable no hay con que agrupar
+        return await _exchange(dns_query_bytes, timeout_milliseconds, upstream_dns_server, dns_server_port, None)
+
+    # 2) Single-flight: si la misma pregunta ya esta en vuelo, esperar esa respuesta.
+    #    Con una respuesta vencida disponible se espera como maximo ANSWER_CACHE_STALE_WAIT_MS;
+    #    el intercambio sigue en background y actualiza el cache si termina bien.
+    wait_ms = min(timeout_milliseconds, ANSWER_CACHE_STALE_WAIT_MS) if stale_available else timeout_milliseconds
+    query_start_time = time.monotonic()
+    try:
+        (dns_response_bytes, round_trip_time_ms, contacted_server), shared = await upstream_flights.do(
+            _flight_key(dns_query_bytes, question_key[0], upstream_dns_server, dns_server_port),
+            lambda: _exchange(dns_query_bytes, timeout_milliseconds, upstream_dns_server, dns_server_port,
+                              question_key[0] if use_cache else None),
+            _convert_milliseconds_to_seconds(wait_ms),
+        )
+    except (socket.timeout, OSError, ConnectionError) as e:
+        stale_response = None
+        if use_cache:
+            answer_cache.mark_failed(question_key[0])
+            stale_response = _serve_stale(dns_query_bytes, question_key,
+                                          "timeout" if isinstance(e, socket.timeout) else "error")
+        if stale_response is None:
+            raise
+        return stale_response, int((time.monotonic() - query_start_time) * 1000), "cache (stale)"
+
+    if use_cache and dns_wire.get_rcode(dns_response_bytes) == dns_wire.RCODE_SERVFAIL:
+        # SERVFAIL del upstream: mejor la respuesta vencida (RFC 8767)
+        answer_cache.mark_failed(question_key[0])
+        stale_response = _serve_stale(dns_query_bytes, question_key, "servfail")
+        if stale_response is not None:
+            return stale_response, round_trip_time_ms, "cache (stale)"
+    if shared:
+        metrics.upstream_coalesced.inc()
+        dns_response_bytes = _adapt_shared_response(dns_response_bytes, dns_query_bytes, question_key[1])
+    return dns_response_bytes, round_trip_time_ms, contacted_server
+
+
+async def _exchange(dns_query_bytes: bytes, timeout_milliseconds: int, upstream_dns_server: Optional[str],
+                    dns_server_port: int, cache_key):
+    """Intercambio con el upstream (UDP, TCP si la respuesta viene truncada) y guardado en cache."""
+    # 1) Intentar UDP por el pool de sockets persistentes (sin bloquear threads):
+    #    al mejor upstream, con una copia al siguiente si tarda mas que su p95
+    pool = get_upstream_pool() if upstream_dns_server is None else get_upstream_pool(f"[{upstream_dns_server}]:{dns_server_port}")
+    query_start_time = time.monotonic()
+    dns_response_bytes, round_trip_time_ms, contacted_server, upstream = await pool.query(
+        dns_query_bytes, _convert_milliseconds_to_seconds(timeout_milliseconds)
+    )
+    server_label = upstream.label
+
+    # 2) Si la respuesta UDP está truncada (TC), reintentar por el pool TCP del mismo upstream
+    if _check_if_dns_response_is_truncated(dns_response_bytes):
+        metrics.upstream_tcp_fallback.labels(server_label).inc()
+        tcp_start_time = time.monotonic()
         try:
-            # Enviar los bytes del query DNS
-            udp_socket.sendto(dns_query_payload, socket_address)
-            
-            # Esperar la respuesta (hasta RECV_BUF bytes)
-            dns_response, server_address_info = udp_socket.recvfrom(RECV_BUF)
-
-            # Calcular RTT (tiempo total desde envio hasta recepcion)
-            round_trip_time_ms = int((time.monotonic() - query_start_time) * 1000)
-
-            # Formatear direccion del servidor como "IP:Puerto"
-            server_address_string = f"{server_address_info[0]}:{server_address_info[1]}"
-            
-            return dns_response, round_trip_time_ms, server_address_string
-            
+            remaining_ms = timeout_milliseconds - round_trip_time_ms
+            tcp_forwarder = await get_tcp_forwarder(upstream.host, upstream.port)
+            dns_response_bytes, _, contacted_server = await tcp_forwarder.query(
+                dns_query_bytes, _convert_milliseconds_to_seconds(remaining_ms)
+            )
+            metrics.upstream_rtt.labels(server_label, "tcp").observe(time.monotonic() - tcp_start_time)
         except socket.timeout:
-            # Re-lanzar timeout para que el caller lo maneje
-            raise
+            metrics.upstream_timeouts.labels(server_label, "tcp").inc()
         except Exception:
-            # Re-lanzar cualquier otro error de red
-            raise
+            # Si TCP falla, conservamos la respuesta UDP truncada (o podríamos elegir fallar).
+            pass
+        # RTT total: intento UDP + TCP (incluye el handshake si hubo que conectar)
+        round_trip_time_ms = int((time.monotonic() - query_start_time) * 1000)
 
-def send_dns_query_via_tcp(dns_query_payload: bytes, upstream_server: str, server_port: int, timeout_milliseconds: int) -> bytes:
-    """Envia query DNS via TCP (fallback cuando UDP esta truncado)."""
-    timeout_seconds = _convert_milliseconds_to_seconds(timeout_milliseconds)
-
-    # Resolver direccion del servidor
-    address_info_list = socket.getaddrinfo(upstream_server, server_port, proto=socket.IPPROTO_TCP)
-    
-    # Usar la primera direccion disponible
-    socket_family, socket_type, protocol, canonical_name, socket_address = address_info_list[0]
-
-    # Crear socket TCP, conectar, enviar y recibir
-    with socket.socket(socket_family, socket.SOCK_STREAM) as tcp_socket:
-        tcp_socket.settimeout(timeout_seconds)
-        tcp_socket.connect(socket_address)
-        
-        # En DNS sobre TCP: 2 bytes BigEndian con la longitud + payload
-        payload_length_prefix = len(dns_query_payload).to_bytes(2, "big")
-        tcp_socket.sendall(payload_length_prefix + dns_query_payload)
-
-        # Leer 2 bytes de longitud de la respuesta
-        response_length_bytes = tcp_socket.recv(2)
-        if len(response_length_bytes) < 2:
-            raise RuntimeError("TCP read length failed")
-        expected_response_length = int.from_bytes(response_length_bytes, "big")
-
-        # Inicializar buffer para almacenar la respuesta completa
-        response_data = bytearray()
-
-        # Leer datos hasta completar expected_response_length
-        while len(response_data) < expected_response_length:
-            # Calcular cuantos bytes faltan
-            remaining_bytes = expected_response_length - len(response_data)
-            
-            # Intentar recibir los bytes restantes
-            data_chunk = tcp_socket.recv(remaining_bytes)
-            
-            # Si no se reciben datos, la conexion se cerro
-            if not data_chunk:
-                break
-            
-            # Agregar los bytes recibidos al buffer
-            response_data.extend(data_chunk)
-            
-        return bytes(response_data)
+    # 3) Guardar en cache (solo respuestas completas y con TTL valido)
+    if cache_key:
+        answer_cache.put(cache_key, dns_response_bytes)
 
-# --- FUNCION PRINCIPAL ---
+    return dns_response_bytes, round_trip_time_ms, contacted_server
 
-def process_dns_query_from_base64(dns_query_base64: str, timeout_milliseconds: int = DEFAULT_TIMEOUT_MS, upstream_dns_server: str = UPSTREAM_HOST, dns_server_port: int = UPSTREAM_PORT):
+
+async def process_dns_query_from_base64(dns_query_base64: str, timeout_milliseconds: int = DEFAULT_TIMEOUT_MS, upstream_dns_server: Optional[str] = None, dns_server_port: int = UPSTREAM_PORT):
     """Procesa query DNS en Base64 y lo reenvia a servidor upstream."""
     # 1) Decodificar Base64
     try:
@@ -124,31 +209,14 @@ def process_dns_query_from_base64(dns_query_base64: str, timeout_milliseconds: i
     if len(dns_query_bytes) == 0 or len(dns_query_bytes) > MAX_PAYLOAD_BYTES:
         raise ValueError("payload_size_invalid")
 
-    # 2) Intentar UDP
-    try:
-        dns_response_bytes, round_trip_time_ms, contacted_server = send_dns_query_via_udp(dns_query_bytes, upstream_dns_server, dns_server_port, timeout_milliseconds)
-    except socket.timeout:
-        # upstream no respondió en UDP dentro del timeout
-        raise
-    except Exception as network_error:
-        # Problema de red (DNS unreachable, getaddrinfo falló, etc)
-        raise
-
-    # 3) Si la respuesta UDP está truncada (TC), intentar TCP fallback
-    try:
-        if _check_if_dns_response_is_truncated(dns_response_bytes):
-            # TCP fallback
-            tcp_dns_response = send_dns_query_via_tcp(dns_query_bytes, upstream_dns_server, dns_server_port, timeout_milliseconds)
-            dns_response_bytes = tcp_dns_response
-            contacted_server = f"{upstream_dns_server}:{dns_server_port} (tcp)"
-            # round_trip_time_ms queda como el medido por UDP; para medir bien haría falta cronometrar TCP también
-    except Exception:
-        # Si TCP falla, conservamos la respuesta UDP truncada (o podríamos elegir fallar).
-        pass
+    # 2) Reenviar (cache -> UDP -> TCP si esta truncada)
+    dns_response_bytes, round_trip_time_ms, contacted_server = await forward_dns_query(
+        dns_query_bytes, timeout_milliseconds, upstream_dns_server, dns_server_port
+    )
 
-    # 4) Codificar respuesta y devolver
+    # 3) Codificar respuesta y devolver
     return {
         "payload_b64": base64.b64encode(dns_response_bytes).decode(),
         "server": contacted_server,
         "rtt_ms": int(round_trip_time_ms)
-    }
\ No newline at end of file
+    }
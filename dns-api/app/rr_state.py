@@ -0,0 +1,155 @@
+"""
+Contadores de round-robin de los records multi, fuera del storage.
+Resolver un record multi no escribe nada en el storage:
+- RR_STATE_PATH vacio: un contador por fqdn en memoria del proceso (cada
+  worker rota por su cuenta, la distribucion global queda aproximada).
+- RR_STATE_PATH: archivo mapeado con mmap y compartido por todos los workers,
+  con RR_STATE_SLOTS contadores uint32 indexados por crc32(fqdn). El
+  incremento se hace bajo un lock de rango (lockf) sobre el slot, asi la
+  rotacion es global entre workers. Dos fqdn en el mismo slot comparten
+  contador; la rotacion de cada uno sigue siendo pareja.
+
+Checkpoint opcional (RR_CHECKPOINT_INTERVAL_S > 0): un thread guarda rr_index
+de los records usados, como maximo una escritura por record por intervalo.
+rr_index no cambia el ETag de /api/records ni recompila el plan del record
+(ver record_cache.UNVERSIONED_FIELDS y resolve_plan.get_plan).
+"""
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin archivo compartido
+    fcntl = None
+
+try:
+    from storage import get_storage
+    from config import RR_STATE_PATH, RR_STATE_SLOTS, RR_CHECKPOINT_INTERVAL_S
+    from logs import get_logger
+except ImportError:
+    from .storage import get_storage
+    from .config import RR_STATE_PATH, RR_STATE_SLOTS, RR_CHECKPOINT_INTERVAL_S
+    from .logs import get_logger
+
+logger = get_logger("rr")
+
+_COUNTER = struct.Struct("<I")
+
+_local: Dict[str, int] = {}
+_pending: Dict[str, int] = {}   # fqdn -> proximo indice, pendiente de checkpoint
+_lock = threading.Lock()
+_fd: Optional[int] = None
+_mm: Optional[mmap.mmap] = None
+_slots = 0
+_checkpoint_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def _open_shared(path: str, slots: int):
+    """Abre (o crea) el archivo de contadores y lo mapea en lectura/escritura."""
+    size = slots * _COUNTER.size
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)  # los slots nuevos quedan en 0
+        return fd, mmap.mmap(fd, size)
+    except Exception:
+        os.close(fd)
+        raise
+
+
+def _next_shared(fqdn: str) -> int:
+    off = (zlib.crc32(fqdn.encode("utf-8")) % _slots) * _COUNTER.size
+    # lockf excluye a otros procesos; el lock del modulo, a otros threads del mismo
+    with _lock:
+        fcntl.lockf(_fd, fcntl.LOCK_EX, _COUNTER.size, off)
+        try:
+            value = _COUNTER.unpack_from(_mm, off)[0]
+            _COUNTER.pack_into(_mm, off, (value + 1) & 0xFFFFFFFF)
+        finally:
+            fcntl.lockf(_fd, fcntl.LOCK_UN, _COUNTER.size, off)
+    return value
+
+
+def _next_local(fqdn: str, seed: int) -> int:
+    with _lock:
+        value = _local.get(fqdn, seed)
+        _local[fqdn] = value + 1
+    return value
+
+
+def next_index(fqdn: str, seed: int = 0) -> int:
+    """
+    Retorna el indice de rotacion para esta resolucion y avanza el contador.
+    seed: valor inicial si el proceso todavia no conoce el fqdn (ej. rr_index guardado).
+    """
+    value = _next_shared(fqdn) if _mm is not None else _next_local(fqdn, seed)
+    if RR_CHECKPOINT_INTERVAL_S > 0:
+        with _lock:
+            _pending[fqdn] = value + 1
+    return value
+
+
+def checkpoint():
+    """Escribe en el storage el rr_index de los records rotados desde el ultimo checkpoint."""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    store = get_storage()
+    for fqdn, value in pending.items():
+        try:
+            store.update_record(fqdn, {"rr_index": value})
+        except Exception as e:
+            logger.warning("rr_index checkpoint failed for %s: %s", fqdn, e)
+
+
+def _checkpoint_loop():
+    while not _stop.wait(RR_CHECKPOINT_INTERVAL_S):
+        checkpoint()
+
+
+def start():
+    """Abre el archivo compartido (si esta configurado) y el thread de checkpoint."""
+    global _fd, _mm, _slots, _checkpoint_thread
+    if RR_STATE_PATH and fcntl and _mm is None:
+        try:
+            _fd, _mm = _open_shared(RR_STATE_PATH, RR_STATE_SLOTS)
+            _slots = RR_STATE_SLOTS
+        except Exception as e:
+            logger.warning("could not open rr state %s, using per-process counters: %s", RR_STATE_PATH, e)
+    if RR_CHECKPOINT_INTERVAL_S > 0 and _checkpoint_thread is None:
+        _stop.clear()
+        _checkpoint_thread = threading.Thread(target=_checkpoint_loop, name="rr-checkpoint", daemon=True)
+        _checkpoint_thread.start()
+
+
+def stop():
+    """Detiene el checkpoint (con un ultimo volcado) y cierra el archivo compartido."""
+    global _fd, _mm, _checkpoint_thread
+    if _checkpoint_thread is not None:
+        _stop.set()
+        _checkpoint_thread.join(timeout=5)
+        _checkpoint_thread = None
+        checkpoint()
+    with _lock:
+        if _mm is not None:
+            _mm.close()
+            os.close(_fd)
+            _mm, _fd = None, None
+
+
+def stats() -> dict:
+    return {
+        "mode": "shared" if _mm is not None else "process",
+        "path": RR_STATE_PATH or None,
+        "slots": _slots if _mm is not None else None,
+        "local_counters": len(_local),
+        "pending_checkpoint": len(_pending),
+    }
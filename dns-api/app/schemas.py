@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 class DNSResolverIn(BaseModel):
@@ -24,6 +24,17 @@ class DNSResolveOut(BaseModel):
     target_id: Optional[str] = None
     type: Optional[str] = None
 
+class DNSResolveBatchItemOut(BaseModel):
+    host: str
+    status_code: int = 200
+    ip: Optional[str] = None
+    target_id: Optional[str] = None
+    type: Optional[str] = None
+    error: Optional[str] = None
+
+class DNSResolveBatchOut(BaseModel):
+    results: List[DNSResolveBatchItemOut]
+
 class HealthUpdate(BaseModel):
     fqdn: str
     target_id: str
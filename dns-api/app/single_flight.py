@@ -0,0 +1,57 @@
+"""
+Single-flight: una sola ejecucion en vuelo por clave.
+Cuando vence un nombre popular llegan muchas queries iguales a la vez; la
+primera hace el intercambio con el upstream y las demas esperan ese mismo
+resultado en lugar de mandar su propio paquete.
+
+La ejecucion corre en su propia task: si el llamador que la inicio se cancela
+(cliente que corta), los demas siguen esperando el resultado.
+"""
+
+import asyncio
+import socket
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Consumir el error aunque no quede nadie esperando (evita el warning de asyncio)
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, make_coro: Callable[[], Awaitable[Any]],
+                 timeout_s: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Retorna (resultado, compartido). compartido=True si se reutilizo una
+        ejecucion iniciada por otro llamador. timeout_s acota la espera de este
+        llamador (socket.timeout), sin cancelar la ejecucion compartida.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(make_coro())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout_s), shared
+        except asyncio.TimeoutError:
+            raise socket.timeout("upstream timeout")
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "inflight": len(self._inflight),
+            "exchanges": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,811 @@
+"""
+Acceso a los datos persistentes: records (incluye health y rr_index) y rangos
+ip_to_country. El resto de la app usa get_storage() y no sabe que backend hay
+detras (STORAGE_BACKEND):
+
+- firestore: la implementacion original (cliente de firebase_client).
+- sqlite: archivo local en modo WAL (SQLITE_PATH), compartido por todos los
+  workers. Los records se guardan como JSON por fqdn; ip_to_country tiene un
+  indice sobre range_start, asi ubicar la IP es un seek del indice. Sin red
+  ni dependencias de la nube.
+
+Los rangos IPv6 (ip_version 6, id "range6_...") guardan los extremos como hex
+de 32 digitos (range_start_hex/range_end_hex): Firestore solo tiene enteros de
+64 bits y el hex de largo fijo ordena igual que el numero.
+
+Los updates usan rutas con puntos ("health.t1.status"), como Firestore.
+watch_records(callback) entrega cambios con la misma forma que on_snapshot
+(col_snapshot, changes, read_time), asi record_cache funciona con ambos.
+
+Las operaciones que usan los endpoints tienen una variante *_async para el
+event loop: Firestore usa el AsyncClient (la concurrencia la limitan los
+sockets, no el threadpool); SQLite hace las lecturas puntuales en el mismo
+loop (microsegundos, en WAL no esperan locks) y escribe y lista en un thread.
+"""
+
+import asyncio
+import enum
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from config import STORAGE_BACKEND, SQLITE_PATH, SQLITE_WATCH_INTERVAL_S
+    from logs import get_logger
+    from metrics import firestore_timer
+except ImportError:
+    from .config import STORAGE_BACKEND, SQLITE_PATH, SQLITE_WATCH_INTERVAL_S
+    from .logs import get_logger
+    from .metrics import firestore_timer
+
+logger = get_logger("storage")
+
+# Un write de health: (fqdn, record placeholder a crear antes o None, updates con puntos)
+RecordWrite = Tuple[str, Optional[dict], Dict[str, object]]
+
+
+def is_ipv6_range(doc_id: str, data: Optional[dict] = None) -> bool:
+    return doc_id.startswith("range6_") or bool(data and data.get("ip_version") == 6)
+
+
+def _hex128(n: int) -> str:
+    return f"{n:032x}"
+
+
+def set_path(data: dict, path: str, value):
+    """Asigna data["a"]["b"]["c"] = value para path "a.b.c", creando los mapas intermedios."""
+    parts = path.split(".")
+    for part in parts[:-1]:
+        child = data.get(part)
+        if not isinstance(child, dict):
+            child = data[part] = {}
+        data = child
+    data[parts[-1]] = value
+
+
+class Storage:
+    """Interfaz comun de los backends."""
+
+    name = ""
+
+    async def _read_async(self, fn: Callable, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    async def _write_async(self, fn: Callable, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    async def _scan_async(self, fn: Callable, *args):
+        # Listados completos: siempre en un thread, aun con lecturas inline
+        return await asyncio.to_thread(fn, *args)
+
+    # --- variantes async (por defecto, la operacion sincrona en un thread) ---
+    async def get_record_async(self, fqdn: str) -> Optional[dict]:
+        return await self._read_async(self.get_record, fqdn)
+
+    async def get_records_async(self, fqdns: List[str]) -> Dict[str, Optional[dict]]:
+        return await self._read_async(self.get_records, fqdns)
+
+    async def list_records_async(self) -> List[dict]:
+        return await self._scan_async(self.list_records)
+
+    async def set_record_async(self, fqdn: str, data: dict):
+        return await self._write_async(self.set_record, fqdn, data)
+
+    async def update_record_async(self, fqdn: str, updates: Dict[str, object]):
+        return await self._write_async(self.update_record, fqdn, updates)
+
+    async def delete_record_async(self, fqdn: str):
+        return await self._write_async(self.delete_record, fqdn)
+
+    async def get_ip_range_async(self, doc_id: str) -> Optional[dict]:
+        return await self._read_async(self.get_ip_range, doc_id)
+
+    async def find_ip_range_async(self, ip_int: int, candidates: int = 1, version: int = 4) -> Optional[dict]:
+        return await self._read_async(self.find_ip_range, ip_int, candidates, version)
+
+    async def list_ip_ranges_async(self, limit: int, start_after: Optional[str] = None) -> List[Tuple[str, dict]]:
+        return await self._scan_async(self.list_ip_ranges, limit, start_after)
+
+    async def set_ip_range_async(self, doc_id: str, data: dict):
+        return await self._write_async(self.set_ip_range, doc_id, data)
+
+    async def update_ip_range_async(self, doc_id: str, updates: Dict[str, object]):
+        return await self._write_async(self.update_ip_range, doc_id, updates)
+
+    async def delete_ip_range_async(self, doc_id: str):
+        return await self._write_async(self.delete_ip_range, doc_id)
+
+    # --- records ---
+    def get_record(self, fqdn: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def get_records(self, fqdns: List[str]) -> Dict[str, Optional[dict]]:
+        raise NotImplementedError
+
+    def list_records(self) -> List[dict]:
+        raise NotImplementedError
+
+    def set_record(self, fqdn: str, data: dict):
+        raise NotImplementedError
+
+    def update_record(self, fqdn: str, updates: Dict[str, object]):
+        """Update parcial; falla si el record no existe."""
+        raise NotImplementedError
+
+    def delete_record(self, fqdn: str):
+        raise NotImplementedError
+
+    def delete_all_records(self):
+        raise NotImplementedError
+
+    def write_record_updates(self, writes: List[RecordWrite]):
+        """Aplica varios updates en una sola escritura atomica."""
+        raise NotImplementedError
+
+    def watch_records(self, callback: Callable):
+        """Suscripcion a cambios; retorna un objeto con is_active y unsubscribe()."""
+        raise NotImplementedError
+
+    # --- ip_to_country ---
+    def get_ip_range(self, doc_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def find_ip_range(self, ip_int: int, candidates: int = 1, version: int = 4) -> Optional[dict]:
+        """Rango que contiene ip_int (revisa los `candidates` de mayor inicio <= ip_int)."""
+        raise NotImplementedError
+
+    def list_ip_ranges(self, limit: int, start_after: Optional[str] = None) -> List[Tuple[str, dict]]:
+        """Pagina ordenada por id de documento: [(id, data)]."""
+        raise NotImplementedError
+
+    def set_ip_range(self, doc_id: str, data: dict):
+        raise NotImplementedError
+
+    def set_ip_ranges(self, items: Iterable[Tuple[str, dict]]) -> int:
+        """Escribe varios rangos en una sola escritura (hasta 500 en Firestore)."""
+        raise NotImplementedError
+
+    def count_ip_ranges(self) -> int:
+        raise NotImplementedError
+
+    def update_ip_range(self, doc_id: str, updates: Dict[str, object]):
+        raise NotImplementedError
+
+    def delete_ip_range(self, doc_id: str):
+        raise NotImplementedError
+
+    def load_ip_rows(self) -> List[Tuple[int, int, str]]:
+        """Todos los rangos IPv4 como (range_start, range_end, country)."""
+        raise NotImplementedError
+
+    def load_ip6_rows(self) -> List[Tuple[int, int, str]]:
+        """Todos los rangos IPv6 como (inicio, fin, country) con enteros de 128 bits."""
+        raise NotImplementedError
+
+
+# --- FIRESTORE ---
+
+class FirestoreStorage(Storage):
+    name = "firestore"
+
+    def _client(self):
+        try:
+            from firebase_client import get_client
+        except ImportError:
+            from .firebase_client import get_client
+        return get_client()
+
+    def _async_client(self):
+        try:
+            from firebase_client import get_async_client
+        except ImportError:
+            from .firebase_client import get_async_client
+        return get_async_client()
+
+    def _records(self):
+        return self._client().collection("records")
+
+    def _ranges(self):
+        return self._client().collection("ip_to_country")
+
+    def get_record(self, fqdn):
+        with firestore_timer("records", "get"):
+            doc = self._records().document(fqdn).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_records(self, fqdns):
+        client = self._client()
+        refs = [client.collection("records").document(fqdn) for fqdn in fqdns]
+        with firestore_timer("records", "get_all"):
+            docs = list(client.get_all(refs))
+        found = {doc.id: (doc.to_dict() if doc.exists else None) for doc in docs}
+        return {fqdn: found.get(fqdn) for fqdn in fqdns}
+
+    def list_records(self):
+        with firestore_timer("records", "stream"):
+            return [doc.to_dict() for doc in self._records().stream()]
+
+    def set_record(self, fqdn, data):
+        with firestore_timer("records", "set"):
+            self._records().document(fqdn).set(data)
+
+    def update_record(self, fqdn, updates):
+        with firestore_timer("records", "update"):
+            self._records().document(fqdn).update(updates)
+
+    def delete_record(self, fqdn):
+        with firestore_timer("records", "delete"):
+            self._records().document(fqdn).delete()
+
+    def delete_all_records(self):
+        for doc in self._records().stream():
+            doc.reference.delete()
+
+    def write_record_updates(self, writes):
+        client = self._client()
+        batch = client.batch()
+        for fqdn, placeholder, updates in writes:
+            ref = client.collection("records").document(fqdn)
+            if placeholder is not None:
+                batch.set(ref, placeholder)
+            batch.update(ref, updates)
+        with firestore_timer("records", "batch_commit"):
+            batch.commit()
+
+    def watch_records(self, callback):
+        return self._records().on_snapshot(callback)
+
+    def get_ip_range(self, doc_id):
+        with firestore_timer("ip_to_country", "get"):
+            doc = self._ranges().document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def find_ip_range(self, ip_int, candidates=1, version=4):
+        from google.cloud import firestore
+        if version == 6:
+            field, value = "range_start_hex", _hex128(ip_int)
+        else:
+            field, value = "range_start", ip_int
+        # Un solo filtro de desigualdad + order_by
+        query = (
+            self._ranges()
+            .where(filter=firestore.FieldFilter(field, "<=", value))
+            .order_by(field, direction=firestore.Query.DESCENDING)
+            .limit(candidates)
+        )
+        with firestore_timer("ip_to_country", "query"):
+            docs = query.get()
+        for doc in docs:
+            data = doc.to_dict()
+            if version == 6:
+                if data.get("range_end_hex", "") >= value:
+                    return data
+            elif int(data.get("range_end", 0)) >= ip_int:
+                return data
+        return None
+
+    def list_ip_ranges(self, limit, start_after=None):
+        query = self._ranges().order_by("__name__").limit(limit)
+        # Si hay un cursor, continuar desde ese documento
+        if start_after:
+            start_doc = self._ranges().document(start_after).get()
+            if start_doc.exists:
+                query = query.start_after(start_doc)
+        with firestore_timer("ip_to_country", "stream"):
+            return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def set_ip_range(self, doc_id, data):
+        with firestore_timer("ip_to_country", "set"):
+            self._ranges().document(doc_id).set(data)
+
+    def set_ip_ranges(self, items):
+        client = self._client()
+        batch = client.batch()
+        count = 0
+        for doc_id, data in items:
+            batch.set(client.collection("ip_to_country").document(doc_id), data)
+            count += 1
+        with firestore_timer("ip_to_country", "batch_commit"):
+            batch.commit()
+        return count
+
+    def count_ip_ranges(self):
+        # Agregacion del lado del servidor (no lee los documentos)
+        with firestore_timer("ip_to_country", "count"):
+            result = self._ranges().count().get()
+        return int(result[0][0].value)
+
+    def update_ip_range(self, doc_id, updates):
+        with firestore_timer("ip_to_country", "update"):
+            self._ranges().document(doc_id).update(updates)
+
+    def delete_ip_range(self, doc_id):
+        with firestore_timer("ip_to_country", "delete"):
+            self._ranges().document(doc_id).delete()
+
+    def load_ip_rows(self):
+        # Solo los campos necesarios
+        docs = self._ranges().select(["range_start", "range_end", "country"]).stream()
+        rows = []
+        with firestore_timer("ip_to_country", "stream"):
+            for doc in docs:
+                data = doc.to_dict()
+                try:
+                    rows.append((int(data["range_start"]), int(data["range_end"]), data.get("country") or "unknown"))
+                except (KeyError, TypeError, ValueError):
+                    # documento incompleto o IPv6, se ignora
+                    continue
+        return rows
+
+    def load_ip6_rows(self):
+        from google.cloud import firestore
+        docs = (
+            self._ranges()
+            .where(filter=firestore.FieldFilter("ip_version", "==", 6))
+            .select(["range_start_hex", "range_end_hex", "country"])
+            .stream()
+        )
+        rows = []
+        with firestore_timer("ip_to_country", "stream"):
+            for doc in docs:
+                data = doc.to_dict()
+                try:
+                    rows.append((int(data["range_start_hex"], 16), int(data["range_end_hex"], 16),
+                                 data.get("country") or "unknown"))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        return rows
+
+    # --- AsyncClient ---
+
+    async def get_record_async(self, fqdn):
+        with firestore_timer("records", "get"):
+            doc = await self._async_client().collection("records").document(fqdn).get()
+        return doc.to_dict() if doc.exists else None
+
+    async def get_records_async(self, fqdns):
+        client = self._async_client()
+        refs = [client.collection("records").document(fqdn) for fqdn in fqdns]
+        with firestore_timer("records", "get_all"):
+            found = {doc.id: (doc.to_dict() if doc.exists else None) async for doc in client.get_all(refs)}
+        return {fqdn: found.get(fqdn) for fqdn in fqdns}
+
+    async def list_records_async(self):
+        with firestore_timer("records", "stream"):
+            return [doc.to_dict() async for doc in self._async_client().collection("records").stream()]
+
+    async def set_record_async(self, fqdn, data):
+        with firestore_timer("records", "set"):
+            await self._async_client().collection("records").document(fqdn).set(data)
+
+    async def update_record_async(self, fqdn, updates):
+        with firestore_timer("records", "update"):
+            await self._async_client().collection("records").document(fqdn).update(updates)
+
+    async def delete_record_async(self, fqdn):
+        with firestore_timer("records", "delete"):
+            await self._async_client().collection("records").document(fqdn).delete()
+
+    async def get_ip_range_async(self, doc_id):
+        with firestore_timer("ip_to_country", "get"):
+            doc = await self._async_client().collection("ip_to_country").document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    async def find_ip_range_async(self, ip_int, candidates=1, version=4):
+        from google.cloud import firestore
+        if version == 6:
+            field, value = "range_start_hex", _hex128(ip_int)
+        else:
+            field, value = "range_start", ip_int
+        query = (
+            self._async_client().collection("ip_to_country")
+            .where(filter=firestore.FieldFilter(field, "<=", value))
+            .order_by(field, direction=firestore.Query.DESCENDING)
+            .limit(candidates)
+        )
+        with firestore_timer("ip_to_country", "query"):
+            docs = await query.get()
+        for doc in docs:
+            data = doc.to_dict()
+            if version == 6:
+                if data.get("range_end_hex", "") >= value:
+                    return data
+            elif int(data.get("range_end", 0)) >= ip_int:
+                return data
+        return None
+
+    async def list_ip_ranges_async(self, limit, start_after=None):
+        ranges = self._async_client().collection("ip_to_country")
+        query = ranges.order_by("__name__").limit(limit)
+        if start_after:
+            start_doc = await ranges.document(start_after).get()
+            if start_doc.exists:
+                query = query.start_after(start_doc)
+        with firestore_timer("ip_to_country", "stream"):
+            return [(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+    async def set_ip_range_async(self, doc_id, data):
+        with firestore_timer("ip_to_country", "set"):
+            await self._async_client().collection("ip_to_country").document(doc_id).set(data)
+
+    async def update_ip_range_async(self, doc_id, updates):
+        with firestore_timer("ip_to_country", "update"):
+            await self._async_client().collection("ip_to_country").document(doc_id).update(updates)
+
+    async def delete_ip_range_async(self, doc_id):
+        with firestore_timer("ip_to_country", "delete"):
+            await self._async_client().collection("ip_to_country").document(doc_id).delete()
+
+
+# --- SQLITE ---
+
+# Cambios guardados para los watchers de otros procesos; uno que se atrase mas
+# que esto se resincroniza con un snapshot completo
+_CHANGE_LOG_SIZE = 10000
+_SQL_VARS = 500
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS records (
+    fqdn TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS record_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    fqdn TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS records_ai AFTER INSERT ON records
+    BEGIN INSERT INTO record_changes (fqdn) VALUES (NEW.fqdn); END;
+CREATE TRIGGER IF NOT EXISTS records_au AFTER UPDATE ON records
+    BEGIN INSERT INTO record_changes (fqdn) VALUES (NEW.fqdn); END;
+CREATE TRIGGER IF NOT EXISTS records_ad AFTER DELETE ON records
+    BEGIN INSERT INTO record_changes (fqdn) VALUES (OLD.fqdn); END;
+CREATE TRIGGER IF NOT EXISTS record_changes_trim AFTER INSERT ON record_changes
+    BEGIN DELETE FROM record_changes WHERE seq <= NEW.seq - {_CHANGE_LOG_SIZE}; END;
+CREATE TABLE IF NOT EXISTS ip_to_country (
+    id TEXT PRIMARY KEY,
+    range_start INTEGER NOT NULL,
+    range_end INTEGER NOT NULL,
+    country TEXT,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ip_to_country_range_start ON ip_to_country (range_start, range_end);
+CREATE TABLE IF NOT EXISTS ip6_to_country (
+    id TEXT PRIMARY KEY,
+    range_start_hex TEXT NOT NULL,
+    range_end_hex TEXT NOT NULL,
+    country TEXT,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ip6_to_country_range_start ON ip6_to_country (range_start_hex, range_end_hex);
+"""
+
+
+def _dumps(data: dict) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def _chunks(items: List[str]):
+    for i in range(0, len(items), _SQL_VARS):
+        yield items[i:i + _SQL_VARS]
+
+
+class _ChangeType(enum.Enum):
+    ADDED = 1
+    MODIFIED = 2
+    REMOVED = 3
+
+
+class _Doc:
+    __slots__ = ("id", "_data")
+
+    def __init__(self, doc_id: str, data: Optional[dict]):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return self._data
+
+
+class _Change:
+    __slots__ = ("type", "document")
+
+    def __init__(self, change_type: _ChangeType, document: _Doc):
+        self.type = change_type
+        self.document = document
+
+
+class _SqliteWatch:
+    """
+    Polling del log de cambios con PRAGMA data_version (cambia cuando otra
+    conexion hace commit): si no hubo commits, el chequeo no lee tablas.
+    Si el log ya no tiene los cambios pendientes, la suscripcion se marca
+    inactiva y record_cache se resuscribe con un snapshot completo.
+    """
+
+    def __init__(self, storage: "SqliteStorage", callback: Callable, interval_s: float):
+        self.is_active = True
+        self._storage = storage
+        self._callback = callback
+        self._interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sqlite-records-watch", daemon=True)
+        self._thread.start()
+
+    def unsubscribe(self):
+        self._stop.set()
+        self.is_active = False
+
+    def _run(self):
+        conn = self._storage._connect()
+        try:
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            with self._storage._read(conn):
+                last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM record_changes").fetchone()[0]
+                docs = [_Doc(fqdn, json.loads(data)) for fqdn, data in conn.execute("SELECT fqdn, data FROM records")]
+            self._callback(docs, [_Change(_ChangeType.ADDED, d) for d in docs], None)
+
+            while not self._stop.wait(self._interval_s):
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current == version:
+                    continue
+                version = current
+                with self._storage._read(conn):
+                    first = conn.execute("SELECT MIN(seq) FROM record_changes").fetchone()[0]
+                    if first is not None and first > last + 1:
+                        logger.info("sqlite change log overflowed, resyncing records")
+                        break
+                    rows = conn.execute("SELECT seq, fqdn FROM record_changes WHERE seq > ? ORDER BY seq",
+                                        (last,)).fetchall()
+                    if not rows:
+                        continue
+                    last = rows[-1][0]
+                    changes = []
+                    for fqdn in dict.fromkeys(fqdn for _, fqdn in rows):
+                        row = conn.execute("SELECT data FROM records WHERE fqdn = ?", (fqdn,)).fetchone()
+                        if row is None:
+                            changes.append(_Change(_ChangeType.REMOVED, _Doc(fqdn, None)))
+                        else:
+                            changes.append(_Change(_ChangeType.MODIFIED, _Doc(fqdn, json.loads(row[0]))))
+                self._callback([], changes, None)
+        except Exception as e:
+            logger.warning("sqlite records watch failed: %s", e)
+        finally:
+            self.is_active = False
+            conn.close()
+
+
+class SqliteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path: str, watch_interval_s: float = 0.2):
+        self.path = path
+        self.watch_interval_s = watch_interval_s
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit: las transacciones se abren explicitamente
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """Una conexion por thread y por proceso (no se reutilizan tras un fork)."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn, local.pid = self._connect(), os.getpid()
+        return local.conn
+
+    async def _read_async(self, fn, *args):
+        # Lectura puntual por indice (~10 us) que en WAL no espera a los escritores: sin thread
+        return fn(*args)
+
+    @contextmanager
+    def _read(self, conn: sqlite3.Connection):
+        """Varias lecturas sobre el mismo snapshot."""
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # --- records ---
+
+    def get_record(self, fqdn):
+        row = self._conn().execute("SELECT data FROM records WHERE fqdn = ?", (fqdn,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_records(self, fqdns):
+        found = {}
+        conn = self._conn()
+        for chunk in _chunks(list(fqdns)):
+            sql = f"SELECT fqdn, data FROM records WHERE fqdn IN ({','.join('?' * len(chunk))})"
+            found.update((fqdn, json.loads(data)) for fqdn, data in conn.execute(sql, chunk))
+        return {fqdn: found.get(fqdn) for fqdn in fqdns}
+
+    def list_records(self):
+        return [json.loads(data) for (data,) in self._conn().execute("SELECT data FROM records")]
+
+    def _upsert_record(self, conn, fqdn: str, data: dict):
+        conn.execute(
+            "INSERT INTO records (fqdn, data) VALUES (?, ?) ON CONFLICT (fqdn) DO UPDATE SET data = excluded.data",
+            (fqdn, _dumps(data)),
+        )
+
+    def _apply_updates(self, conn, fqdn: str, updates: Dict[str, object]):
+        row = conn.execute("SELECT data FROM records WHERE fqdn = ?", (fqdn,)).fetchone()
+        if row is None:
+            raise KeyError(f"No document to update: records/{fqdn}")
+        data = json.loads(row[0])
+        for path, value in updates.items():
+            set_path(data, path, value)
+        conn.execute("UPDATE records SET data = ? WHERE fqdn = ?", (_dumps(data), fqdn))
+
+    def set_record(self, fqdn, data):
+        with self._write() as conn:
+            self._upsert_record(conn, fqdn, data)
+
+    def update_record(self, fqdn, updates):
+        with self._write() as conn:
+            self._apply_updates(conn, fqdn, updates)
+
+    def delete_record(self, fqdn):
+        with self._write() as conn:
+            conn.execute("DELETE FROM records WHERE fqdn = ?", (fqdn,))
+
+    def delete_all_records(self):
+        with self._write() as conn:
+            conn.execute("DELETE FROM records")
+
+    def write_record_updates(self, writes):
+        with self._write() as conn:
+            for fqdn, placeholder, updates in writes:
+                if placeholder is not None:
+                    self._upsert_record(conn, fqdn, placeholder)
+                self._apply_updates(conn, fqdn, updates)
+
+    def watch_records(self, callback):
+        return _SqliteWatch(self, callback, self.watch_interval_s)
+
+    # --- ip_to_country ---
+
+    @staticmethod
+    def _range_table(doc_id: str) -> str:
+        return "ip6_to_country" if is_ipv6_range(doc_id) else "ip_to_country"
+
+    def get_ip_range(self, doc_id):
+        row = self._conn().execute(f"SELECT data FROM {self._range_table(doc_id)} WHERE id = ?",
+                                   (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_ip_range(self, ip_int, candidates=1, version=4):
+        if version == 6:
+            value = _hex128(ip_int)
+            sql = ("SELECT range_end_hex, data FROM ip6_to_country WHERE range_start_hex <= ? "
+                   "ORDER BY range_start_hex DESC LIMIT ?")
+        else:
+            value = ip_int
+            sql = "SELECT range_end, data FROM ip_to_country WHERE range_start <= ? ORDER BY range_start DESC LIMIT ?"
+        for range_end, data in self._conn().execute(sql, (value, candidates)).fetchall():
+            if range_end >= value:
+                return json.loads(data)
+        return None
+
+    def list_ip_ranges(self, limit, start_after=None):
+        conn = self._conn()
+        ranges = "SELECT id, data FROM ip_to_country UNION ALL SELECT id, data FROM ip6_to_country"
+        if start_after and conn.execute(f"SELECT 1 FROM {self._range_table(start_after)} WHERE id = ?",
+                                        (start_after,)).fetchone():
+            rows = conn.execute(f"SELECT id, data FROM ({ranges}) WHERE id > ? ORDER BY id LIMIT ?",
+                                (start_after, limit))
+        else:
+            rows = conn.execute(f"SELECT id, data FROM ({ranges}) ORDER BY id LIMIT ?", (limit,))
+        return [(doc_id, json.loads(data)) for doc_id, data in rows]
+
+    def _put_range(self, conn, doc_id: str, data: dict):
+        if is_ipv6_range(doc_id, data):
+            conn.execute(
+                "INSERT INTO ip6_to_country (id, range_start_hex, range_end_hex, country, data) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET range_start_hex = excluded.range_start_hex, "
+                "range_end_hex = excluded.range_end_hex, country = excluded.country, data = excluded.data",
+                (doc_id, data["range_start_hex"], data["range_end_hex"], data.get("country"), _dumps(data)),
+            )
+            return
+        conn.execute(
+            "INSERT INTO ip_to_country (id, range_start, range_end, country, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET range_start = excluded.range_start, range_end = excluded.range_end, "
+            "country = excluded.country, data = excluded.data",
+            (doc_id, int(data["range_start"]), int(data["range_end"]), data.get("country"), _dumps(data)),
+        )
+
+    def set_ip_range(self, doc_id, data):
+        with self._write() as conn:
+            self._put_range(conn, doc_id, data)
+
+    def set_ip_ranges(self, items):
+        count = 0
+        with self._write() as conn:
+            for doc_id, data in items:
+                self._put_range(conn, doc_id, data)
+                count += 1
+        return count
+
+    def update_ip_range(self, doc_id, updates):
+        with self._write() as conn:
+            row = conn.execute(f"SELECT data FROM {self._range_table(doc_id)} WHERE id = ?", (doc_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"No document to update: ip_to_country/{doc_id}")
+            data = json.loads(row[0])
+            for path, value in updates.items():
+                set_path(data, path, value)
+            self._put_range(conn, doc_id, data)
+
+    def delete_ip_range(self, doc_id):
+        with self._write() as conn:
+            conn.execute(f"DELETE FROM {self._range_table(doc_id)} WHERE id = ?", (doc_id,))
+
+    def count_ip_ranges(self):
+        return self._conn().execute(
+            "SELECT (SELECT COUNT(*) FROM ip_to_country) + (SELECT COUNT(*) FROM ip6_to_country)"
+        ).fetchone()[0]
+
+    def load_ip_rows(self):
+        return [
+            (start, end, country or "unknown")
+            for start, end, country in self._conn().execute(
+                "SELECT range_start, range_end, country FROM ip_to_country ORDER BY range_start"
+            )
+        ]
+
+    def load_ip6_rows(self):
+        return [
+            (int(start, 16), int(end, 16), country or "unknown")
+            for start, end, country in self._conn().execute(
+                "SELECT range_start_hex, range_end_hex, country FROM ip6_to_country ORDER BY range_start_hex"
+            )
+        ]
+
+
+_storage: Optional[Storage] = None
+_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """Backend configurado en STORAGE_BACKEND (se crea una vez por proceso)."""
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                if STORAGE_BACKEND == "sqlite":
+                    _storage = SqliteStorage(SQLITE_PATH, SQLITE_WATCH_INTERVAL_S)
+                elif STORAGE_BACKEND == "firestore":
+                    _storage = FirestoreStorage()
+                else:
+                    raise ValueError(f"STORAGE_BACKEND desconocido: {STORAGE_BACKEND}")
+                logger.info("storage backend: %s", _storage.name)
+    return _storage
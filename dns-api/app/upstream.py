@@ -0,0 +1,594 @@
+"""
+Forwarder asincrono hacia servidores DNS upstream.
+Mantiene un pool chico de sockets UDP de larga vida por servidor y multiplexa
+las queries en vuelo por ID de transaccion (unico por socket) y pregunta.
+Para respuestas truncadas usa conexiones TCP persistentes con pipelining y
+respuestas fuera de orden (RFC 7766), cerrando las que quedan ociosas.
+La direccion del upstream se resuelve una sola vez al crear el pool.
+
+Con varios servidores (UPSTREAM_DNS), UpstreamPool manda cada query al de
+mejor puntaje (RTT suavizado + penalizacion por fallas recientes) y, si no
+responde dentro de su p95 reciente, envia una copia (hedge) al siguiente.
+Gana la primera respuesta valida; las demas se cancelan.
+"""
+
+import asyncio
+import itertools
+import secrets
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import dns_wire
+    import metrics
+    from config import UPSTREAM_UDP_POOL_SIZE, UPSTREAM_TCP_MAX_CONNECTIONS, UPSTREAM_TCP_MAX_INFLIGHT, UPSTREAM_TCP_IDLE_TIMEOUT_S
+    from config import UPSTREAM_DNS, UPSTREAM_HEDGE_MAX, UPSTREAM_HEDGE_MIN_MS, UPSTREAM_HEDGE_MAX_MS, UPSTREAM_FAILURE_PENALTY_MS
+except ImportError:
+    from . import dns_wire
+    from . import metrics
+    from .config import UPSTREAM_UDP_POOL_SIZE, UPSTREAM_TCP_MAX_CONNECTIONS, UPSTREAM_TCP_MAX_INFLIGHT, UPSTREAM_TCP_IDLE_TIMEOUT_S
+    from .config import UPSTREAM_DNS, UPSTREAM_HEDGE_MAX, UPSTREAM_HEDGE_MIN_MS, UPSTREAM_HEDGE_MAX_MS, UPSTREAM_FAILURE_PENALTY_MS
+
+
+def _question_bytes(msg: bytes) -> bytes:
+    """Seccion de pregunta (en minusculas) para validar que la respuesta corresponde."""
+    try:
+        return msg[dns_wire.HEADER_LEN:dns_wire.parse_question(msg).end].lower()
+    except (ValueError, IndexError):
+        return b""
+
+
+class _UdpUpstreamSocket(asyncio.DatagramProtocol):
+    """Un socket UDP conectado al upstream con sus queries pendientes."""
+
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: Dict[int, Tuple[bytes, asyncio.Future]] = {}
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < dns_wire.HEADER_LEN:
+            return
+        waiter = self.pending.get(dns_wire.get_id(data))
+        if waiter is None:
+            return  # respuesta tardia (ya vencio) o no solicitada
+        question, future = waiter
+        received_question = _question_bytes(data)
+        if received_question and received_question != question:
+            return  # mismo ID pero otra pregunta: se descarta
+        if not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        # ICMP port unreachable u otros errores: fallan todas las pendientes
+        for _, future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def connection_lost(self, exc):
+        self.closed = True
+        for _, future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError("upstream socket closed"))
+
+    def new_id(self) -> int:
+        while True:
+            msg_id = secrets.randbits(16)
+            if msg_id not in self.pending:
+                return msg_id
+
+
+class UdpForwarder:
+    """Pool de sockets UDP hacia un upstream (host, port)."""
+
+    def __init__(self, host: str, port: int, pool_size: int = UPSTREAM_UDP_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.pool_size = max(1, pool_size)
+        self.address = None
+        self.family = 0
+        self.server_label = f"{host}:{port}"
+        self._sockets = []
+        self._next = itertools.count()
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # Resolver la direccion una sola vez
+        infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP)
+        self.family, _, _, _, self.address = infos[0]
+        self.server_label = f"{self.address[0]}:{self.address[1]}"
+        self._sockets = [await self._open_socket() for _ in range(self.pool_size)]
+
+    async def _open_socket(self) -> _UdpUpstreamSocket:
+        loop = asyncio.get_running_loop()
+        _, protocol = await loop.create_datagram_endpoint(
+            _UdpUpstreamSocket, remote_addr=self.address, family=self.family
+        )
+        return protocol
+
+    async def _pick_socket(self) -> _UdpUpstreamSocket:
+        index = next(self._next) % len(self._sockets)
+        sock = self._sockets[index]
+        if sock.closed:
+            async with self._lock:
+                if self._sockets[index].closed:
+                    self._sockets[index] = await self._open_socket()
+                sock = self._sockets[index]
+        return sock
+
+    async def query(self, payload: bytes, timeout_s: float) -> Tuple[bytes, int, str]:
+        """Envia la query y retorna (response_bytes, rtt_ms, server_address)."""
+        sock = await self._pick_socket()
+        original_id = dns_wire.get_id(payload)
+        msg_id = sock.new_id()
+        future = asyncio.get_running_loop().create_future()
+        sock.pending[msg_id] = (_question_bytes(payload), future)
+
+        start = time.monotonic()
+        try:
+            sock.transport.sendto(dns_wire.set_id(payload, msg_id))
+            response = await asyncio.wait_for(future, timeout_s)
+        except asyncio.TimeoutError:
+            raise socket.timeout("upstream timeout")
+        finally:
+            sock.pending.pop(msg_id, None)
+
+        rtt_ms = int((time.monotonic() - start) * 1000)
+        return dns_wire.set_id(response, original_id), rtt_ms, self.server_label
+
+    def close(self):
+        for sock in self._sockets:
+            if sock.transport is not None:
+                sock.transport.close()
+        self._sockets = []
+
+
+class _TcpUpstreamConnection:
+    """Conexion TCP persistente: varias queries en vuelo, respuestas en cualquier orden."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.pending: Dict[int, Tuple[bytes, asyncio.Future]] = {}
+        self.closed = False
+        self.answered = 0
+        self.last_used = time.monotonic()
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                # Cada mensaje va precedido por 2 bytes BigEndian con su longitud
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+                data = await self.reader.readexactly(length)
+                self.last_used = time.monotonic()
+                if length < dns_wire.HEADER_LEN:
+                    continue
+                waiter = self.pending.get(dns_wire.get_id(data))
+                if waiter is None:
+                    continue
+                question, future = waiter
+                received_question = _question_bytes(data)
+                if received_question and received_question != question:
+                    continue
+                self.answered += 1
+                if not future.done():
+                    future.set_result(data)
+        except asyncio.CancelledError:
+            error = ConnectionError("upstream connection closed")
+        except (asyncio.IncompleteReadError, OSError) as e:
+            error = ConnectionError(f"upstream connection lost: {e}")
+        finally:
+            self._shutdown(error or ConnectionError("upstream connection closed"))
+
+    def _shutdown(self, error: BaseException):
+        self.closed = True
+        for _, future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.writer.close()
+
+    def new_id(self) -> int:
+        while True:
+            msg_id = secrets.randbits(16)
+            if msg_id not in self.pending:
+                return msg_id
+
+    async def query(self, payload: bytes) -> bytes:
+        msg_id = self.new_id()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[msg_id] = (_question_bytes(payload), future)
+        self.last_used = time.monotonic()
+        try:
+            wire = dns_wire.set_id(payload, msg_id)
+            self.writer.write(struct.pack("!H", len(wire)) + wire)
+            await self.writer.drain()
+            return await future
+        finally:
+            self.pending.pop(msg_id, None)
+            self.last_used = time.monotonic()
+
+    def close(self):
+        if not self._read_task.done():
+            self._read_task.cancel()
+
+
+class TcpForwarder:
+    """Pool de conexiones TCP persistentes hacia un upstream (host, port)."""
+
+    def __init__(self, host: str, port: int, max_connections: int = UPSTREAM_TCP_MAX_CONNECTIONS,
+                 max_inflight: int = UPSTREAM_TCP_MAX_INFLIGHT, idle_timeout_s: float = UPSTREAM_TCP_IDLE_TIMEOUT_S):
+        self.host = host
+        self.port = port
+        self.max_connections = max(1, max_connections)
+        self.max_inflight = max(1, max_inflight)
+        self.idle_timeout_s = idle_timeout_s
+        self.address = None
+        self.family = 0
+        self.server_label = f"{host}:{port}"
+        self._connections: List[_TcpUpstreamConnection] = []
+        self._connecting = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
+        self.family, _, _, _, self.address = infos[0]
+        self.server_label = f"{self.address[0]}:{self.address[1]}"
+        self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _open_connection(self) -> _TcpUpstreamConnection:
+        self._connecting += 1
+        try:
+            reader, writer = await asyncio.open_connection(self.address[0], self.address[1], family=self.family)
+        finally:
+            self._connecting -= 1
+        conn = _TcpUpstreamConnection(reader, writer)
+        self._connections.append(conn)
+        return conn
+
+    async def _acquire(self) -> Tuple[_TcpUpstreamConnection, bool]:
+        """Retorna (conexion, reutilizada). Prefiere la conexion abierta menos cargada."""
+        self._connections = [c for c in self._connections if not c.closed]
+        best = min(self._connections, key=lambda c: len(c.pending), default=None)
+        if best is not None and len(best.pending) < self.max_inflight:
+            return best, True
+        if len(self._connections) + self._connecting < self.max_connections:
+            return await self._open_connection(), False
+        if best is not None:
+            return best, True  # todas llenas: se encola en la menos cargada
+        return await self._open_connection(), False
+
+    async def _query(self, payload: bytes) -> bytes:
+        conn, reused = await self._acquire()
+        try:
+            return await conn.query(payload)
+        except ConnectionError:
+            # El upstream pudo cerrar la conexion ociosa justo antes de usarla: un reintento
+            if not reused:
+                raise
+            conn = await self._open_connection()
+            return await conn.query(payload)
+
+    async def query(self, payload: bytes, timeout_s: float) -> Tuple[bytes, int, str]:
+        """Envia la query (incluye conexion si hace falta) y retorna (response, rtt_ms, server)."""
+        original_id = dns_wire.get_id(payload)
+        start = time.monotonic()
+        try:
+            response = await asyncio.wait_for(self._query(payload), timeout_s)
+        except asyncio.TimeoutError:
+            raise socket.timeout("upstream tcp timeout")
+        rtt_ms = int((time.monotonic() - start) * 1000)
+        return dns_wire.set_id(response, original_id), rtt_ms, f"{self.server_label} (tcp)"
+
+    async def _reap_idle(self):
+        """Cierra conexiones sin queries pendientes que superan idle_timeout_s."""
+        interval = max(0.5, self.idle_timeout_s / 2)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for conn in list(self._connections):
+                if conn.closed or (not conn.pending and now - conn.last_used > self.idle_timeout_s):
+                    conn.close()
+                    self._connections.remove(conn)
+
+    def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+
+
+# --- SELECCION ENTRE VARIOS UPSTREAMS ---
+
+_RTT_ALPHA = 0.125          # peso de cada muestra en el RTT suavizado (como TCP)
+_FAIL_ALPHA = 0.1           # peso de cada resultado en la tasa de fallas
+_FAIL_HALF_LIFE_S = 30.0    # la tasa de fallas se olvida con el tiempo: un server caido se vuelve a probar
+_RTT_SAMPLES = 64           # RTTs recientes para el p95
+_MIN_P95_SAMPLES = 8
+# Respuestas que no cuentan como validas si otro upstream todavia puede contestar
+_RETRY_RCODES = (dns_wire.RCODE_SERVFAIL, 5)  # SERVFAIL, REFUSED
+
+
+def parse_servers(spec: str, default_port: int = 53) -> List[Tuple[str, int]]:
+    """"8.8.8.8,1.1.1.1:53,[2606:4700:4700::1111]" -> [(host, port)]."""
+    servers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, port = item, default_port
+        if item.startswith("["):
+            host, _, rest = item[1:].partition("]")
+            if rest.startswith(":"):
+                port = int(rest[1:])
+        elif item.count(":") == 1:
+            host, port_str = item.split(":")
+            port = int(port_str)
+        servers.append((host, port))
+    return servers
+
+
+class UpstreamStats:
+    """RTT suavizado, p95 reciente y tasa de fallas de un servidor upstream."""
+
+    __slots__ = ("host", "port", "label", "srtt_ms", "p95_ms", "fail_rate", "_fail_rate_at",
+                 "answers", "failures", "hedge_wins", "_samples", "_next_sample")
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.label = f"{host}:{port}"
+        self.srtt_ms: Optional[float] = None  # None = sin datos todavia
+        self.p95_ms: Optional[float] = None
+        self.fail_rate = 0.0
+        self._fail_rate_at = 0.0  # momento al que corresponde fail_rate (decae desde ahi)
+        self.answers = 0
+        self.failures = 0
+        self.hedge_wins = 0
+        self._samples: List[float] = []
+        self._next_sample = 0
+
+    def _add_sample(self, rtt_ms: float):
+        if self.srtt_ms is None:
+            self.srtt_ms = rtt_ms
+        else:
+            self.srtt_ms += _RTT_ALPHA * (rtt_ms - self.srtt_ms)
+        if len(self._samples) < _RTT_SAMPLES:
+            self._samples.append(rtt_ms)
+        else:
+            self._samples[self._next_sample] = rtt_ms
+            self._next_sample = (self._next_sample + 1) % _RTT_SAMPLES
+        # El p95 se recalcula cada 8 muestras (ordenar 64 floats por query no hace falta)
+        if len(self._samples) >= _MIN_P95_SAMPLES and (self.p95_ms is None or self._next_sample % 8 == 0):
+            ordered = sorted(self._samples)
+            self.p95_ms = ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _decayed_fail_rate(self, now: float) -> float:
+        if not self.fail_rate:
+            return 0.0
+        return self.fail_rate * 0.5 ** ((now - self._fail_rate_at) / _FAIL_HALF_LIFE_S)
+
+    def observe(self, rtt_ms: float):
+        """Respuesta valida en rtt_ms."""
+        self.answers += 1
+        self._add_sample(rtt_ms)
+        self._update_fail_rate(0.0)
+
+    def observe_failure(self):
+        """Timeout, error de red o SERVFAIL/REFUSED."""
+        self.failures += 1
+        self._update_fail_rate(1.0)
+
+    def _update_fail_rate(self, outcome: float):
+        now = time.monotonic()
+        rate = self._decayed_fail_rate(now)
+        self.fail_rate = rate + _FAIL_ALPHA * (outcome - rate)
+        self._fail_rate_at = now
+
+    def observe_lost(self, elapsed_ms: float):
+        """Perdio contra otro upstream: su RTT es al menos elapsed_ms."""
+        if self.srtt_ms is None or elapsed_ms > self.srtt_ms:
+            self._add_sample(elapsed_ms)
+
+    def score(self, now: float) -> float:
+        """Latencia esperada (ms): RTT suavizado + probabilidad de falla * penalizacion."""
+        # Sin datos: puntaje 0, asi cada servidor se prueba al menos una vez
+        srtt = self.srtt_ms if self.srtt_ms is not None else 0.0
+        return srtt + self._decayed_fail_rate(now) * UPSTREAM_FAILURE_PENALTY_MS
+
+    def hedge_delay_s(self) -> float:
+        """Espera antes de mandar la copia: el p95 reciente (o 2 * RTT suavizado con pocas muestras)."""
+        if self.p95_ms is not None:
+            delay_ms = self.p95_ms
+        elif self.srtt_ms is not None:
+            delay_ms = 2 * self.srtt_ms
+        else:
+            delay_ms = UPSTREAM_HEDGE_MAX_MS
+        return min(max(delay_ms, UPSTREAM_HEDGE_MIN_MS), UPSTREAM_HEDGE_MAX_MS) / 1000.0
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "server": self.label,
+            "srtt_ms": round(self.srtt_ms, 1) if self.srtt_ms is not None else None,
+            "p95_ms": round(self.p95_ms, 1) if self.p95_ms is not None else None,
+            "fail_rate": round(self._decayed_fail_rate(now), 4),
+            "score_ms": round(self.score(now), 1),
+            "answers": self.answers,
+            "failures": self.failures,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def _discard(task: asyncio.Future):
+    """Cancela un intento que ya no hace falta (o consume su resultado si ya termino)."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+class UpstreamPool:
+    """Reparte las queries UDP entre varios upstreams con hedging."""
+
+    def __init__(self, servers: List[Tuple[str, int]], max_hedges: int = UPSTREAM_HEDGE_MAX):
+        if not servers:
+            raise ValueError("UpstreamPool sin servidores")
+        self.servers = [UpstreamStats(host, port) for host, port in servers]
+        self.max_hedges = max(0, max_hedges)
+        self.queries = 0
+        self.hedges_sent = 0
+
+    def ranked(self) -> List[UpstreamStats]:
+        now = time.monotonic()
+        return sorted(self.servers, key=lambda s: s.score(now))
+
+    async def _attempt(self, server: UpstreamStats, payload: bytes, timeout_s: float) -> Tuple[bytes, int, str]:
+        forwarder = await get_udp_forwarder(server.host, server.port)
+        return await forwarder.query(payload, timeout_s)
+
+    async def query(self, payload: bytes, timeout_s: float) -> Tuple[bytes, int, str, UpstreamStats]:
+        """
+        Retorna (response_bytes, rtt_ms, server_address, upstream que respondio).
+        rtt_ms es desde el primer envio. socket.timeout si nadie responde a tiempo.
+        """
+        self.queries += 1
+        ranked = self.ranked()
+        start = time.monotonic()
+        deadline = start + timeout_s
+        attempts: Dict[asyncio.Future, Tuple[UpstreamStats, float]] = {}
+        next_server = 0
+        hedges = 0
+        last_launched = ranked[0]
+        fallback: Optional[Tuple[bytes, str, UpstreamStats]] = None
+
+        def launch():
+            nonlocal next_server, last_launched
+            server = ranked[next_server]
+            next_server += 1
+            last_launched = server
+            now = time.monotonic()
+            task = asyncio.ensure_future(self._attempt(server, payload, max(0.001, deadline - now)))
+            attempts[task] = (server, now)
+
+        launch()
+        try:
+            while attempts:
+                remaining = deadline - time.monotonic()
+                # Pasado el deadline no se lanzan hedges: esperar a que los intentos en curso venzan
+                can_hedge = hedges < self.max_hedges and next_server < len(ranked) and remaining > 0
+                # Cada intento vence solo (su timeout llega hasta el deadline)
+                wait_s = min(last_launched.hedge_delay_s(), remaining) if can_hedge else None
+                done, _ = await asyncio.wait(attempts, timeout=wait_s, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if time.monotonic() < deadline:
+                        hedges += 1
+                        self.hedges_sent += 1
+                        metrics.upstream_hedges.labels("sent").inc()
+                        launch()
+                    continue
+                for task in done:
+                    server, sent_at = attempts.pop(task)
+                    try:
+                        response, rtt_ms, address = task.result()
+                    except socket.timeout:
+                        server.observe_failure()
+                        metrics.upstream_timeouts.labels(server.label, "udp").inc()
+                        continue
+                    except (OSError, ConnectionError):
+                        server.observe_failure()
+                        continue
+                    metrics.upstream_rtt.labels(server.label, "udp").observe(rtt_ms / 1000.0)
+                    if len(response) >= dns_wire.HEADER_LEN and dns_wire.get_rcode(response) in _RETRY_RCODES:
+                        server.observe_failure()
+                        fallback = (response, address, server)
+                        continue
+                    server.observe(rtt_ms)
+                    if server is not ranked[0]:
+                        server.hedge_wins += 1
+                        metrics.upstream_hedges.labels("won").inc()
+                    return response, int((time.monotonic() - start) * 1000), address, server
+                # Fallaron todos los intentos en curso: pasar al siguiente sin esperar el hedge
+                if not attempts and next_server < len(ranked) and time.monotonic() < deadline:
+                    launch()
+        finally:
+            now = time.monotonic()
+            for task, (server, sent_at) in attempts.items():
+                _discard(task)
+                server.observe_lost((now - sent_at) * 1000)
+
+        if fallback is not None:
+            response, address, server = fallback
+            return response, int((time.monotonic() - start) * 1000), address, server
+        raise socket.timeout("upstream timeout")
+
+    def stats(self) -> dict:
+        return {
+            "queries": self.queries,
+            "hedges_sent": self.hedges_sent,
+            "servers": [s.stats() for s in self.ranked()],
+        }
+
+
+_pools: Dict[str, UpstreamPool] = {}
+
+
+def get_upstream_pool(spec: str = UPSTREAM_DNS) -> UpstreamPool:
+    """Pool para una lista de servidores ("host[:port],..."), creado la primera vez que se usa."""
+    pool = _pools.get(spec)
+    if pool is None:
+        pool = _pools.setdefault(spec, UpstreamPool(parse_servers(spec)))
+    return pool
+
+
+def pool_stats() -> dict:
+    return get_upstream_pool().stats()
+
+
+# --- POOL POR PROCESO ---
+
+_forwarders: Dict[Tuple[str, str, int], object] = {}
+_forwarders_lock: Optional[asyncio.Lock] = None
+
+
+async def _get_forwarder(cls, host: str, port: int):
+    global _forwarders_lock
+    key = (cls.__name__, host, port)
+    forwarder = _forwarders.get(key)
+    if forwarder is not None:
+        return forwarder
+    if _forwarders_lock is None:
+        _forwarders_lock = asyncio.Lock()
+    async with _forwarders_lock:
+        forwarder = _forwarders.get(key)
+        if forwarder is None:
+            forwarder = cls(host, port)
+            await forwarder.start()
+            _forwarders[key] = forwarder
+    return forwarder
+
+
+async def get_udp_forwarder(host: str, port: int) -> UdpForwarder:
+    """Forwarder UDP compartido para (host, port), creado la primera vez que se usa."""
+    return await _get_forwarder(UdpForwarder, host, port)
+
+
+async def get_tcp_forwarder(host: str, port: int) -> TcpForwarder:
+    """Pool TCP compartido para (host, port), creado la primera vez que se usa."""
+    return await _get_forwarder(TcpForwarder, host, port)
+
+
+def close_all():
+    """Cierra los sockets de todos los forwarders (shutdown del worker)."""
+    for forwarder in _forwarders.values():
+        forwarder.close()
+    _forwarders.clear()
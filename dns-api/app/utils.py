@@ -1,10 +1,22 @@
+import ipaddress
+from typing import Tuple
+
 import requests
-from google.cloud import firestore
 
 try:
-    from firebase_client import get_client
+    from storage import get_storage
+except ImportError:
+    from .storage import get_storage
+
+try:
+    import geo_index
+    from logs import get_query_logger
 except ImportError:
-    from .firebase_client import get_client
+    from . import geo_index
+    from .logs import get_query_logger
+
+# Fallas de geolocalizacion: pueden repetirse por query, se muestrean
+logger = get_query_logger("geo")
 
 REGION_MAP = {
     # A
@@ -95,70 +107,119 @@ def ip_to_int(ip):
 def int_to_ip(n):
     return f"{(n>>24)&255}.{(n>>16)&255}.{(n>>8)&255}.{n&255}"
 
-def get_geo_location_from_db(ip: str):
-    """Busca pais y region de una IP en la base de datos."""
-    db = get_client()
-    if not db:
-        # fallback simple: devuelve unknown o heurística (útil en tests)
-        return {"ip": ip, "country": "unknown", "region": "unknown"}
+def int_to_ip6(n):
+    return str(ipaddress.IPv6Address(n))
+
+def parse_ip(ip: str) -> Tuple[int, int]:
+    """
+    (version, entero) de una IP. Las IPv4 mapeadas (::ffff:a.b.c.d) se tratan
+    como IPv4. ValueError si no es una IP valida.
+    """
+    if ":" not in ip:
+        return 4, ip_to_int(ip)
+    addr = ipaddress.IPv6Address(ip)
+    if addr.ipv4_mapped is not None:
+        return 4, int(addr.ipv4_mapped)
+    return 6, int(addr)
+
+def ip_range_doc(start_ip: str, end_ip: str, country) -> Tuple[str, dict]:
+    """
+    (doc_id, documento) de ip_to_country para un rango IPv4 o IPv6.
+    IPv6 no entra en un entero de Firestore (int64): los extremos se guardan
+    como hex de 32 digitos, que ordena igual que el valor numerico.
+    """
+    version, s = parse_ip(start_ip)
+    end_version, e = parse_ip(end_ip)
+    if version != end_version:
+        raise ValueError("start_ip y end_ip deben ser de la misma version")
+    if version == 4:
+        return f"range_{s}_{e}", {
+            "range_start": s, "range_end": e, "start_ip": start_ip, "end_ip": end_ip, "country": country,
+        }
+    return f"range6_{s:032x}_{e:032x}", {
+        "ip_version": 6, "range_start_hex": f"{s:032x}", "range_end_hex": f"{e:032x}",
+        "start_ip": start_ip, "end_ip": end_ip, "country": country,
+    }
+
+def _unknown_location(ip: str) -> dict:
+    return {"ip": ip, "country": "unknown", "region": "unknown"}
+
+def _location_from_index(ip: str, version: int, ip_int: int):
+    """Camino rapido: indice en memoria. None si el indice todavia no esta cargado."""
+    index = geo_index.get_index()
+    if index is None:
+        return None
+    match = index.lookup(ip_int) if version == 4 else index.lookup_v6(ip_int)
+    if not match:
+        return _unknown_location(ip)
+    country = match[2]
+    return {"ip": ip, "country": country, "region": REGION_MAP.get(country, "unknown")}
+
+def _location_from_doc(ip: str, doc) -> dict:
+    # Si no hay doc, no hay match
+    if not doc:
+        return _unknown_location(ip)
+    country = doc.get("country", "unknown")
+    region = REGION_MAP.get(country, "unknown")
+    return {"ip": ip, "country": country, "region": region}
+
+def _heuristic_location(ip: str, ip_int: int, error) -> dict:
+    # Si la consulta falla por cualquier razón (p. ej. índice), fallback local heurístico
+    logger.warning("IP geolocation query failed: %s", error)
+    # Fallback heurístico simplificado (igual que tu versión actual)
+    # --- heurística simple para testing ---
+    if ip.startswith("192.168.") or ip.startswith("10.") or ip.startswith("172."):
+        country = "US"
+    else:
+        # pequeña heurística por residuo (solo para pruebas)
+        try:
+            if (ip_int % 10) < 3:
+                country = "US"
+            elif (ip_int % 10) < 6:
+                country = "CA"
+            else:
+                country = "MX"
+        except Exception:
+            country = "US"
+    region = REGION_MAP.get(country, "na")
+    return {"ip": ip, "country": country, "region": region}
 
-    # convertir IP a entero (IPv4). Si usas IPv6, añade manejo adicional.
+def get_geo_location_from_db(ip: str):
+    """Busca pais y region de una IP (IPv4 o IPv6) en la base de datos."""
     try:
-        ip_int = ip_to_int(ip)
+        version, ip_int = parse_ip(ip)
     except Exception:
         # IP inválida
-        return {"ip": ip, "country": "unknown", "region": "unknown"}
+        return _unknown_location(ip)
+
+    location = _location_from_index(ip, version, ip_int)
+    if location is not None:
+        return location
 
+    # El indice todavia no esta cargado: consulta directa al storage
     try:
-        # Construye la query: un solo filtro de desigualdad + order_by
-        q = (
-            db.collection("ip_to_country")
-              .where(filter=firestore.FieldFilter("range_start", "<=", ip_int))
-              .order_by("range_start", direction=firestore.Query.DESCENDING)
-              .limit(1)
-        )
-        docs = q.get()
+        # Rango con el mayor range_start <= ip (range_end se valida en el backend)
+        doc = get_storage().find_ip_range(ip_int, version=version)
     except Exception as e:
-        # Si la consulta falla por cualquier razón (p. ej. índice), fallback local heurístico
-        print(f"Warning: IP geolocation query failed: {e}")
-        # Fallback heurístico simplificado (igual que tu versión actual)
-        # --- heurística simple para testing ---
-        if ip.startswith("192.168.") or ip.startswith("10.") or ip.startswith("172."):
-            country = "US"
-        else:
-            # pequeña heurística por residuo (solo para pruebas)
-            try:
-                if (ip_int % 10) < 3:
-                    country = "US"
-                elif (ip_int % 10) < 6:
-                    country = "CA"
-                else:
-                    country = "MX"
-            except Exception:
-                country = "US"
-        region = REGION_MAP.get(country, "na")
-        return {"ip": ip, "country": country, "region": region}
+        return _heuristic_location(ip, ip_int, e)
+    return _location_from_doc(ip, doc)
 
-    # Si no hay docs, no hay match
-    if not docs:
-        return {"ip": ip, "country": "unknown", "region": "unknown"}
-
-    # Tomamos el único doc devuelto y verificamos range_end localmente
-    doc = docs[0].to_dict()
-    # doc debe contener range_start, range_end, country
+async def get_geo_location_from_db_async(ip: str):
+    """get_geo_location_from_db para el event loop: la consulta al storage no ocupa un thread."""
     try:
-        range_start = int(doc.get("range_start"))
-        range_end = int(doc.get("range_end"))
-        country = doc.get("country", "unknown")
+        version, ip_int = parse_ip(ip)
     except Exception:
-        return {"ip": ip, "country": "unknown", "region": "unknown"}
+        return _unknown_location(ip)
 
-    if range_start <= ip_int <= range_end:
-        region = REGION_MAP.get(country, "unknown")
-        return {"ip": ip, "country": country, "region": region}
+    location = _location_from_index(ip, version, ip_int)
+    if location is not None:
+        return location
 
-    # si no está dentro del range => no match
-    return {"ip": ip, "country": "unknown", "region": "unknown"}
+    try:
+        doc = await get_storage().find_ip_range_async(ip_int, version=version)
+    except Exception as e:
+        return _heuristic_location(ip, ip_int, e)
+    return _location_from_doc(ip, doc)
 
 def get_geo_location_from_api(ip: str):
     try:
@@ -173,12 +234,12 @@ def get_geo_location_from_api(ip: str):
             # Fallback a heurística local si la API falla
             return {"ip": ip, "country": "unknown", "region": "unknown"}
     except Exception as e:
-        print(f"Warning: IP-API request failed: {e}")
+        logger.warning("IP-API request failed: %s", e)
         # Fallback a heurística local
         if ip.startswith("192.168.") or ip.startswith("10.") or ip.startswith("172."):
             country = "US"
         else:
-            ip_int = ip_to_int(ip)
+            ip_int = parse_ip(ip)[1]
             if (ip_int % 10) < 3:
                 country = "US"
             elif (ip_int % 10) < 6:
@@ -0,0 +1,291 @@
+"""
+Benchmark reproducible de la API HTTP con un Firestore en memoria.
+
+La app corre en el mismo proceso (httpx + ASGITransport, con el lifespan
+real) y get_client() retorna benchmarks/fake_firestore.py, con una
+latencia configurable por llamada. Con --backend sqlite se usa el storage
+SQLite sobre un archivo temporal. Cada escenario se corre con varios
+niveles de concurrencia y reporta throughput y p50/p95/p99.
+
+Ejecutar (desde dns-api/):
+    python -m benchmarks.bench_api
+    python -m benchmarks.bench_api --concurrency 1 8 32 --requests 2000 --latency-ms 5
+    python -m benchmarks.bench_api --backend sqlite
+    python -m benchmarks.bench_api --output benchmarks/baseline.json
+    python -m benchmarks.bench_api --compare benchmarks/baseline.json --threshold 0.15
+
+Con --compare el proceso termina con codigo 1 si algun escenario perdio mas
+de --threshold de throughput o empeoro su p95 en esa proporcion.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+# La configuracion se lee al importar app.*: fijarla antes
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["GEO_DB_PATH"] = ""
+os.environ["RR_STATE_PATH"] = ""
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+os.environ.pop("prometheus_multiproc_dir", None)
+
+import httpx
+
+try:
+    from benchmarks.fake_firestore import FakeFirestore, install
+except ImportError:
+    from fake_firestore import FakeFirestore, install
+
+RECORD_TYPES = ("single", "multi", "weight", "geo", "roundtrip")
+REGIONS = ("na", "eu", "sa", "as")
+# Paises del rango sintetico (uno por /8) y su region segun utils.REGION_MAP
+COUNTRIES = ("US", "DE", "BR", "JP", "CA", "FR", "AR", "IN")
+
+
+def _ip(n: int) -> str:
+    return f"{(n >> 24) & 255}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+
+def make_dataset(records_per_type: int, targets_per_record: int, seed: int):
+    """Records de cada tipo + rangos ip_to_country. Determinista para una misma semilla."""
+    rnd = random.Random(seed)
+    ranges = {}
+    for i, country in enumerate(COUNTRIES):
+        start, end = (i + 11) << 24, ((i + 12) << 24) - 1
+        ranges[f"range_{start}_{end}"] = {
+            "range_start": start, "range_end": end,
+            "start_ip": _ip(start), "end_ip": _ip(end), "country": country,
+        }
+
+    records = {}
+    for rtype in RECORD_TYPES:
+        for n in range(records_per_type):
+            fqdn = f"{rtype}{n}.bench.example.com"
+            count = 1 if rtype == "single" else targets_per_record
+            targets, health = [], {}
+            for t in range(count):
+                country = COUNTRIES[rnd.randrange(len(COUNTRIES))]
+                tid = f"t{t}"
+                target = {
+                    "id": tid,
+                    "ip": f"192.0.{n % 256}.{t + 1}",
+                    "geo_location": {"country": country, "region": "unknown"},
+                }
+                if rtype == "weight":
+                    target["weight"] = rnd.randint(1, 100)
+                targets.append(target)
+                health[tid] = {
+                    "status": "healthy" if rnd.random() > 0.1 or t == 0 else "unhealthy",
+                    "rtt": {"by_region": {r: round(rnd.uniform(5, 250), 1) for r in REGIONS}},
+                }
+            records[fqdn] = {"fqdn": fqdn, "type": rtype, "ttl": 60, "targets": targets,
+                             "health": health, "rr_index": 0}
+    return records, ranges
+
+
+def load_dataset(args, records: Dict[str, dict], ranges: Dict[str, dict]):
+    """Carga los datos en el backend elegido; retorna el FakeFirestore (o None con sqlite)."""
+    if args.backend == "sqlite":
+        from app.storage import get_storage
+        store = get_storage()
+        store.set_ip_ranges(ranges.items())
+        for fqdn, record in records.items():
+            store.set_record(fqdn, record)
+        return None
+    fake = FakeFirestore(latency_ms=args.latency_ms)
+    fake.seed("ip_to_country", ranges)
+    fake.seed("records", records)
+    install(fake)
+    return fake
+
+
+def client_ips(count: int, seed: int) -> List[str]:
+    """IPs de cliente repartidas en muchos /24 de los rangos sembrados."""
+    rnd = random.Random(seed + 1)
+    return [_ip(((11 + rnd.randrange(len(COUNTRIES))) << 24) | rnd.randrange(1 << 24)) for _ in range(count)]
+
+
+class Scenario:
+    def __init__(self, name: str, make_request: Callable[[int], tuple]):
+        self.name = name
+        self.make_request = make_request
+
+
+def build_scenarios(fqdns: List[str], ips: List[str], seed: int) -> List[Scenario]:
+    by_type = {t: [f for f in fqdns if f.startswith(t)] for t in RECORD_TYPES}
+    rnd = random.Random(seed + 2)
+
+    def resolve(rtype):
+        names = by_type[rtype]
+        return lambda i: ("POST", "/api/resolve", {"host": names[i % len(names)], "client_ip": ips[i % len(ips)]})
+
+    def health(i):
+        fqdn = fqdns[i % len(fqdns)]
+        healthy = rnd.random() > 0.05
+        return ("POST", "/api/update_health", {
+            "fqdn": fqdn, "target_id": "t0", "region": REGIONS[i % len(REGIONS)],
+            "status": "healthy" if healthy else "unhealthy", "rtt": round(rnd.uniform(5, 250), 1),
+        })
+
+    scenarios = [Scenario(f"resolve_{t}", resolve(t)) for t in RECORD_TYPES]
+    scenarios.append(Scenario("records_list", lambda i: ("GET", "/api/records", None)))
+    scenarios.append(Scenario("update_health", health))
+    return scenarios
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, concurrency: int, total: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, path, body = scenario.make_request(i)
+            start = time.perf_counter()
+            resp = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run(args) -> Dict:
+    records, ranges = make_dataset(args.records_per_type, args.targets, args.seed)
+    fake = load_dataset(args, records, ranges)
+    fqdns = list(records)
+
+    from app import geo_index
+    from app.main import app
+
+    ips = client_ips(args.client_ips, args.seed)
+    scenarios = [s for s in build_scenarios(fqdns, ips, args.seed)
+                 if not args.scenarios or s.name in args.scenarios]
+
+    results: Dict[str, Dict[str, Dict]] = {}
+    async with app.router.lifespan_context(app):
+        deadline = time.monotonic() + 10
+        while geo_index.get_index() is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for scenario in scenarios:
+                results[scenario.name] = {}
+                for concurrency in args.concurrency:
+                    # Calentamiento: planes compilados, caches y conexiones
+                    await run_scenario(client, scenario, concurrency, min(args.requests, 100))
+                    calls_before = fake.calls if fake else 0
+                    row = await run_scenario(client, scenario, concurrency, args.requests)
+                    # Llamadas a Firestore por request: confirma si el escenario paso por el storage
+                    if fake:
+                        row["firestore_calls_per_request"] = round((fake.calls - calls_before) / args.requests, 3)
+                    results[scenario.name][str(concurrency)] = row
+                    print(f"{scenario.name:18s} c={concurrency:<4d} {row['rps']:>10.1f} req/s  "
+                          f"p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms p99={row['p99_ms']:.2f}ms"
+                          f"{'  fs/req=%.2f' % row['firestore_calls_per_request'] if fake else ''}"
+                          f"{'  errors=%d' % row['errors'] if row['errors'] else ''}")
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "latency_ms": args.latency_ms if fake else None,
+            "record_cache": os.environ.get("RECORD_CACHE_ENABLED", "1") == "1",
+            "requests": args.requests,
+            "records_per_type": args.records_per_type,
+            "targets": args.targets,
+            "seed": args.seed,
+            "firestore_calls": fake.calls if fake else None,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Lista de regresiones respecto del baseline (escenarios/concurrencias presentes en ambos)."""
+    regressions = []
+    for name, by_conc in current["results"].items():
+        for conc, row in by_conc.items():
+            base = baseline.get("results", {}).get(name, {}).get(conc)
+            if not base:
+                continue
+            rps_delta = (row["rps"] - base["rps"]) / base["rps"] if base["rps"] else 0.0
+            p95_delta = (row["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+            print(f"{name:18s} c={conc:<4s} rps {rps_delta:+7.1%}  p95 {p95_delta:+7.1%}")
+            if rps_delta < -threshold or p95_delta > threshold:
+                regressions.append(f"{name} c={conc}: rps {rps_delta:+.1%}, p95 {p95_delta:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la API con Firestore en memoria")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=1000, help="Requests por escenario y concurrencia")
+    parser.add_argument("--backend", choices=["firestore", "sqlite"], default="firestore",
+                        help="firestore = cliente en memoria; sqlite = app/storage.py sobre un archivo temporal")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia simulada por llamada a Firestore")
+    parser.add_argument("--records-per-type", type=int, default=50)
+    parser.add_argument("--targets", type=int, default=4, help="Targets por record (salvo single)")
+    parser.add_argument("--client-ips", type=int, default=5000)
+    parser.add_argument("--scenarios", nargs="*", help="Solo estos escenarios (ej: resolve_geo records_list)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-record-cache", action="store_true", help="RECORD_CACHE_ENABLED=0 (lee Firestore por request)")
+    parser.add_argument("--output", help="Guardar resultados en este JSON (baseline)")
+    parser.add_argument("--compare", help="Comparar contra un JSON guardado con --output")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Tolerancia para --compare (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    if args.no_record_cache:
+        os.environ["RECORD_CACHE_ENABLED"] = "0"
+    os.environ["STORAGE_BACKEND"] = args.backend
+    if args.backend == "sqlite":
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-dns-"), "dns.sqlite3")
+
+    current = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print("REGRESIONES:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark de seleccion ponderada: recorrido lineal (implementacion anterior
+de resolve_weight) vs tabla alias del plan compilado (app/resolve_plan.py).
+
+Ejecutar:
+    python -m benchmarks.bench_weight
+    python -m benchmarks.bench_weight --targets 5 20 50 --iterations 200000
+
+No necesita Firestore: usa records sinteticos en memoria.
+"""
+
+import argparse
+import random
+import time
+from collections import Counter
+
+from app import resolve_plan
+
+
+def make_record(n_targets: int) -> dict:
+    targets = [{"id": f"t{i}", "ip": f"10.0.{i // 256}.{i % 256}", "weight": random.randint(1, 100)}
+               for i in range(n_targets)]
+    health = {t["id"]: {"status": "healthy"} for t in targets}
+    return {"fqdn": f"bench{n_targets}.example.com", "type": "weight", "targets": targets, "health": health}
+
+
+def select_linear(record: dict):
+    """Cuerpo de resolve_weight antes de la tabla alias (sin el print)."""
+    targets = record.get("targets", [])
+    healthy = [t for t in targets if record.get("health", {}).get(t["id"]) and record["health"][t["id"]].get("status") == "healthy"]
+    if not healthy:
+        return None
+    total_weight = sum(t.get("weight", 1) for t in healthy)
+    rand_value = random.uniform(0, total_weight)
+    cumulative = 0
+    for target in healthy:
+        cumulative += target.get("weight", 1)
+        if rand_value <= cumulative:
+            return target["id"]
+    return None
+
+
+def select_alias(record: dict):
+    table = resolve_plan.get_plan(record).alias
+    return table.sample().id if table else None
+
+
+def run(fn, record: dict, iterations: int):
+    counts = Counter()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        counts[fn(record)] += 1
+    return time.perf_counter() - start, counts
+
+
+def max_share_error(record: dict, counts: Counter, iterations: int) -> float:
+    """Maxima diferencia absoluta entre la proporcion observada y la esperada."""
+    total = sum(t["weight"] for t in record["targets"])
+    return max(abs(counts[t["id"]] / iterations - t["weight"] / total) for t in record["targets"])
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark de seleccion ponderada")
+    p.add_argument("--targets", type=int, nargs="+", default=[2, 5, 20, 50, 100])
+    p.add_argument("--iterations", type=int, default=100000)
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    random.seed(args.seed)
+
+    print(f"{'targets':>8} {'lineal us/op':>13} {'alias us/op':>12} {'speedup':>8} {'err lineal':>11} {'err alias':>10}")
+    for n in args.targets:
+        record = make_record(n)
+        resolve_plan.clear()
+        select_alias(record)  # construccion de la tabla fuera de la medicion
+        t_lin, c_lin = run(select_linear, record, args.iterations)
+        t_ali, c_ali = run(select_alias, record, args.iterations)
+        print(f"{n:>8} {t_lin / args.iterations * 1e6:>13.3f} {t_ali / args.iterations * 1e6:>12.3f} "
+              f"{t_lin / t_ali:>7.1f}x {max_share_error(record, c_lin, args.iterations):>11.4f} "
+              f"{max_share_error(record, c_ali, args.iterations):>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Reemplazo en memoria del cliente de Firestore para los benchmarks.
+
+Implementa solo lo que usa la API (documentos, queries simples, get_all,
+batch y on_snapshot) y agrega una latencia configurable a cada llamada que
+en Firestore real seria un round trip. install() lo deja como cliente de
+app.firebase_client, asi get_client() lo retorna sin credenciales; la
+variante async (FakeAsyncFirestore, para get_async_client()) comparte los
+mismos datos y espera la latencia con asyncio.sleep.
+"""
+
+import asyncio
+import copy
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: Optional[dict], reference=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = reference
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class _ChangeType:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _Change:
+    def __init__(self, kind: str, snapshot: FakeSnapshot):
+        self.type = _ChangeType(kind)
+        self.document = snapshot
+
+
+class FakeWatch:
+    def __init__(self, collection: "FakeCollection", callback):
+        self.collection = collection
+        self.callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        with self.collection.lock:
+            if self in self.collection.watches:
+                self.collection.watches.remove(self)
+
+
+def _set_path(data: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+_OPS = {
+    "<": lambda a, b: a < b, "<=": lambda a, b: a <= b, "==": lambda a, b: a == b,
+    ">": lambda a, b: a > b, ">=": lambda a, b: a >= b, "!=": lambda a, b: a != b,
+}
+
+
+class FakeDocument:
+    def __init__(self, collection: "FakeCollection", doc_id: str):
+        self.collection = collection
+        self.id = doc_id
+
+    def _snapshot(self) -> FakeSnapshot:
+        return FakeSnapshot(self.id, self.collection.docs.get(self.id), self)
+
+    def get(self) -> FakeSnapshot:
+        self.collection.client.rpc()
+        with self.collection.lock:
+            return self._snapshot()
+
+    def set(self, data: dict, merge: bool = False):
+        self.collection.client.rpc()
+        self._apply_set(data)
+
+    def update(self, updates: dict):
+        self.collection.client.rpc()
+        self._apply_update(updates)
+
+    def delete(self):
+        self.collection.client.rpc()
+        self._apply_delete()
+
+    def _apply_set(self, data: dict):
+        with self.collection.lock:
+            kind = "MODIFIED" if self.id in self.collection.docs else "ADDED"
+            self.collection.docs[self.id] = copy.deepcopy(data)
+        self.collection.notify(self.id, kind)
+
+    def _apply_update(self, updates: dict):
+        with self.collection.lock:
+            if self.id not in self.collection.docs:
+                raise KeyError(f"No document to update: {self.id}")
+            for path, value in updates.items():
+                _set_path(self.collection.docs[self.id], path, copy.deepcopy(value))
+        self.collection.notify(self.id, "MODIFIED")
+
+    def _apply_delete(self):
+        with self.collection.lock:
+            existed = self.collection.docs.pop(self.id, None) is not None
+        if existed:
+            self.collection.notify(self.id, "REMOVED")
+
+
+class FakeQuery:
+    def __init__(self, collection: "FakeCollection", filters=(), order=None, descending=False,
+                 limit=None, start_after=None):
+        self.collection = collection
+        self.filters = list(filters)
+        self.order = order
+        self.descending = descending
+        self.limit_count = limit
+        self.start_after_id = start_after
+
+    def _copy(self, **changes) -> "FakeQuery":
+        args = dict(filters=self.filters, order=self.order, descending=self.descending,
+                    limit=self.limit_count, start_after=self.start_after_id)
+        args.update(changes)
+        return FakeQuery(self.collection, **args)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self.filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path: str, direction=None):
+        return self._copy(order=field_path, descending=str(direction).upper().endswith("DESCENDING"))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot.id)
+
+    def select(self, field_paths):
+        return self
+
+    def stream(self) -> List[FakeSnapshot]:
+        self.collection.client.rpc()
+        return self._run()
+
+    def _run(self) -> List[FakeSnapshot]:
+        with self.collection.lock:
+            items = list(self.collection.docs.items())
+        for field, op, value in self.filters:
+            items = [(k, d) for k, d in items if field in d and _OPS[op](d[field], value)]
+        if self.order and self.order != "__name__":
+            items = [(k, d) for k, d in items if self.order in d]
+            items.sort(key=lambda kv: kv[1][self.order], reverse=self.descending)
+        else:
+            items.sort(key=lambda kv: kv[0], reverse=self.descending)
+        if self.start_after_id is not None:
+            ids = [k for k, _ in items]
+            if self.start_after_id in ids:
+                items = items[ids.index(self.start_after_id) + 1:]
+        if self.limit_count is not None:
+            items = items[:self.limit_count]
+        return [FakeSnapshot(k, d, FakeDocument(self.collection, k)) for k, d in items]
+
+    def get(self) -> List[FakeSnapshot]:
+        return self.stream()
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client: "FakeFirestore", name: str):
+        super().__init__(self)
+        self.client = client
+        self.name = name
+        self.docs: Dict[str, dict] = {}
+        self.watches: List[FakeWatch] = []
+        self.lock = threading.RLock()
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self, doc_id)
+
+    def on_snapshot(self, callback) -> FakeWatch:
+        watch = FakeWatch(self, callback)
+        with self.lock:
+            self.watches.append(watch)
+            docs = [FakeSnapshot(k, d) for k, d in self.docs.items()]
+        callback(docs, [_Change("ADDED", s) for s in docs], None)
+        return watch
+
+    def notify(self, doc_id: str, kind: str):
+        with self.lock:
+            watches = list(self.watches)
+            snapshot = FakeSnapshot(doc_id, self.docs.get(doc_id))
+        for watch in watches:
+            # El snapshot completo no se arma en cada cambio: record_cache solo lo usa al (re)conectar
+            watch.callback([], [_Change(kind, snapshot)], None)
+
+
+class FakeBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self.client = client
+        self.ops = []
+
+    def set(self, ref: FakeDocument, data: dict, merge: bool = False):
+        self.ops.append((ref._apply_set, data))
+
+    def update(self, ref: FakeDocument, updates: dict):
+        self.ops.append((ref._apply_update, updates))
+
+    def delete(self, ref: FakeDocument):
+        self.ops.append((lambda _: ref._apply_delete(), None))
+
+    def commit(self):
+        self.client.rpc()
+        for apply, arg in self.ops:
+            apply(arg)
+        self.ops = []
+
+
+class FakeFirestore:
+    """Cliente en memoria; latency_ms se duerme en cada llamada que seria un round trip."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000.0
+        self.collections: Dict[str, FakeCollection] = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def rpc(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+
+    async def arpc(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency_s > 0:
+            await asyncio.sleep(self.latency_s)
+
+    def collection(self, name: str) -> FakeCollection:
+        with self._lock:
+            if name not in self.collections:
+                self.collections[name] = FakeCollection(self, name)
+            return self.collections[name]
+
+    def get_all(self, refs):
+        self.rpc()
+        for ref in list(refs):
+            with ref.collection.lock:
+                yield ref._snapshot()
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def seed(self, collection: str, docs: Dict[str, dict]):
+        """Carga documentos sin latencia ni notificaciones (antes de arrancar la app)."""
+        col = self.collection(collection)
+        with col.lock:
+            for doc_id, data in docs.items():
+                col.docs[doc_id] = copy.deepcopy(data)
+
+
+# --- AsyncClient ---
+
+class FakeAsyncDocument:
+    def __init__(self, doc: FakeDocument):
+        self._doc = doc
+        self.id = doc.id
+
+    async def get(self) -> FakeSnapshot:
+        await self._doc.collection.client.arpc()
+        with self._doc.collection.lock:
+            return self._doc._snapshot()
+
+    async def set(self, data: dict, merge: bool = False):
+        await self._doc.collection.client.arpc()
+        self._doc._apply_set(data)
+
+    async def update(self, updates: dict):
+        await self._doc.collection.client.arpc()
+        self._doc._apply_update(updates)
+
+    async def delete(self):
+        await self._doc.collection.client.arpc()
+        self._doc._apply_delete()
+
+
+class FakeAsyncQuery:
+    def __init__(self, query: FakeQuery):
+        self._query = query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        return FakeAsyncQuery(self._query.where(field_path, op_string, value, filter=filter))
+
+    def order_by(self, field_path: str, direction=None):
+        return FakeAsyncQuery(self._query.order_by(field_path, direction))
+
+    def limit(self, count: int):
+        return FakeAsyncQuery(self._query.limit(count))
+
+    def start_after(self, snapshot):
+        return FakeAsyncQuery(self._query.start_after(snapshot))
+
+    def select(self, field_paths):
+        return self
+
+    async def get(self) -> List[FakeSnapshot]:
+        await self._query.collection.client.arpc()
+        return self._query._run()
+
+    async def stream(self):
+        for snapshot in await self.get():
+            yield snapshot
+
+
+class FakeAsyncCollection(FakeAsyncQuery):
+    def document(self, doc_id: str) -> FakeAsyncDocument:
+        return FakeAsyncDocument(self._query.document(doc_id))
+
+
+class FakeAsyncFirestore:
+    """Vista async de un FakeFirestore: mismos documentos, latencia con asyncio.sleep."""
+
+    def __init__(self, sync: FakeFirestore):
+        self.sync = sync
+
+    def collection(self, name: str) -> FakeAsyncCollection:
+        return FakeAsyncCollection(self.sync.collection(name))
+
+    async def get_all(self, refs):
+        await self.sync.arpc()
+        for ref in list(refs):
+            with ref._doc.collection.lock:
+                yield ref._doc._snapshot()
+
+
+def install(fake: FakeFirestore):
+    """Hace que get_client() y get_async_client() de app.firebase_client retornen el cliente falso."""
+    from app import firebase_client
+    firebase_client._db = fake
+    firebase_client._async_db = FakeAsyncFirestore(fake)
+    firebase_client._app = object()
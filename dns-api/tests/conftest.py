@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Los modulos de app/ se importan como paquete (from app import ...) desde dns-api/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEO_DB_PATH", "")
+os.environ.setdefault("RR_STATE_PATH", "")
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
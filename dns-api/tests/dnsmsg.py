@@ -0,0 +1,30 @@
+"""Armado de mensajes DNS wire para los tests."""
+
+import struct
+
+
+def name(*labels: bytes) -> bytes:
+    return b"".join(bytes([len(l)]) + l for l in labels) + b"\x00"
+
+
+def query(qname: bytes, qtype: int = 1, qclass: int = 1, msg_id: int = 0x1234, flags: int = 0x0100,
+          opt_do: bool = False) -> bytes:
+    arcount = 1 if opt_do else 0
+    msg = struct.pack("!HHHHHH", msg_id, flags, 1, 0, 0, arcount) + qname + struct.pack("!HH", qtype, qclass)
+    if opt_do:
+        msg += b"\x00" + struct.pack("!HHIH", 41, 4096, 0x8000, 0)
+    return msg
+
+
+def soa_rdata(minimum: int) -> bytes:
+    return name(b"ns", b"example") + name(b"host", b"example") + struct.pack("!IIIII", 1, 7200, 3600, 1209600, minimum)
+
+
+def response(q: bytes, rcode: int = 0, answers=(), authority=()) -> bytes:
+    """Respuesta a la query q (sin OPT); answers/authority: (type, ttl, rdata) con el nombre comprimido al QNAME."""
+    msg_id, flags, qd, _, _, _ = struct.unpack_from("!HHHHHH", q, 0)
+    header = struct.pack("!HHHHHH", msg_id, 0x8180 | rcode, qd, len(answers), len(authority), 0)
+    body = q[12:]
+    for rtype, ttl, rdata in list(answers) + list(authority):
+        body += b"\xc0\x0c" + struct.pack("!HHIH", rtype, 1, ttl, len(rdata)) + rdata
+    return header + body
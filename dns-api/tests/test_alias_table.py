@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from app.alias_table import AliasTable
+
+
+def exact_distribution(table: AliasTable) -> dict:
+    """Probabilidad de cada item segun prob/alias (sin muestrear)."""
+    dist = {item: 0.0 for item in table.items}
+    for i in range(table.n):
+        dist[table.items[i]] += table.prob[i] / table.n
+        dist[table.items[table.alias[i]]] += (1.0 - table.prob[i]) / table.n
+    return dist
+
+
+@pytest.mark.parametrize("weights", [
+    [1, 1, 1],
+    [1, 2, 3, 4],
+    [10, 0.5, 0.25, 7, 100],
+    [5],
+    [0, 3, 0, 1],
+])
+def test_table_matches_normalized_weights(weights):
+    items = [f"t{i}" for i in range(len(weights))]
+    dist = exact_distribution(AliasTable(items, weights))
+    total = sum(weights)
+    for item, w in zip(items, weights):
+        assert dist[item] == pytest.approx(w / total, abs=1e-12)
+
+
+def test_zero_and_negative_weights_are_never_sampled():
+    table = AliasTable(["a", "b", "c"], [0, -5, 2])
+    grid = [k / 1000 for k in range(1000)]
+    assert {table.sample(lambda: u) for u in grid} == {"c"}
+
+
+def test_all_zero_weights_fall_back_to_uniform():
+    dist = exact_distribution(AliasTable(["a", "b", "c", "d"], [0, 0, 0, 0]))
+    assert all(p == pytest.approx(0.25) for p in dist.values())
+
+
+def test_sampling_over_a_uniform_grid_follows_the_weights():
+    table = AliasTable(["a", "b", "c"], [1, 2, 7])
+    counts = {"a": 0, "b": 0, "c": 0}
+    steps = 10000
+    for k in range(steps):
+        counts[table.sample(lambda: (k + 0.5) / steps)] += 1
+    assert counts == pytest.approx({"a": 1000, "b": 2000, "c": 7000}, abs=2)
+
+
+def test_random_sampling_is_close_to_the_weights():
+    rnd = random.Random(42)
+    table = AliasTable(["a", "b"], [1, 3])
+    hits = sum(table.sample(rnd.random) == "b" for _ in range(20000))
+    assert hits / 20000 == pytest.approx(0.75, abs=0.02)
+
+
+def test_rand_equal_to_one_stays_in_range():
+    table = AliasTable(["a", "b"], [1, 1])
+    assert table.sample(lambda: 1.0) in ("a", "b")
@@ -0,0 +1,170 @@
+import pytest
+
+from app import answer_cache as answer_cache_module
+from app import dns_wire
+from app.answer_cache import AnswerCache, make_key
+
+from dnsmsg import name, query, response, soa_rdata
+
+A = dns_wire.TYPE_A
+SOA = dns_wire.TYPE_SOA
+IP = b"\x01\x02\x03\x04"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", clock)
+    return clock
+
+
+def new_cache(**kwargs):
+    params = dict(max_entries=10, max_ttl=3600, negative_max_ttl=900, stale_max_s=60, stale_ttl=30)
+    params.update(kwargs)
+    return AnswerCache(**params)
+
+
+def ttls(msg: bytes):
+    return [ttl for _, ttl in dns_wire.scan_ttls(msg, dns_wire.parse_question(msg).end).ttl_fields]
+
+
+def test_make_key_includes_type_class_and_do_bit():
+    q = query(name(b"example", b"com"))
+    assert make_key(q) == (("example.com", 1, 1, False), len(q))
+    assert make_key(query(name(b"example", b"com"), opt_do=True))[0][3] is True
+    assert make_key(query(name(b"example", b"com"), qtype=28))[0] != make_key(q)[0]
+
+
+@pytest.mark.parametrize("msg", [
+    query(name(b"example", b"com"), flags=0x8100),        # es una respuesta
+    query(name(b"example", b"com"), flags=0x2100),        # opcode 4 (NOTIFY)
+    b"\x00\x01",                                          # basura
+])
+def test_make_key_rejects_non_cacheable_queries(msg):
+    assert make_key(msg) is None
+
+
+@pytest.mark.parametrize("soa_ttl, minimum, expected", [(300, 60, 60), (30, 600, 30), (3600, 3600, 900)])
+def test_negative_ttl_is_min_of_soa_ttl_and_minimum(clock, soa_ttl, minimum, expected):
+    cache = new_cache()
+    q = query(name(b"missing", b"example"))
+    key, end = make_key(q)
+    assert cache.put(key, response(q, rcode=dns_wire.RCODE_NXDOMAIN, authority=[(SOA, soa_ttl, soa_rdata(minimum))]))
+    assert cache._entries[key].ttl == expected
+    clock.now += expected - 1
+    assert cache.get(key, q, end) is not None
+    clock.now += 1
+    assert cache.get(key, q, end) is None
+
+
+def test_nodata_is_cached_with_soa_and_negative_without_soa_is_not(clock):
+    cache = new_cache()
+    q = query(name(b"example", b"com"), qtype=28)
+    key, _ = make_key(q)
+    assert not cache.put(key, response(q, rcode=dns_wire.RCODE_NXDOMAIN))
+    assert cache.put(key, response(q, authority=[(SOA, 120, soa_rdata(50))]))
+    assert cache._entries[key].ttl == 50
+
+
+def test_servfail_and_truncated_answers_are_not_cached(clock):
+    cache = new_cache()
+    q = query(name(b"example", b"com"))
+    key, _ = make_key(q)
+    assert not cache.put(key, response(q, rcode=dns_wire.RCODE_SERVFAIL))
+    truncated = bytearray(response(q, answers=[(A, 300, IP)]))
+    truncated[2] |= 0x02
+    assert not cache.put(key, bytes(truncated))
+
+
+def test_response_for_another_question_is_not_stored_under_the_key(clock):
+    cache = new_cache()
+    q = query(name(b"example", b"com"))
+    other = query(name(b"example", b"net"))
+    key, _ = make_key(q)
+    assert not cache.put(key, response(other, answers=[(A, 300, IP)]))
+
+
+def test_hit_rewrites_id_question_case_and_remaining_ttl(clock):
+    cache = new_cache()
+    q = query(name(b"example", b"com"), msg_id=1)
+    key, end = make_key(q)
+    cache.put(key, response(q, answers=[(A, 300, IP), (A, 100, b"\x05\x06\x07\x08")]))
+    clock.now += 40
+    q2 = query(name(b"ExAmPlE", b"CoM"), msg_id=0xBEEF)
+    hit = cache.get(make_key(q2)[0], q2, end)
+    assert dns_wire.get_id(hit) == 0xBEEF
+    assert hit[12:end] == q2[12:end]
+    assert ttls(hit) == [260, 60]
+    # La entrada vive lo que el TTL minimo de answer
+    clock.now += 60
+    assert cache.get(key, q, end) is None
+
+
+def test_answer_ttl_is_capped_by_max_ttl(clock):
+    cache = new_cache(max_ttl=10)
+    q = query(name(b"example", b"com"))
+    key, _ = make_key(q)
+    cache.put(key, response(q, answers=[(A, 300, IP)]))
+    assert cache._entries[key].ttl == 10
+
+
+def test_serve_stale_window(clock):
+    cache = new_cache(stale_max_s=60, stale_ttl=30)
+    q = query(name(b"example", b"com"))
+    key, end = make_key(q)
+    cache.put(key, response(q, answers=[(A, 100, IP)]))
+    assert cache.get_stale(key, q, end) is None          # todavia vigente
+    clock.now += 100
+    assert cache.get(key, q, end) is None
+    assert cache.has_stale(key)
+    assert ttls(cache.get_stale(key, q, end)) == [30]
+    cache.mark_failed(key)
+    assert cache.recently_failed(key)
+    clock.now += 60
+    assert cache.get_stale(key, q, end) is None
+    cache.get(key, q, end)
+    assert key not in cache._entries
+
+
+def test_lru_eviction(clock):
+    cache = new_cache(max_entries=2)
+    entries = []
+    for label in (b"a", b"b", b"c"):
+        q = query(name(label, b"example"))
+        key, end = make_key(q)
+        entries.append((key, q, end))
+        cache.put(key, response(q, answers=[(A, 300, IP)]))
+        if label == b"b":
+            cache.get(*entries[0])   # "a" pasa a ser el mas reciente
+    assert entries[1][0] not in cache._entries
+    assert entries[0][0] in cache._entries and entries[2][0] in cache._entries
+    assert cache.evictions == 1
+
+
+def test_truncate_response_keeps_question_and_sets_tc():
+    q = query(name(b"example", b"com"))
+    truncated = dns_wire.truncate_response(response(q, answers=[(A, 300, IP)] * 40))
+    assert dns_wire.get_flags(truncated) & dns_wire.FLAG_TC
+    assert dns_wire.answer_count(truncated) == 0
+    assert dns_wire.parse_question(truncated).qname == "example.com"
+    assert len(truncated) == len(q)
+
+
+def test_max_udp_payload_from_edns():
+    assert dns_wire.max_udp_payload(query(name(b"example", b"com"))) == 512
+    assert dns_wire.max_udp_payload(query(name(b"example", b"com"), opt_do=True)) == 4096
+
+
+def test_response_min_ttl_uses_soa_for_negative_answers():
+    q = query(name(b"missing", b"example"))
+    assert dns_wire.response_min_ttl(response(q, rcode=3, authority=[(SOA, 300, soa_rdata(45))])) == 45
+    assert dns_wire.response_min_ttl(response(q, answers=[(A, 20, IP)])) == 20
+    assert dns_wire.response_min_ttl(b"\x00" * 5) is None
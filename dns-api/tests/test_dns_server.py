@@ -0,0 +1,34 @@
+import asyncio
+
+from app import dns_server, dns_wire
+
+from dnsmsg import name, query
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+
+def test_managed_lookup_error_answers_servfail(monkeypatch):
+    async def failing_get_record(fqdn):
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr("app.dns_handler.get_record", failing_get_record)
+    q = query(name(b"www", b"example", b"com"))
+
+    async def run():
+        server = dns_server._UdpDnsServer()
+        server.connection_made(FakeTransport())
+        await server._answer(q, ("127.0.0.1", 5353))
+        return server.transport.sent
+
+    sent = asyncio.run(run())
+    assert len(sent) == 1
+    response = sent[0][0]
+    assert dns_wire.get_id(response) == dns_wire.get_id(q)
+    assert dns_wire.get_rcode(response) == dns_wire.RCODE_SERVFAIL
+    assert dns_wire.parse_question(response).qname == "www.example.com"
@@ -0,0 +1,67 @@
+import struct
+
+import pytest
+
+from app import dns_wire
+from app.answer_cache import AnswerCache, make_key
+
+from dnsmsg import name, query, response, soa_rdata
+
+
+def test_parse_question_lowercases_and_keeps_end():
+    q = query(name(b"WWW", b"Example", b"COM"), qtype=28)
+    question = dns_wire.parse_question(q)
+    assert question == ("www.example.com", 28, 1, len(q))
+
+
+def test_parse_question_root_name():
+    assert dns_wire.parse_question(query(b"\x00")).qname == ""
+
+
+@pytest.mark.parametrize("msg", [
+    b"\x00" * 11,                                                     # header corto
+    struct.pack("!HHHHHH", 1, 0, 2, 0, 0, 0) + name(b"a") + b"\x00\x01\x00\x01",  # qdcount 2
+    query(name(b"a"))[:-1],                                           # pregunta truncada
+    query(b"\x05ab"),                                                 # label mas largo que el mensaje
+    query(b"\xc0\x0c"),                                               # qname comprimido
+])
+def test_parse_question_rejects_malformed(msg):
+    with pytest.raises(ValueError):
+        dns_wire.parse_question(msg)
+
+
+def test_dot_inside_label_is_not_a_label_separator():
+    one_label = dns_wire.parse_question(query(name(b"www.example", b"com"))).qname
+    three_labels = dns_wire.parse_question(query(name(b"www", b"example", b"com"))).qname
+    assert one_label == "www\\.example.com"
+    assert one_label != three_labels
+
+
+@pytest.mark.parametrize("a, b", [
+    ((b"a\\", b"b"), (b"a\\.b",)),
+    ((b"\xc3\xa9",), (b"\xc3\xa8",)),          # bytes no ASCII distintos
+    ((b"\xff",), (b"\\255",)),                 # byte crudo vs su escape escrito literal
+    ((b"a b",), (b"a\\032b",)),
+])
+def test_distinct_wire_names_give_distinct_keys(a, b):
+    key_a, _ = make_key(query(name(*a)))
+    key_b, _ = make_key(query(name(*b)))
+    assert key_a != key_b
+
+
+def test_only_ascii_letters_are_case_folded():
+    assert make_key(query(name(b"\xc3\x89")))[0] != make_key(query(name(b"\xc3\xa9")))[0]
+    assert make_key(query(name(b"ExAmPlE")))[0] == make_key(query(name(b"example")))[0]
+
+
+def test_negative_answer_for_odd_name_is_not_served_to_normal_name():
+    cache = AnswerCache(max_entries=10, max_ttl=300, negative_max_ttl=300)
+    odd = query(name(b"www.example", b"com"))
+    normal = query(name(b"www", b"example", b"com"))
+    assert len(odd) == len(normal)
+    odd_key, _ = make_key(odd)
+    nxdomain = response(odd, rcode=dns_wire.RCODE_NXDOMAIN, authority=[(dns_wire.TYPE_SOA, 300, soa_rdata(60))])
+    assert cache.put(odd_key, nxdomain)
+    normal_key, normal_end = make_key(normal)
+    assert cache.get(normal_key, normal, normal_end) is None
+    assert cache.get(odd_key, odd, make_key(odd)[1]) is not None
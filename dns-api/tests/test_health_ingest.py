@@ -0,0 +1,91 @@
+import pytest
+
+from app import health_ingest
+
+
+class FakeStore:
+    """Storage minimo: rechaza el lote entero si un update es invalido, como WriteBatch.update."""
+
+    def __init__(self):
+        self.records = {}
+        self.down = False
+        self.calls = 0
+
+    def get_records(self, fqdns):
+        return {fqdn: self.records.get(fqdn) for fqdn in fqdns}
+
+    def write_record_updates(self, writes):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("unavailable")
+        for _, _, updates in writes:
+            for path in updates:
+                if "" in path.split("."):
+                    raise ValueError("Empty element")
+        for fqdn, placeholder, updates in writes:
+            record = self.records.setdefault(fqdn, placeholder or {})
+            record.update(updates)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(health_ingest, "get_storage", lambda: store)
+    for state in (health_ingest._pending, health_ingest._placeholders, health_ingest._last_written,
+                  health_ingest._recent, health_ingest._aggregate, health_ingest._attempts):
+        state.clear()
+    yield store
+    for state in (health_ingest._pending, health_ingest._placeholders, health_ingest._aggregate,
+                  health_ingest._attempts):
+        state.clear()
+
+
+@pytest.mark.parametrize("path", ["health..x", ".x", "health.x.", "", "health.a/b", "health.a[0]"])
+def test_invalid_update_paths_are_rejected(path):
+    with pytest.raises(ValueError):
+        health_ingest.submit_updates("a.example", {path: 1})
+
+
+@pytest.mark.parametrize("target_id, region", [("", "us"), ("t1", ""), ("t.1", "us"), ("t1", "us*")])
+def test_invalid_report_elements_are_rejected(target_id, region):
+    with pytest.raises(ValueError):
+        health_ingest.submit_report("a.example", target_id, region, "healthy", 10.0)
+
+
+def test_bad_update_does_not_block_the_rest(store):
+    health_ingest.submit_report("good.example", "t1", "us", "healthy", 10.0)
+    # Saltea la validacion: simula un update que el storage rechaza igual
+    health_ingest._enqueue("bad.example", {"health..x": 1})
+    health_ingest.submit_report("other.example", "t1", "us", "healthy", 10.0)
+
+    assert health_ingest.flush() == 2
+    assert store.records["good.example"]["health.t1.status"] == "healthy"
+    assert "other.example" in store.records
+    assert "bad.example" not in store.records
+    assert not health_ingest._pending
+    assert health_ingest.flush() == 0
+
+
+def test_outage_requeues_until_attempts_run_out(store, monkeypatch):
+    monkeypatch.setattr(health_ingest, "HEALTH_MAX_ATTEMPTS", 3)
+    health_ingest.submit_report("a.example", "t1", "us", "healthy", 10.0)
+    store.down = True
+    assert health_ingest.flush() == 0
+    assert health_ingest.flush() == 0
+    assert "a.example" in health_ingest._pending
+    assert health_ingest.flush() == 0
+    assert "a.example" not in health_ingest._pending
+    # El reporte descartado no queda suprimido por el deadband
+    store.down = False
+    assert health_ingest.submit_report("a.example", "t1", "us", "healthy", 10.0) is not None
+    assert health_ingest.flush() == 1
+
+
+def test_outage_stops_retrying_per_record(store):
+    for i in range(5):
+        health_ingest.submit_report(f"r{i}.example", "t1", "us", "healthy", 10.0)
+    store.down = True
+    health_ingest.flush()
+    # Un lote y un reintento individual, no uno por record
+    assert store.calls == 2
+    assert len(health_ingest._pending) == 5
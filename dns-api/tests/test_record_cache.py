@@ -0,0 +1,160 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import record_cache
+
+
+class Doc:
+    def __init__(self, fqdn, data):
+        self.id = fqdn
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def change(kind, fqdn, data=None):
+    return SimpleNamespace(type=SimpleNamespace(name=kind), document=Doc(fqdn, data or {}))
+
+
+def record(fqdn, ip="1.1.1.1", status="healthy"):
+    return {"fqdn": fqdn, "type": "single", "targets": [{"id": "t1", "ip": ip}],
+            "health": {"t1": {"status": status}}}
+
+
+@pytest.fixture
+def cache():
+    """Cache sincronizado con tres records, como tras el primer snapshot del listener."""
+    record_cache._needs_reset = True
+    docs = [Doc(f"r{i}.example", record(f"r{i}.example", f"1.1.1.{i}")) for i in range(3)]
+    record_cache._on_snapshot(docs, [], None)
+    yield record_cache
+    record_cache._synced = False
+    record_cache._needs_reset = True
+    record_cache._dirty.clear()
+
+
+def test_write_without_event_stops_blocking_the_feed(cache, monkeypatch):
+    monkeypatch.setattr(record_cache, "RECORD_CACHE_DIRTY_TIMEOUT_S", 0.05)
+    cache.invalidate("r1.example")
+    assert cache.feed_state() is None
+    assert cache.lookup("r1.example") == (False, None)
+    time.sleep(0.06)
+    # Sin evento (la escritura no cambio el documento) la marca vence
+    assert cache.feed_state() is not None
+    assert cache.lookup("r1.example")[0]
+    assert cache.all_records() is not None
+
+
+def test_event_clears_dirty_mark(cache):
+    cache.invalidate("r1.example")
+    cache._on_snapshot([], [change("MODIFIED", "r1.example", record("r1.example", "9.9.9.9"))], None)
+    assert cache.lookup("r1.example") == (True, record("r1.example", "9.9.9.9"))
+    assert cache.feed_state() is not None
+
+
+def test_rr_index_checkpoint_keeps_version_and_plan(cache):
+    from app import resolve_plan
+
+    before = cache.feed_state()
+    hit, current = cache.lookup("r1.example")
+    plan = resolve_plan.get_plan(current)
+    cache._on_snapshot([], [change("MODIFIED", "r1.example", dict(current, rr_index=7))], None)
+    assert cache.feed_state() == before
+    _, updated = cache.lookup("r1.example")
+    assert updated["rr_index"] == 7
+    assert resolve_plan.get_plan(updated) is plan
+    assert plan.rr_seed == 7
+
+
+def modify(fqdn, **kwargs):
+    record_cache._on_snapshot([], [change("MODIFIED", fqdn, record(fqdn, **kwargs))], None)
+
+
+def test_digest_matches_a_fresh_read_of_the_same_records(cache):
+    modify("r1.example", status="unhealthy")
+    records = cache.all_records()
+    assert cache.feed_state() == cache.digest_of(records)
+    assert cache.feed_state(("fqdn", "targets")) == cache.digest_of(records, ("fqdn", "targets"))
+    # El digest no depende del orden
+    assert cache.digest_of(list(reversed(records))) == cache.digest_of(records)
+
+
+def test_changes_since_returns_updates_and_deletions(cache):
+    version = cache.feed_state()
+    modify("r1.example", ip="9.9.9.9")
+    cache._on_snapshot([], [change("REMOVED", "r2.example")], None)
+    cache._on_snapshot([], [change("ADDED", "new.example", record("new.example"))], None)
+
+    current, full, records, deleted = cache.changes_since(version)
+    assert not full
+    assert current == cache.feed_state()
+    assert sorted(r["fqdn"] for r in records) == ["new.example", "r1.example"]
+    assert deleted == ["r2.example"]
+    assert cache.changes_since(current)[1:] == (False, [], [])
+
+
+def test_deleted_and_readded_record_is_an_update(cache):
+    version = cache.feed_state()
+    cache._on_snapshot([], [change("REMOVED", "r2.example")], None)
+    cache._on_snapshot([], [change("ADDED", "r2.example", record("r2.example", ip="8.8.8.8"))], None)
+    _, full, records, deleted = cache.changes_since(version)
+    assert not full and deleted == []
+    assert [r["targets"][0]["ip"] for r in records] == ["8.8.8.8"]
+
+
+def test_reverting_a_change_returns_to_the_same_version(cache):
+    version = cache.feed_state()
+    modify("r1.example", status="unhealthy")
+    assert cache.feed_state() != version
+    modify("r1.example", status="healthy")
+    assert cache.feed_state() == version
+    assert cache.changes_since(version)[1:] == (False, [], [])
+
+
+def test_projection_ignores_changes_outside_its_fields(cache):
+    fields = cache.normalize_fields(["targets", "fqdn"])
+    version = cache.feed_state(fields)
+    modify("r1.example", status="unhealthy")
+    assert cache.feed_state(fields) == version
+    assert cache.changes_since(version, fields)[1:] == (False, [], [])
+    modify("r0.example", ip="7.7.7.7")
+    _, full, records, _ = cache.changes_since(version, fields)
+    assert not full and [r["fqdn"] for r in records] == ["r0.example"]
+
+
+def test_unknown_version_and_trimmed_tombstones_resync(cache, monkeypatch):
+    assert cache.changes_since("0123456789abcdef")[1] is True
+    monkeypatch.setattr(record_cache, "RECORD_FEED_MAX_TOMBSTONES", 1)
+    version = cache.feed_state()
+    cache._on_snapshot([], [change("REMOVED", "r0.example")], None)
+    cache._on_snapshot([], [change("REMOVED", "r1.example")], None)
+    # Con 1 record vivo y 1 tombstone, los dos borrados siguen en el log
+    assert cache.changes_since(version)[1:] == (False, [], ["r1.example", "r0.example"])
+    recent = cache.feed_state()
+    cache._on_snapshot([], [change("REMOVED", "r2.example")], None)
+    # El tombstone de r0 se recorto: quien lo necesitaba recibe la coleccion completa
+    assert cache.changes_since(version)[1:] == (True, [], [])
+    assert cache.changes_since(recent)[1:] == (False, [], ["r2.example"])
+
+
+def test_resync_forgets_old_versions(cache):
+    version = cache.feed_state()
+    modify("r1.example", ip="9.9.9.9")
+    middle = cache.feed_state()
+    # Reconexion del listener: el snapshot siguiente reemplaza todo
+    record_cache._needs_reset = True
+    record_cache._on_snapshot([Doc("r0.example", record("r0.example", "1.1.1.0"))], [], None)
+    assert cache.changes_since(version)[1] is True
+    _, full, records, _ = cache.changes_since(middle)
+    assert full and [r["fqdn"] for r in records] == ["r0.example"]
+    assert cache.changes_since(cache.feed_state())[1:] == (False, [], [])
+
+
+def test_store_ignores_reads_older_than_a_listener_update(cache):
+    token = cache.read_token()
+    modify("r1.example", ip="9.9.9.9")
+    cache.store("r1.example", record("r1.example", ip="1.1.1.1"), token)
+    assert cache.lookup("r1.example")[1]["targets"][0]["ip"] == "9.9.9.9"
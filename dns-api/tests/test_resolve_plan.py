@@ -0,0 +1,102 @@
+import pytest
+
+from app import resolve_plan
+from app.resolve_plan import RecordPlan, get_plan
+
+
+def target(tid, ip, country=None, region=None, weight=1):
+    t = {"id": tid, "ip": ip, "weight": weight}
+    if country or region:
+        t["geo_location"] = {"country": country, "region": region}
+    return t
+
+
+def health(status="healthy", last_ms=None, by_region=None):
+    h = {"status": status}
+    if last_ms is not None or by_region is not None:
+        h["rtt"] = {"last_ms": last_ms if last_ms is not None else 999, "by_region": by_region or {}}
+    return h
+
+
+@pytest.fixture(autouse=True)
+def clean_plans():
+    resolve_plan.clear()
+    yield
+    resolve_plan.clear()
+
+
+def test_single_uses_only_the_first_target():
+    record = {"fqdn": "s.example", "type": "single",
+              "targets": [target("a", "1.1.1.1"), target("b", "2.2.2.2")],
+              "health": {"a": health("unhealthy"), "b": health()}}
+    plan = RecordPlan(record)
+    assert plan.single is None
+    assert [t.id for t in plan.healthy] == ["b"]
+    record["health"]["a"] = health()
+    assert RecordPlan(record).single.ip == "1.1.1.1"
+
+
+def test_healthy_keeps_record_order_and_skips_targets_without_health():
+    record = {"fqdn": "m.example", "type": "multi", "rr_index": 4,
+              "targets": [target("a", "1.1.1.1"), target("b", "2.2.2.2"), target("c", "3.3.3.3")],
+              "health": {"c": health(), "a": health()}}
+    plan = RecordPlan(record)
+    assert [t.id for t in plan.healthy] == ["a", "c"]
+    assert plan.rr_seed == 4
+
+
+def test_weight_builds_an_alias_table_over_healthy_targets():
+    record = {"fqdn": "w.example", "type": "weight",
+              "targets": [target("a", "1.1.1.1", weight=3), target("b", "2.2.2.2", weight=1),
+                          target("c", "3.3.3.3", weight=5)],
+              "health": {"a": health(), "b": health(), "c": health("unhealthy")}}
+    plan = RecordPlan(record)
+    assert {plan.alias.sample(lambda: k / 100).id for k in range(100)} == {"a", "b"}
+    assert RecordPlan(dict(record, health={})).alias is None
+
+
+def test_geo_picks_earliest_healthy_matching_country_or_region():
+    record = {"fqdn": "g.example", "type": "geo",
+              "targets": [target("us", "1.1.1.1", "US", "north-america"),
+                          target("down", "9.9.9.9", "AR", "south-america"),
+                          target("br", "2.2.2.2", "BR", "south-america"),
+                          target("ar", "3.3.3.3", "AR", "south-america")],
+              "health": {"us": health(), "down": health("unhealthy"), "br": health(), "ar": health()}}
+    plan = RecordPlan(record)
+    assert plan.geo_target("AR", "south-america").id == "br"   # br (region) esta antes que ar (pais)
+    assert plan.geo_target("US", "south-america").id == "us"
+    assert plan.geo_target("CL", "south-america").id == "br"
+    assert plan.geo_target("JP", "asia").id == "us"
+
+
+def test_roundtrip_picks_lowest_rtt_per_region_with_last_ms_fallback():
+    record = {"fqdn": "r.example", "type": "roundtrip",
+              "targets": [target("a", "1.1.1.1"), target("b", "2.2.2.2"), target("c", "3.3.3.3")],
+              "health": {"a": health(last_ms=50, by_region={"eu": 10, "us": 80}),
+                         "b": health(last_ms=20, by_region={"us": 30}),
+                         "c": health("unhealthy", last_ms=1, by_region={"eu": 1})}}
+    plan = RecordPlan(record)
+    assert plan.roundtrip_target("eu")[0].id == "a"
+    assert plan.roundtrip_target("us")[0].id == "b"
+    # Region sin mediciones: last_ms de cada target
+    assert plan.roundtrip_target("asia") == (plan.healthy[1], 20)
+
+
+def test_get_plan_recompiles_only_when_the_dict_changes():
+    record = {"fqdn": "m.example", "type": "multi", "targets": [target("a", "1.1.1.1")], "health": {"a": health()}}
+    plan = get_plan(record)
+    assert get_plan(record) is plan
+    changed = dict(record, health={"a": health("unhealthy")})
+    assert get_plan(changed) is not plan
+    assert get_plan(changed).healthy == ()
+
+
+def test_forget_drops_plans():
+    a = {"fqdn": "a.example", "type": "multi", "targets": [], "health": {}}
+    b = {"fqdn": "b.example", "type": "multi", "targets": [], "health": {}}
+    get_plan(a)
+    get_plan(b)
+    resolve_plan.forget("a.example")
+    assert set(resolve_plan._plans) == {"b.example"}
+    resolve_plan.forget()
+    assert not resolve_plan._plans
@@ -1,6 +1,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <strings.h>
 #include <unistd.h>
 #include <time.h>
 #include "regions.h"
@@ -60,6 +61,26 @@ static size_t curl_write_cb(void *data, size_t size, size_t nmemb, void *userp)
 }
 
 
+// Captura el header ETag de la respuesta (userp: char** a liberar por el llamador)
+static size_t curl_header_cb(char *buffer, size_t size, size_t nitems, void *userp)
+{
+    size_t len = size * nitems;
+    char **etag = (char **)userp;
+    if (len > 5 && strncasecmp(buffer, "ETag:", 5) == 0) {
+        const char *v = buffer + 5;
+        size_t n = len - 5;
+        while (n > 0 && (*v == ' ' || *v == '\t')) { v++; n--; }
+        while (n > 0 && (v[n - 1] == '\r' || v[n - 1] == '\n' || v[n - 1] == ' ')) n--;
+        free(*etag);
+        *etag = strndup(v, n);
+    }
+    return len;
+}
+
+// Ultima respuesta de /api/records y su ETag: con 304 se vuelve a parsear sin descargarla
+static char *g_records_etag = NULL;
+static char *g_records_body = NULL;
+
 static int parse_targets_from_json(const char *json_str, target_t **out_targets)
 {
     json_error_t error;
@@ -188,26 +209,54 @@ static int fetch_targets_from_api(target_t **out_targets)
     CURL *curl = NULL;
     CURLcode res;
     struct curl_memory mem = {0};
+    struct curl_slist *headers = NULL;
+    char *etag = NULL;
+    long http_code = 0;
     int parsed = 0;
 
     curl_global_init(CURL_GLOBAL_DEFAULT);
     curl = curl_easy_init();
     if (!curl) return 0;
 
-    const char *url = "http://dns-api:8080/api/records";
+    // Solo fqdn y targets (sin health); If-None-Match evita bajar la coleccion si no cambio
+    const char *url = "http://dns-api:8080/api/records?fields=fqdn,targets";
     curl_easy_setopt(curl, CURLOPT_URL, url);
     curl_easy_setopt(curl, CURLOPT_WRITEFUNCTION, curl_write_cb);
     curl_easy_setopt(curl, CURLOPT_WRITEDATA, &mem);
+    curl_easy_setopt(curl, CURLOPT_HEADERFUNCTION, curl_header_cb);
+    curl_easy_setopt(curl, CURLOPT_HEADERDATA, &etag);
     curl_easy_setopt(curl, CURLOPT_TIMEOUT_MS, 3000L);
+    if (g_records_etag && g_records_body) {
+        char inm[256];
+        snprintf(inm, sizeof(inm), "If-None-Match: %s", g_records_etag);
+        headers = curl_slist_append(headers, inm);
+        curl_easy_setopt(curl, CURLOPT_HTTPHEADER, headers);
+    }
 
     res = curl_easy_perform(curl);
-    if (res == CURLE_OK && mem.response && mem.size > 0) {
+    if (res == CURLE_OK)
+        curl_easy_getinfo(curl, CURLINFO_RESPONSE_CODE, &http_code);
+    if (res == CURLE_OK && http_code == 304 && g_records_body) {
+        parsed = parse_targets_from_json(g_records_body, out_targets);
+    } else if (res == CURLE_OK && mem.response && mem.size > 0) {
         parsed = parse_targets_from_json(mem.response, out_targets);
+        free(g_records_body);
+        free(g_records_etag);
+        g_records_body = NULL;
+        g_records_etag = NULL;
+        if (parsed > 0 && etag) {
+            g_records_body = mem.response;
+            g_records_etag = etag;
+            mem.response = NULL;
+            etag = NULL;
+        }
     } else {
         fprintf(stderr, "[HealthChecker] Failed to fetch records from API: %s\n", curl_easy_strerror(res));
     }
 
     if (mem.response) free(mem.response);
+    free(etag);
+    curl_slist_free_all(headers);
     curl_easy_cleanup(curl);
     curl_global_cleanup();
     return parsed;